@@ -1,7 +1,9 @@
 import openai
 import streamlit as st
-from langchain.llms import OpenAI
-from langchain.llms import DeepInfra
+from utils.clients import registry
+from utils.clients import get_openai_llm
+from utils.clients import get_deepinfra_llm
+from utils.streaming import stream_response
 
 st.set_page_config(
     page_title="Learn LangChain ! Large Language Models",
@@ -49,11 +51,12 @@ with st.form("openai_llm"):
 
     if execute:
 
-        llm = OpenAI(openai_api_key=openai_key, temperature=0.5)
+        llm = get_openai_llm(openai_key, temperature=0.5)
 
-        response = llm(prompt)
+        # tokens are shown as soon as the provider sends them
+        response, renderer = stream_response(llm, prompt, st.empty(), render="code")
 
-        st.code(response)
+        st.caption(renderer.caption())
 
 st.write('''
 While it may seem trivial to abstract a simple API call to OpenAI GPT model, this
@@ -98,11 +101,11 @@ with st.form("deepinfra_llm"):
 
         with st.spinner('Processing your request...'):
 
-            llm = DeepInfra(deepinfra_api_token=deepinfra_token, model_id=model_id)
+            llm = get_deepinfra_llm(deepinfra_token, model_id)
 
-            response = llm(prompt)        
+            response, renderer = stream_response(llm, prompt, st.empty(), render="code")
 
-            st.code(response)
+            st.caption(renderer.caption())
 
 st.write('''
 Take some time to play with prompts and observe how different LLMs provide us so
@@ -110,6 +113,23 @@ different responses. This is why is very important to choose the right model bas
 on our specific needs.
 ''')
 
+st.info('''
+Notice that we don't create a new LLM object on every execution: clients are kept in a shared
+registry (keyed by provider, model, API key and temperature) so they can reuse their open
+connections, and idle ones are dropped after a while. Deterministic calls (temperature 0, like the
+extraction in the Prompts and Parsers section) also go through a response cache on disk, so the same
+prompt is only sent to the provider once. Calls with a higher temperature, like the ones above, are
+never cached, since we expect a different answer every time.
+''', icon="ℹ️")
+
+st.info('''
+Responses are also streamed: instead of `llm(prompt)`, which returns only when the whole
+completion is ready, `llm.stream(prompt)` yields the tokens as the model generates them, so
+the first words show up almost immediately. The final text is exactly the same.
+''', icon="ℹ️")
+
+st.caption('Client registry: {hits} hits, {misses} misses, {clients} clients alive'.format(**registry.stats()))
+
 st.subheader('LLMs vs ChatModels')
 
 st.write('''
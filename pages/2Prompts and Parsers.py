@@ -1,9 +1,14 @@
 import openai
 import streamlit as st
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
+from utils.clients import get_chat_openai
 from langchain.output_parsers import ResponseSchema
-from langchain.output_parsers import StructuredOutputParser
+from langchain.schema import OutputParserException
+from utils.prompts import compile_template
+from utils.prompts import get_format_instructions
+from utils.structured import stream_structured
+from utils.batch import get_token_bucket
+from utils.classify import BulkClassifier
+from utils.loaders import UploadedCSVLoader
 
 st.set_page_config(
     page_title="Learn LangChain | Prompts and Parsers",
@@ -57,7 +62,8 @@ with st.form("prompt_templates"):
 	Please reply only with the name, no comments attached.
 	"""
 
-    prompt_template = ChatPromptTemplate.from_template(template)
+    # parsed once per process, Streamlit reruns reuse the compiled template
+    prompt_template = compile_template(template)
 
     name_type = st.selectbox(
     	'Name type',
@@ -70,7 +76,7 @@ with st.form("prompt_templates"):
 
     if execute:
 
-        chat = ChatOpenAI(temperature=0.9, openai_api_key=openai_key)
+        chat = get_chat_openai(openai_key, temperature=0.9)
 
         format_template = prompt_template.format_messages(adjective=name_type, product=business_type)
 
@@ -158,9 +164,8 @@ keywords = ResponseSchema(name="keywords", description="Extract any adjective to
 
 response_schemas = [satisfied, keywords]
 
-output_parser = StructuredOutputParser.from_response_schemas(response_schemas)
-
-format_instructions = output_parser.get_format_instructions()
+# built once per schema, not on every rerun
+format_instructions = get_format_instructions(response_schemas)
 
 with st.form("output_parsers"):
 
@@ -184,7 +189,8 @@ with st.form("output_parsers"):
     {format_instructions}
     """
 
-    prompt_template = ChatPromptTemplate.from_template(template=review_template)
+    # the format instructions never change, so they are rendered into the compiled template
+    prompt_template = compile_template(review_template).partial(format_instructions=format_instructions)
 
     review_text = st.text_area("Customer review")
 
@@ -192,15 +198,91 @@ with st.form("output_parsers"):
 
     if execute:
 
-        chat = ChatOpenAI(temperature=0, openai_api_key=openai_key)
+        chat = get_chat_openai(openai_key, temperature=0)
 
-        format_template = prompt_template.format_messages(text=review_text, format_instructions=format_instructions)
+        format_template = prompt_template.format_messages(text=review_text)
 
-        response = chat(format_template)
+        output_dict = {}
+
+        output = st.empty()
+
+        # fields show up as soon as their value is complete, malformed answers stop the generation
+        try:
+            for key, value in stream_structured(chat, format_template, [schema.name for schema in response_schemas]):
+                output_dict[key] = value
+                output.json(output_dict)
+        except OutputParserException as error:
+            st.error(error)
+
+st.info('''
+Streamlit runs the whole page again on every interaction, so in this demo the templates are parsed only
+once: compile_template() splits them into fixed text and variables, and formatting a prompt is then just
+joining the pieces. The format instructions are also built once per schema and baked into the template.
+''', icon="ℹ️")
+
+st.subheader('Classifying reviews in bulk')
+
+st.write('''
+With an export of thousands of reviews, one call per review means sending the same instructions over and
+over, and paying for them every time. Instead, we can pack as many reviews as fit in a token budget into a
+single prompt, each with its number, and ask for a JSON list with one object per review. The objects are
+mapped back to their review by that number, and only the reviews missing or malformed in the answer are
+sent again on their own, with the single-review prompt above.
+''')
+
+st.code('''
+classifier = BulkClassifier(chat, response_schemas, max_prompt_tokens=3000, max_batch_size=50)
+
+results = classifier.classify(reviews)  # one dict per review, in order
+
+classifier.summary()  # calls, tokens, cost per review, reviews per second
+''')
+
+with st.form("bulk_output_parsers"):
+
+    reviews_file = st.file_uploader("Upload a CSV file of reviews", type=["csv"])
+
+    review_column = st.text_input("Review column", value="review")
+
+    max_prompt_tokens = st.slider("Max tokens per prompt", 500, 8000, 3000, step=500)
+
+    max_batch_size = st.slider("Max reviews per prompt (1 to classify them one by one)", 1, 100, 50)
+
+    rate = st.number_input("Max requests per second for this API key", min_value=0.1, value=3.0)
+
+    execute = st.form_submit_button("🚀 Execute")
+
+    if execute and reviews_file is not None:
+
+        chat = get_chat_openai(openai_key, temperature=0)
+
+        classifier = BulkClassifier(
+            chat,
+            response_schemas,
+            max_prompt_tokens=max_prompt_tokens,
+            max_batch_size=max_batch_size,
+            bucket=get_token_bucket(openai_key, rate),
+        )
+
+        # rows are read and classified 1000 at a time, so the whole export never sits in a prompt queue
+        loader = UploadedCSVLoader(reviews_file, content_columns=[review_column], metadata_columns=[review_column])
+
+        rows = []
+
+        table = st.empty()
+
+        for documents in loader.lazy_load_chunks():
+
+            reviews = [document.metadata[review_column] or '' for document in documents]
+
+            for review, result in zip(reviews, classifier.classify(reviews)):
+                rows.append({'review': review, **(result or {'satisfied': '⚠️ failed', 'keywords': None})})
 
-        output_dict = output_parser.parse(response.content)
+            table.dataframe(rows)
 
-        st.json(output_dict)
+        st.caption('{reviews} reviews in {bulk_calls} bulk and {single_calls} single calls, {failed} failed · '
+                   '{prompt_tokens} prompt and {completion_tokens} completion tokens · '
+                   '${cost_per_review:.5f} per review · {reviews_per_second:.1f} reviews/s'.format(**classifier.summary()))
 
 st.divider()
 
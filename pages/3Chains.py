@@ -1,9 +1,13 @@
 import openai
 import streamlit as st
 from langchain.chains import LLMChain
-from langchain.chat_models import ChatOpenAI
+from utils.clients import get_chat_openai
 from langchain.prompts import ChatPromptTemplate
 from langchain.chains import SequentialChain
+from utils.batch import BatchRunner
+from utils.batch import get_token_bucket
+from utils.pipeline import PipelineRunner
+from utils.graph import ChainGraph
 
 st.set_page_config(
     page_title="Learn LangChain | Chains",
@@ -54,7 +58,7 @@ with st.form("basic_chain"):
 
     	with st.spinner('Processing your request...'):
 
-	        llm = ChatOpenAI(openai_api_key=openai_key, temperature=0.9)
+	        llm = get_chat_openai(openai_key, temperature=0.9)
 
 	        prompt = ChatPromptTemplate.from_template('''
 	        I want you to act as a movie creative. Can you come up with an alternative name for the movie {movie}?\
@@ -73,6 +77,62 @@ This basic Chain is not very different from the Prompt Template approach, but le
 some more complex example where we can explore the adavntages and the simplicity that chains bring us.
 ''')
 
+st.subheader('Running a Chain over many inputs')
+
+st.write('''
+When we have hundreds or thousands of inputs, calling `chain.run()` in a loop means waiting for each
+answer before sending the next request. Since LLM calls mostly wait on the network, we can send many of
+them at the same time with `ainvoke()` and asyncio, as long as we respect the API rate limits: here the
+requests go through a token bucket shared by everyone using the same API key, and the calls rejected
+with a 429 (rate limit) error are retried after a randomized, exponentially growing delay.
+''')
+
+st.code('''
+runner = BatchRunner(chain, max_concurrency=8, bucket=get_token_bucket(openai_key, rate=3))
+
+# results are streamed as (index, output, error) tuples
+for index, response, error in runner.stream(movies, ordered=True):
+    print(movies[index], response or error)
+''')
+
+with st.form("batch_chain"):
+
+    movies = st.text_area("Movies (one per line)", placeholder="The Green Mile\nThe Godfather\nPulp Fiction")
+
+    max_concurrency = st.slider("Concurrent requests", 1, 32, 8)
+
+    rate = st.number_input("Max requests per second for this API key", min_value=0.1, value=3.0)
+
+    ordered = st.toggle("Show results in input order (otherwise as soon as they are ready)", value=True)
+
+    execute = st.form_submit_button("🚀 Execute")
+
+    if execute:
+
+        llm = get_chat_openai(openai_key, temperature=0.9)
+
+        prompt = ChatPromptTemplate.from_template('''
+        I want you to act as a movie creative. Can you come up with an alternative name for the movie {movie}?\
+        The name should honor the film story as it is. Please limit your answer to the name only.\
+        If you don't know the movie, answer: "I don't know this movie"
+        ''')
+
+        chain = LLMChain(llm=llm, prompt=prompt)
+
+        runner = BatchRunner(chain, max_concurrency=max_concurrency, bucket=get_token_bucket(openai_key, rate))
+
+        movies = [movie.strip() for movie in movies.splitlines() if movie.strip()]
+
+        rows = []
+
+        table = st.empty()
+
+        for index, response, error in runner.stream(movies, ordered=ordered):
+            rows.append({'movie': movies[index], 'response': response if error is None else f'⚠️ {error}'})
+            table.dataframe(rows)
+
+        st.caption('{completed} completed, {failed} failed, {retries} retries after rate limiting'.format(**runner.stats))
+
 st.subheader('Sequential Chain')
 
 st.write('''
@@ -121,7 +181,7 @@ with st.form("sequential_chain"):
 
     	with st.spinner('Processing your request...'):
 
-	        llm = ChatOpenAI(openai_api_key=openai_key, temperature=0.9)
+	        llm = get_chat_openai(openai_key, temperature=0.9)
 
 	        first_prompt = ChatPromptTemplate.from_template('''
 	        I want you to act as a movie creative. Can you come up with an alternative name for the movie {movie}?\
@@ -148,6 +208,75 @@ with st.form("sequential_chain"):
 
 	        st.json(response)
 
+st.write('''
+With many inputs, a Sequential Chain can also run as a pipeline: each chain becomes a stage with its
+own workers and a small queue in front of it, and an input enters the second stage as soon as its
+title is ready, while the other inputs are still waiting for theirs. Stages that are slower (longer
+answers) can get more workers, and a full queue pauses the stage before it.
+''')
+
+st.code('''
+pipeline = PipelineRunner(sequential_chain, max_concurrency=[4, 8], queue_size=16)
+
+for index, values, error in pipeline.stream(movies):
+    print(values["movie_title"], values["trailer"])
+
+print(pipeline.report())
+''')
+
+with st.form("pipelined_chain"):
+
+    movies = st.text_area("Movies (one per line)", placeholder="The Green Mile\nThe Godfather\nPulp Fiction")
+
+    title_workers = st.slider("Workers for the title stage", 1, 16, 4)
+
+    trailer_workers = st.slider("Workers for the trailer stage", 1, 16, 8)
+
+    execute = st.form_submit_button("🚀 Execute")
+
+    if execute:
+
+        llm = get_chat_openai(openai_key, temperature=0.9)
+
+        first_prompt = ChatPromptTemplate.from_template('''
+        I want you to act as a movie creative. Can you come up with an alternative name for the movie {movie}?\
+        The name should honor the film story as it is. Please limit your answer to the name only.\
+        If you don't know the movie, answer: "I don't know this movie"
+        ''')
+
+        first_chain = LLMChain(llm=llm, prompt=first_prompt, output_key="movie_title")
+
+        second_prompt = ChatPromptTemplate.from_template('''
+        Can you write a short advertisement of this new movie including his title {movie_title}?\
+        Please limit it to 20 wprds and return only the advertisement copy.
+        ''')
+
+        second_chain = LLMChain(llm=llm, prompt=second_prompt, output_key="trailer")
+
+        sequential_chain = SequentialChain(
+            chains=[first_chain, second_chain],
+            input_variables=["movie"],
+            output_variables=["movie_title", "trailer"]
+        )
+
+        pipeline = PipelineRunner(sequential_chain, max_concurrency=[title_workers, trailer_workers])
+
+        movies = [movie.strip() for movie in movies.splitlines() if movie.strip()]
+
+        rows = []
+
+        table = st.empty()
+
+        for index, values, error in pipeline.stream(movies):
+            rows.append({**values, 'error': error and str(error)})
+            table.dataframe(rows)
+
+        report = pipeline.report()
+
+        st.caption(f"{report['completed']} inputs in {report['elapsed']:.2f}s ({report['throughput']:.2f} inputs/s)")
+
+        st.dataframe(report['stages'])
+
 st.info("Couldn't we just ask for the title and the description in the first chain?", icon="❓")
 
 st.write('''
@@ -157,6 +286,68 @@ We could, but implementing it in steps offer several advantages:
 - more flexibility if we want dynamically assign new steps to different chains (Router Chain)
 ''')
 
+st.subheader('Chain Graph')
+
+st.write('''
+A Sequential Chain always runs its chains one after the other, even when a chain only needs the
+original input. If we look at the input variables and output keys, we can see which chain really
+depends on which: chains that don't depend on each other can run at the same time, and the total
+time becomes the one of the slowest path through the graph (the critical path).
+''')
+
+st.code('''
+title_chain = LLMChain(llm=llm, prompt=title_prompt, output_key="movie_title")    # needs {movie}
+plot_chain = LLMChain(llm=llm, prompt=plot_prompt, output_key="plot")             # needs {movie}
+trailer_chain = LLMChain(llm=llm, prompt=trailer_prompt, output_key="trailer")    # needs {movie_title} and {plot}
+
+graph = ChainGraph([title_chain, plot_chain, trailer_chain], input_variables=["movie"])
+
+# movie_title and plot run concurrently, trailer starts when both are ready
+response = graph.invoke(movie)
+''')
+
+with st.form("chain_graph"):
+
+    movie = st.text_input("Movie", placeholder="The Green Mile")
+
+    execute = st.form_submit_button("🚀 Execute")
+
+    if execute:
+
+        with st.spinner('Processing your request...'):
+
+            llm = get_chat_openai(openai_key, temperature=0.9)
+
+            title_prompt = ChatPromptTemplate.from_template('''
+            I want you to act as a movie creative. Can you come up with an alternative name for the movie {movie}?\
+            The name should honor the film story as it is. Please limit your answer to the name only.
+            ''')
+
+            plot_prompt = ChatPromptTemplate.from_template('''
+            Summarize the plot of the movie {movie} in one sentence, without mentioning its title.
+            ''')
+
+            trailer_prompt = ChatPromptTemplate.from_template('''
+            Can you write a short advertisement of this new movie including his title {movie_title}?\
+            This is the plot: {plot}. Please limit it to 20 words and return only the advertisement copy.
+            ''')
+
+            graph = ChainGraph([
+                LLMChain(llm=llm, prompt=title_prompt, output_key="movie_title"),
+                LLMChain(llm=llm, prompt=plot_prompt, output_key="plot"),
+                LLMChain(llm=llm, prompt=trailer_prompt, output_key="trailer"),
+            ], input_variables=["movie"])
+
+            response = graph.invoke(movie)
+
+            st.json(response)
+
+            path, total = graph.critical_path()
+
+            st.caption(f"Critical path: {' → '.join(path)} ({total:.2f}s)")
+
+            st.dataframe(list(graph.timings.values()))
+
 st.subheader('To keep in mind:')
 
 st.write('''
@@ -1,6 +1,7 @@
 import openai
 import streamlit as st
-from langchain.embeddings import OpenAIEmbeddings
+from utils.clients import get_openai_embeddings
+from utils.vectorstore import NumpyVectorStore
 
 st.set_page_config(
     page_title="Learn LangChain | Embeddings and Vector Stores",
@@ -37,18 +38,26 @@ with st.form("embedding"):
 
     if execute:
 
-        embeddings_model = OpenAIEmbeddings(openai_api_key=openai_key)
+        embeddings_model = get_openai_embeddings(openai_key)
 
         response = embeddings_model.embed_query(text)
 
         st.json(response)
 
+        st.caption('Embedding cache: {hits} hits, {misses} misses, {vectors} vectors stored, {batches} provider batches'.format(**embeddings_model.stats()))
+
 st.write('''
 In the previous example, we converted a single piece of text into am embedding, but remember that
 LLMs are able to interact with almost any kind of content, as long as we are able to convert it 
 into an embedding. We can work with images, videos, PDFs and even 3rd party proprietary formats.
 ''')
 
+st.info('''
+Embeddings are deterministic for a given model, so there's no reason to pay twice for the same text.
+In this demo, vectors are stored on disk keyed by a hash of the text, and queries arriving at the same
+time from different users are grouped into a single `embed_documents` call.
+''', icon="ℹ️")
+
 st.subheader('Vector stores')
 
 st.write('''
@@ -59,6 +68,43 @@ indexes (eg: DocArrayInMemorySearch). Vector databases are ofter referred as "lo
 for Artificial Intelligence, because of course the data stored is persistent.
 ''')
 
+st.write('''
+To see what an in-memory vector store does under the hood, we can use a tiny one built on NumPy:
+all the embeddings live in a single matrix, and a similarity search is just a matrix product
+followed by a partial sort to pick the top k results. For large collections, `build_index()`
+clusters the vectors so each query only compares against the most promising clusters.
+''')
+
+st.code('''
+from utils.vectorstore import NumpyVectorStore
+
+vectorstore = NumpyVectorStore.from_texts(sentences, embeddings_model)
+
+docs = vectorstore.similarity_search_with_score(query, k=2)
+
+# persist it and load it back later
+vectorstore.save('my-vectorstore')
+vectorstore = NumpyVectorStore.load('my-vectorstore', embeddings_model)
+''')
+
+with st.form("vectorstore"):
+
+    sentences = st.text_area("Sentences to store, one per line", placeholder="I love pizza\nThe sky is blue\nPython is a programming language")
+
+    query = st.text_input("Search query", placeholder="What's the color of the sky?")
+
+    execute = st.form_submit_button("🔍 Search")
+
+    if execute:
+
+        embeddings_model = get_openai_embeddings(openai_key)
+
+        vectorstore = NumpyVectorStore.from_texts([line for line in sentences.splitlines() if line.strip()], embeddings_model)
+
+        docs = vectorstore.similarity_search_with_score(query, k=2)
+
+        st.write(docs)
+
 st.write('''
 In the "Hands-on Projects" section, we will see some sample application which makes good use of
 embeddings, document loaders and vector stores.
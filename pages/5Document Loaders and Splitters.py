@@ -1,20 +1,50 @@
-import os
+import re
+import time
+import uuid
 import openai
-import tempfile
+import zipfile
 import streamlit as st
 from langchain.text_splitter import Language
-from langchain.document_loaders import CSVLoader
-from langchain.document_loaders import TextLoader
-from langchain.document_loaders import PyPDFLoader
 from langchain.document_loaders import WebBaseLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+from utils.loaders import ParallelPDFLoader
+from utils.loaders import UploadedPDFLoader
+from utils.loaders import UploadedCSVLoader
+from utils.loaders import UploadedTextLoader
+from utils.viewer import document_viewer
+from utils.repository import ZipRepositoryLoader
+from utils.web import ConcurrentWebLoader
+from utils.manifest import IngestionManifest
+from utils.clients import get_openai_embeddings
+from utils.vectorstore import NumpyVectorStore
+from utils.splitters import SpanTextSplitter
+from utils.splitters import TokenBudgetSplitter
 
 st.set_page_config(
     page_title="Learn LangChain | Document Loaders and Text Splitters",
     page_icon="✂️"
 )
 
+
+@st.cache_data(max_entries=100)
+def split_spans(text, separators, recursive, chunk_size, chunk_overlap):
+    text_splitter = SpanTextSplitter(separators, recursive=recursive, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return text_splitter.split_spans(text)
+
+@st.cache_data(max_entries=100)
+def split_token_spans(text, chunk_size, chunk_overlap):
+    text_splitter = TokenBudgetSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return text_splitter.split_spans(text)
+
+@st.cache_data(max_entries=100)
+def csv_columns(file_id, _file):
+    # the header is read once per upload, not on every rerun
+    return UploadedCSVLoader(_file).columns()
+
+@st.cache_resource(max_entries=100)
+def get_manifest(path):
+    return IngestionManifest(path)
+
 st.header('✂️ Document Loaders and Text Splitters')
 
 st.write('''
@@ -60,50 +90,52 @@ sample_txt_file = st.file_uploader("Upload a TXT file", type=["txt"])
 
 if sample_txt_file is not None:
 
-    with tempfile.NamedTemporaryFile(delete=False) as temporary_file:
-
-        temporary_file.write(sample_txt_file.read())
-
-    loader = TextLoader(temporary_file.name)
+    # read straight from the upload buffer, no temporary file needed
+    loader = UploadedTextLoader(sample_txt_file)
 
     st.write(loader.load())
 
-    # clean-up the temporary file
-    os.remove(temporary_file.name)
-
 st.subheader('CSVLoader')
 
 sample_csv_file = st.file_uploader("Upload a CSV file", type=["csv"])
 
 if sample_csv_file is not None:
 
-    with tempfile.NamedTemporaryFile(delete=False) as temporary_file:
+    columns = csv_columns(sample_csv_file.file_id, sample_csv_file)
 
-        temporary_file.write(sample_csv_file.read())
+    metadata_columns = st.multiselect("Columns to store as metadata", columns)
 
-    loader = CSVLoader(temporary_file.name)
+    content_columns = st.multiselect("Columns to use as content (all the others if empty)", columns)
 
-    st.write(loader.load())
+    # read straight from the upload buffer, no temporary file needed
+    loader = UploadedCSVLoader(
+        sample_csv_file,
+        content_columns=content_columns,
+        metadata_columns=metadata_columns,
+    )
 
-    # clean-up the temporary file
-    os.remove(temporary_file.name)
+    # documents are pulled from loader.lazy_load() one page at a time
+    document_viewer("csv_documents", loader, (sample_csv_file.file_id, tuple(content_columns), tuple(metadata_columns)))
 
 st.subheader('PyPDFLoader')
 
 sample_pdf_file = st.file_uploader("Upload a PDF file", type=["pdf"])
 
+parallel_pdf = st.toggle("Extract all pages up front, in parallel (faster for PDFs with hundreds of pages)")
+
 if sample_pdf_file is not None:
 
-    with tempfile.NamedTemporaryFile(delete=False) as temporary_file:
+    # read straight from the upload buffer, no temporary file needed
+    if parallel_pdf:
 
-        temporary_file.write(sample_pdf_file.read())
+        loader = ParallelPDFLoader(sample_pdf_file)
 
-    loader = PyPDFLoader(temporary_file.name)
+    else:
 
-    st.write(loader.load())
+        loader = UploadedPDFLoader(sample_pdf_file)
 
-    # clean-up the temporary file
-    os.remove(temporary_file.name)
+    # documents are pulled from loader.lazy_load() one page at a time
+    document_viewer("pdf_documents", loader, (sample_pdf_file.file_id, parallel_pdf))
 
 st.write('''
 If you tried to load all the different file formats, you may have noticed that the LangChain
@@ -150,6 +182,15 @@ most basic one:
 
 st.subheader('CharacterTextSplitter')
 
+st.info('''
+The demos below use a splitter that scans the text once, records where each separator is, and
+works on (start, end) offsets until the chunks are actually needed. The RecursiveCharacterTextSplitter
+demo gives the same chunks as LangChain, the CharacterTextSplitter one too unless the separator repeats
+(eg. two spaces in a row): LangChain collapses the run into one separator, while here it's kept as it
+is in the text, so chunks can end at different places. Results are also cached, so submitting the same
+text twice doesn't split it again.
+''', icon="ℹ️")
+
 st.code('''
 from langchain.text_splitter import CharacterTextSplitter
 
@@ -173,14 +214,9 @@ with st.form("char_textsplitter"):
 
     if execute:
 
-        text_splitter = CharacterTextSplitter(
-            separator = ' ',
-            chunk_size=50,
-            chunk_overlap=5,
-            length_function=len,
-        )
+        spans = split_spans(text, [' '], recursive=False, chunk_size=50, chunk_overlap=5)
 
-        splits = text_splitter.split_text(text)
+        splits = [text[start:end] for start, end in spans]
 
         st.write(splits)
 
@@ -215,14 +251,49 @@ with st.form("recursive_textsplitter"):
 
     if execute:
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            separators=["\n\n", "\n", " ", ""],
-            chunk_size=100,
-            chunk_overlap=20,
-            length_function=len,
-        )
+        spans = split_spans(text, ["\n\n", "\n", " ", ""], recursive=True, chunk_size=100, chunk_overlap=20)
+
+        docs = [Document(page_content=text[start:end]) for start, end in spans]
+
+        st.write(docs)
+
+st.subheader('Split by tokens')
+
+st.write('''
+LLMs context windows are measured in tokens, not characters, so we can ask the splitter to measure
+chunks with the same tokenizer used by the model (tiktoken for OpenAI models). This way every chunk
+is guaranteed to fit the token budget we have in mind, prompt included.
+''')
+
+st.code('''
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# chunk size/overlap are now counted in tokens
+text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+    encoding_name="cl100k_base",
+    chunk_size=50,
+    chunk_overlap=10,
+)
+
+docs = text_splitter.create_documents([text])
+''')
+
+st.info('''
+from_tiktoken_encoder() tokenizes every candidate chunk again while merging. Here each piece of
+text is tokenized once and chunks are packed summing the cached counts, with the same result.
+''', icon="ℹ️")
+
+with st.form("token_textsplitter"):
+
+    text = st.text_area("Insert some text")
+
+    execute = st.form_submit_button("✂️ Split")
+
+    if execute:
+
+        spans = split_token_spans(text, chunk_size=50, chunk_overlap=10)
 
-        docs = text_splitter.create_documents([text])
+        docs = [Document(page_content=text[start:end]) for start, end in spans]
 
         st.write(docs)
 
@@ -257,6 +328,46 @@ php_splitter = RecursiveCharacterTextSplitter.from_language(
 docs = php_splitter.create_documents([sample_php_code])
 ''')
 
+st.write('''
+The same idea scales to a whole code repository: every file is split with the separators of its
+language (picked by file extension), and the files are shared across worker processes. Each
+document keeps the file path and the line range it comes from, ready to be embedded.
+''')
+
+with st.form("repository_splitter"):
+
+    repository_file = st.file_uploader("Upload a zipped repository", type=["zip"])
+
+    execute = st.form_submit_button("✂️ Split Repository")
+
+    if execute and repository_file is not None:
+
+        # the archive is extracted into a temporary directory, never a path chosen by the user
+        repository_loader = ZipRepositoryLoader(repository_file, chunk_size=1000)
+
+        preview = []
+
+        count = 0
+
+        started = time.perf_counter()
+
+        try:
+            for doc in repository_loader.lazy_load():
+                if len(preview) < 20:
+                    preview.append(doc)
+                count += 1
+        except (ValueError, zipfile.BadZipFile) as error:
+            st.error(error)
+        else:
+            st.caption(f"{count} documents in {time.perf_counter() - started:.2f}s")
+
+            st.dataframe([
+                {'language': language, **report, 'MB/s per worker': report['bytes'] / 1e6 / max(report['seconds'], 1e-9)}
+                for language, report in sorted(repository_loader.report.items())
+            ])
+
+            st.write(preview)
+
 st.subheader('Load and Split')
 
 st.write('''
@@ -287,6 +398,109 @@ with st.form("load_and_split"):
 
         st.write(docs)
 
+st.write('''
+To ingest many pages at once, we can fetch them concurrently instead of one after the other: a
+bounded number of requests are kept in flight over keep-alive connections, pages are parsed in a
+thread pool, and already seen pages are revalidated (ETag/Last-Modified) instead of downloaded again.
+''')
+
+with st.form("batch_load_and_split"):
+
+    urls = st.text_area("Insert one URL per line", placeholder="https://francescocarlucci.com/blog/thoughts-on-artificial-intelligence")
+
+    execute = st.form_submit_button("✂️ Load and Split All")
+
+    if execute:
+
+        web_loader = ConcurrentWebLoader([url.strip() for url in urls.splitlines() if url.strip()])
+
+        docs = web_loader.load_and_split()
+
+        st.caption(
+            f"{len(docs)} documents · {web_loader.stats['fetched']} pages downloaded · "
+            f"{web_loader.stats['not_modified']} not modified · {web_loader.stats['elapsed']:.2f}s"
+        )
+
+        for url, error in web_loader.errors.items():
+            st.warning(f"{url}: {error}")
+
+        st.write(docs)
+
+st.subheader('Incremental Ingestion')
+
+st.write('''
+Loading, splitting and embedding a big file takes time (and embeddings cost money), so when we upload
+a new version of a file we don't want to redo everything. Here every page/row is fingerprinted with a
+hash of its content: on re-upload only the changed ones are split again, and only the chunks that
+actually changed are embedded and replaced in the vectorstore. Rows are matched by their content (or
+by an id column), not by their number, so inserting a row doesn't make all the following ones "changed".
+''')
+
+with st.form("incremental_ingestion"):
+
+    ingestion_file = st.file_uploader("Upload a PDF or CSV file", type=["pdf", "csv"])
+
+    id_column = st.text_input("CSV id column (optional, rows are matched by content otherwise)")
+
+    openai_key = st.text_input("OpenAI Api Key (optional, to embed the chunks)")
+
+    execute = st.form_submit_button("🔁 Ingest")
+
+    if execute and ingestion_file is not None:
+
+        if ingestion_file.name.lower().endswith(".pdf"):
+
+            loader = UploadedPDFLoader(ingestion_file)
+
+        else:
+
+            loader = UploadedCSVLoader(ingestion_file, metadata_columns=[id_column] if id_column else ())
+
+        text_splitter = SpanTextSplitter(chunk_size=1000, chunk_overlap=100)
+
+        # each session gets its own manifest and vectorstore, so the file name only has to be unique within
+        # the session (re-uploading it there is a new version) and other users can't clobber it
+        # (the id ends up in a path, so anything that isn't one of our own uuids is replaced)
+        if not re.fullmatch("[0-9a-f]{32}", st.query_params.get("session", "")):
+
+            st.query_params["session"] = uuid.uuid4().hex
+
+        # chunks are only tracked as embedded when they actually went to a vectorstore
+        directory = f".cache/ingestion/{st.query_params['session']}/{'openai' if openai_key else 'split-only'}"
+
+        manifest = get_manifest(f"{directory}/manifest.sqlite")
+
+        # the manifest only records the new chunks once the vectorstore is saved, so a failure is retried on the next upload
+        id_key = id_column if id_column and isinstance(loader, UploadedCSVLoader) else None
+
+        with manifest.ingest(ingestion_file.name, loader.lazy_load(), text_splitter, id_key) as (chunks, removed_ids, report):
+
+            if openai_key:
+
+                embeddings_model = get_openai_embeddings(openai_key)
+
+                try:
+                    vectorstore = NumpyVectorStore.load(f"{directory}/vectorstore", embeddings_model)
+                except FileNotFoundError:
+                    vectorstore = NumpyVectorStore(embeddings_model)
+
+                vectorstore.delete(removed_ids)
+
+                if chunks:
+                    vectorstore.add_texts(
+                        [chunk.page_content for chunk in chunks],
+                        [chunk.metadata for chunk in chunks],
+                        [chunk.metadata['id'] for chunk in chunks],
+                    )
+
+                vectorstore.save(f"{directory}/vectorstore")
+
+                st.caption(f"{len(vectorstore)} chunks in the vectorstore")
+
+        st.write(report)
+
+        st.write(chunks[:20])
+
 st.divider()
 
 st.write('A project by [Francesco Carlucci](https://francescocarlucci.com) - \
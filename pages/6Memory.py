@@ -1,11 +1,28 @@
+import os
+import uuid
 import openai
 import streamlit as st
-from langchain.chat_models import ChatOpenAI
+from utils.clients import get_chat_openai
+from utils.clients import get_openai_embeddings
+from utils.streaming import TokenRenderer
+from utils.streaming import TokenStreamHandler
 from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-from langchain.memory import ConversationBufferWindowMemory
-from langchain.memory import ConversationTokenBufferMemory
-from langchain.memory import ConversationSummaryMemory
+from utils.conversations import LogMemory
+from utils.conversations import BufferView
+from utils.conversations import WindowView
+from utils.conversations import SummaryView
+from utils.conversations import RetrievalView
+from utils.conversations import SessionCache
+from utils.conversations import TokenBudgetView
+from utils.conversations import get_conversation_store
+
+# sqlite:///path.db, file:///directory, redis://host:port/db or local-redis:// (in-process, for development)
+CONVERSATION_STORE = os.environ.get("CONVERSATION_STORE", "sqlite:///.cache/conversations.db")
+
+
+@st.cache_resource
+def get_sessions(url):
+    return SessionCache(get_conversation_store(url))
 
 st.set_page_config(
     page_title="Learn LangChain | Memory",
@@ -89,6 +106,21 @@ llm = ChatOpenAI(openai_api_key=openai_key, temperature=0.0)
 memory = ConversationTokenBufferMemory(llm=llm, max_token_limit=50)
 ''')
 
+st.write('''
+To decide what to drop, ConversationTokenBufferMemory counts the tokens of the whole buffer again after
+every message, which gets slower the longer the buffer. The TokenBufferMemory of this project counts
+each message only once, when it's saved, and keeps a running total: pruning is then just removing the
+oldest messages until the total fits the limit. It counts the text of the history, without the few
+tokens the chat API adds to every message, so for the same limit it can keep a message or two more.
+''')
+
+st.code('''
+from utils.memory import TokenBufferMemory
+
+# no LLM needed, tokens are counted with tiktoken
+memory = TokenBufferMemory(max_token_limit=50)
+''')
+
 st.subheader('ConversationSummaryMemory')
 
 st.write('''
@@ -108,54 +140,113 @@ llm = ChatOpenAI(openai_api_key=openai_key, temperature=0.0)
 memory = ConversationSummaryMemory(llm=llm, max_token_limit=100)
 ''')
 
+st.subheader('RollingSummaryMemory')
+
+st.write('''
+The ConversationSummaryMemory asks the LLM to rewrite the summary after every single message, which
+doubles the calls we pay for. The RollingSummaryMemory of this project mixes the two approaches: the last
+`k` exchanges stay in the prompt word by word, and the older ones are folded into the summary in batches,
+with one LLM call every time they add up to `summary_threshold` tokens. The token count of every exchange
+is computed only once, when it's saved, so the prompt size stays about the same however long we chat.
+''')
+
+st.code('''
+from utils.memory import RollingSummaryMemory
+
+llm = ChatOpenAI(openai_api_key=openai_key, temperature=0.0)
+
+# 4 exchanges kept verbatim, a summary call every ~400 tokens of older messages
+memory = RollingSummaryMemory(llm=llm, k=4, summary_threshold=400)
+''')
+
+st.subheader('Retrieval memory')
+
+st.write('''
+Windows and token limits forget the old messages, summaries keep only what the LLM thought was important
+and a full buffer sends everything every time. A retrieval memory stores every past exchange in a vector
+store, like we did with documents, and puts in the prompt only the last few exchanges plus the older ones
+most similar to the new message: the prompt stays the same size even after thousands of messages, and a
+detail mentioned at the beginning of the conversation can still come back when the user asks about it.
+''')
+
+st.code('''
+from utils.conversations import LogMemory
+from utils.conversations import RetrievalView
+
+# the last 2 exchanges verbatim, plus the 4 older ones most relevant to the new message
+memory = LogMemory(log=log, view=RetrievalView(OpenAIEmbeddings(openai_api_key=openai_key), k=2, top_k=4))
+''')
+
 st.info("In the following example, we will use the ConversationChain, another LangChain built-in chain.\
  You can choose the memory type and understand the memory usage by inspecting the memory dump.", icon="ℹ️")
 
+st.info('''
+In this demo the conversation is not kept in the Streamlit session: every message is appended to a store
+(SQLite by default, a file log or Redis with the CONVERSATION_STORE environment variable) and the
+conversation id is saved in the page URL. The logs of the recent conversations stay in RAM, the idle
+ones are dropped and loaded again from the store when needed, reading only the last messages they use.
+Each memory type is just a different view of the same log, so changing it keeps the whole conversation,
+and summaries are saved with the log, so coming back to a summary memory doesn't summarize everything again.
+''', icon="ℹ️")
+
 openai_key = st.text_input("OpenAI Api Key")
 
 memory_type = st.selectbox(
     'Memory Type',
-    ('ConversationBufferMemory', 'ConversationBufferWindowMemory', 'ConversationSummaryMemory')
+    ('ConversationBufferMemory', 'ConversationBufferWindowMemory', 'TokenBufferMemory', 'ConversationSummaryMemory', 'RollingSummaryMemory', 'Retrieval memory')
 )
 
 prompt = st.chat_input("Hey, how can I help you today?")
 
+# the conversation id lives in the URL, so reloading the page (or restarting the app) resumes it
+if "session" not in st.query_params:
+
+    st.query_params["session"] = uuid.uuid4().hex
+
+session_id = st.query_params["session"]
+
 if prompt:
 
-    if "memory_type" in st.session_state and st.session_state.memory_type != memory_type:
+    llm = get_chat_openai(openai_key, temperature=0.0, streaming=True)
 
-        del st.session_state.conversation
+    # every memory type is a view over the same conversation log, so switching type keeps the history
+    if memory_type == "ConversationBufferWindowMemory":
 
-    if "conversation" not in st.session_state:
+        view = WindowView(k=2)
 
-        llm = ChatOpenAI(openai_api_key=openai_key, temperature=0.0)
+    elif memory_type == "TokenBufferMemory":
 
-        if memory_type == "ConversationBufferWindowMemory":
+        view = TokenBudgetView(max_token_limit=200)
 
-            memory = ConversationBufferWindowMemory(k=2)
+    elif memory_type == "ConversationSummaryMemory":
 
-        elif memory_type == "ConversationSummaryMemory":
+        view = SummaryView(get_chat_openai(openai_key, temperature=0.0), k=0, summary_threshold=0)
 
-            memory = ConversationSummaryMemory(llm=llm, max_token_limit=80)
+    elif memory_type == "RollingSummaryMemory":
 
-        else:
+        view = SummaryView(get_chat_openai(openai_key, temperature=0.0), k=4, summary_threshold=400)
 
-            memory = ConversationBufferMemory()
-            
-        
-        chain = ConversationChain(llm=llm, memory=memory)
-        
-        st.session_state.conversation = chain
+    elif memory_type == "Retrieval memory":
+
+        view = RetrievalView(get_openai_embeddings(openai_key), k=2, top_k=4)
+
+    else:
+
+        view = BufferView()
+
+    # the log is read from the store (only as far back as the view needs) unless the session is already in RAM
+    memory = LogMemory(log=get_sessions(CONVERSATION_STORE).get(session_id), view=view)
 
-        st.session_state.memory = memory
+    chain = ConversationChain(llm=llm, memory=memory)
 
-        st.session_state.memory_type = memory_type
+    # the answer is written token by token while the model generates it
+    renderer = TokenRenderer(st.empty())
 
-    response = st.session_state.conversation.predict(input=prompt)
+    response = chain.predict(input=prompt, callbacks=[TokenStreamHandler(renderer)])
 
-    st.write(response)
+    st.caption(renderer.caption())
 
-    st.json(st.session_state.memory.load_memory_variables({}))
+    st.json(memory.load_memory_variables({"input": prompt}))
 
 st.divider()
 
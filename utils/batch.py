@@ -0,0 +1,380 @@
+import os
+import re
+import sys
+import time
+import httpx
+import random
+import openai
+import asyncio
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from langchain.chains import LLMChain
+from langchain.prompts import ChatPromptTemplate
+from langchain.schema import AIMessage
+from langchain.schema import ChatResult
+from langchain.schema import ChatGeneration
+from langchain.schema.messages import AIMessageChunk
+from langchain.schema.output import ChatGenerationChunk
+from langchain.chat_models.base import BaseChatModel
+
+
+class TokenBucket:
+    """
+    Token bucket allowing `rate` requests per second with bursts of `capacity`.
+    Callers reserve a token (the balance may go negative) and then sleep until
+    it's theirs, so the bucket can be shared by threads and event loops alike.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """Take `tokens` and return how many seconds to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    async def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_token_bucket(api_key, rate, capacity=None):
+    """One bucket per API key (and rate), shared by every batch and session using that key."""
+    key = (hashlib.sha256((api_key or '').encode()).hexdigest()[:16], rate, capacity)
+    with _buckets_lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(rate, capacity)
+        return _buckets[key]
+
+
+def is_rate_limit_error(error):
+    return isinstance(error, openai.RateLimitError) or getattr(error, 'status_code', None) == 429
+
+
+class BatchRunner:
+    """
+    Run a chain over many inputs concurrently: at most `max_concurrency` calls
+    are in flight, each call first takes a token from `bucket` (if any), and
+    calls failing with a 429 are retried up to `max_retries` times after a
+    full-jitter exponential backoff. Other errors are returned, not raised, so
+    one bad input doesn't stop the batch.
+
+    Results are `(index, output, error)` tuples, streamed in submission order
+    (`ordered=True`) or as soon as each call completes.
+    """
+
+    def __init__(self, chain, max_concurrency=8, bucket=None, max_retries=5, base_delay=1.0, max_delay=30.0):
+        self.chain = chain
+        self.max_concurrency = max_concurrency
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {}
+
+    def _inputs(self, item):
+        # like chain.run(value), a single value goes to the only input variable
+        return item if isinstance(item, dict) else {self.chain.input_keys[0]: item}
+
+    def _output(self, outputs):
+        if len(self.chain.output_keys) == 1:
+            return outputs[self.chain.output_keys[0]]
+        return outputs
+
+    async def _call(self, item):
+        return self._output(await invoke_with_retries(
+            self.chain, self._inputs(item), self.stats, self.bucket, self.max_retries, self.base_delay, self.max_delay,
+        ))
+
+    async def _worker(self, items, results):
+        for index, item in items:
+            try:
+                output = await self._call(item)
+            except Exception as error:
+                self.stats['failed'] += 1
+                await results.put((index, None, error))
+            else:
+                self.stats['completed'] += 1
+                await results.put((index, output, None))
+
+    async def astream(self, inputs, ordered=True):
+        self.stats = {'completed': 0, 'failed': 0, 'retries': 0}
+        # workers share one iterator, so inputs are pulled lazily and never all scheduled at once
+        items = enumerate(inputs)
+        queue = asyncio.Queue()
+        workers = [asyncio.ensure_future(self._worker(items, queue)) for _ in range(self.max_concurrency)]
+        results = drain(queue, asyncio.ensure_future(asyncio.gather(*workers)), ordered)
+        try:
+            async for result in results:
+                yield result
+        finally:
+            await results.aclose()
+
+    def stream(self, inputs, ordered=True):
+        """Synchronous version of `astream()`, running on the shared event loop (eg. from a Streamlit script)."""
+        return iterate_in_loop(self.astream(inputs, ordered))
+
+    def run(self, inputs):
+        """Outputs (or exceptions) in the order of `inputs`."""
+        return [output if error is None else error for _, output, error in self.stream(inputs)]
+
+
+async def invoke_with_retries(chain, inputs, stats, bucket=None, max_retries=5, base_delay=1.0, max_delay=30.0):
+    """`chain.ainvoke(inputs)`, rate limited by `bucket` and retried with full-jitter backoff on 429s."""
+    for attempt in range(max_retries + 1):
+        if bucket is not None:
+            await bucket.acquire()
+        try:
+            return await chain.ainvoke(inputs)
+        except Exception as error:
+            if not is_rate_limit_error(error) or attempt == max_retries:
+                raise
+            stats['retries'] += 1
+            await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+async def drain(results, running, ordered=True):
+    """
+    Yield the `(index, ...)` tuples put in the `results` queue until the `running`
+    task is done, reordered by index if `ordered`. Closing the generator early
+    cancels `running`.
+    """
+    pending = {}
+    next_index = 0
+    try:
+        while not (running.done() and results.empty()):
+            getter = asyncio.ensure_future(results.get())
+            await asyncio.wait([getter, running], return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                continue
+            result = getter.result()
+            if not ordered:
+                yield result
+                continue
+            pending[result[0]] = result
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+    finally:
+        # the consumer may stop early: don't leave workers behind
+        running.cancel()
+        await asyncio.gather(running, return_exceptions=True)
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """
+    The event loop every async batch, pipeline and graph runs on, started once
+    in a daemon thread. Cached clients (and the HTTP pools inside them) bind to
+    the loop they are first used on, so they must never see a loop closing.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='async-runner', daemon=True).start()
+        return _loop
+
+
+def run_in_loop(coroutine):
+    """Run `coroutine` on the shared event loop and wait for its result, from synchronous code."""
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+
+async def _next(async_iterator):
+    try:
+        return True, await async_iterator.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+def iterate_in_loop(async_iterator):
+    """Iterate an async generator from synchronous code, running it on the shared event loop."""
+    try:
+        while True:
+            has_value, value = run_in_loop(_next(async_iterator))
+            if not has_value:
+                break
+            yield value
+    finally:
+        run_in_loop(async_iterator.aclose())
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering with an echo of the prompt after `latency` seconds,
+    failing with a 429 RateLimitError `rate_limit_rate` of the times and with a
+    RuntimeError `error_rate` of the times. For benchmarks without an API key.
+    `latency` is the time to the first token, the next ones (words) follow every
+    `token_latency` seconds when streaming.
+    """
+
+    latency: float = 0.1
+    token_latency: float = 0.0
+    rate_limit_rate: float = 0.0
+    error_rate: float = 0.0
+    streaming: bool = False
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return 'fake-chat'
+
+    def _answer(self, messages):
+        self.calls += 1
+        draw = random.random()
+        if draw < self.rate_limit_rate:
+            request = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+            raise openai.RateLimitError('Rate limit reached', response=httpx.Response(429, request=request), body=None)
+        if draw < self.rate_limit_rate + self.error_rate:
+            raise RuntimeError('Injected failure')
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    def _reply(self, messages):
+        return f'echo: {messages[-1].content.strip()}'
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.streaming:
+            # like ChatOpenAI(streaming=True), generate through _stream so callbacks get every token
+            text = ''.join(chunk.message.content for chunk in self._stream(messages, stop, run_manager))
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+        time.sleep(self.latency)
+        return self._answer(messages)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        text = self._answer(messages).generations[0].message.content
+        for i, token in enumerate(re.findall(r'\S+\s*|\s+', text)):
+            if i:
+                time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._answer(messages)
+
+
+class _FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Answers POST /chat/completions like the OpenAI API, echoing the last message."""
+
+    # keep-alive, so clients pool their connections like they do with the real API
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests += 1
+        body = json.dumps({
+            'id': f'chatcmpl-{self.server.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request['model'],
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': f'echo: {request["messages"][-1]["content"]}'},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def fake_openai():
+    """Point ChatOpenAI at a local server (in a daemon thread) speaking enough of the OpenAI chat API."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = os.environ.get('OPENAI_API_BASE')
+    os.environ['OPENAI_API_BASE'] = f'http://127.0.0.1:{server.server_port}/v1'
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        if base_url is None:
+            del os.environ['OPENAI_API_BASE']
+        else:
+            os.environ['OPENAI_API_BASE'] = base_url
+
+
+def check_shared_client(runs=3):
+    """Batches run one after the other on the same cached ChatOpenAI client (its HTTP pool outlives every batch)."""
+    from utils.clients import get_chat_openai
+    with fake_openai() as server:
+        chain = LLMChain(llm=get_chat_openai('sk-check', temperature=0.9), prompt=ChatPromptTemplate.from_template('{movie}'))
+        for run in range(runs):
+            errors = [error for _, _, error in BatchRunner(chain, max_concurrency=4).stream([f'Movie {i}' for i in range(8)]) if error]
+            assert not errors, f'run {run}: {errors[0]!r}'
+        print(f'{runs} batches on the same client | {server.requests} requests | no errors')
+
+
+def benchmark(input_count=1000, latency=0.1, rate_limit_rate=0.05, error_rate=0.01):
+    random.seed(0)
+    prompt = ChatPromptTemplate.from_template('Come up with an alternative name for the movie {movie}')
+    llm = FakeChatModel(latency=latency, rate_limit_rate=rate_limit_rate, error_rate=error_rate)
+    chain = LLMChain(llm=llm, prompt=prompt)
+    movies = [f'Movie {i}' for i in range(input_count)]
+    started = time.perf_counter()
+    for movie in movies[:20]:
+        try:
+            chain.run(movie)
+        except Exception:
+            pass
+    sequential = (time.perf_counter() - started) / 20
+    print(f'{input_count:>6} inputs | sequential chain.run (estimated) | {sequential * input_count:7.2f}s')
+    for max_concurrency, rate in [(8, None), (64, None), (64, 200)]:
+        for ordered in (True, False):
+            runner = BatchRunner(
+                chain,
+                max_concurrency=max_concurrency,
+                bucket=TokenBucket(rate) if rate else None,
+                base_delay=0.05,
+            )
+            started = time.perf_counter()
+            first = None
+            indexes = []
+            for index, output, error in runner.stream(movies, ordered=ordered):
+                first = first or time.perf_counter() - started
+                indexes.append(index)
+            elapsed = time.perf_counter() - started
+            assert sorted(indexes) == list(range(input_count)) and (indexes == sorted(indexes) or not ordered)
+            print(
+                f'{input_count:>6} inputs | concurrency {max_concurrency:>3} | rate {str(rate):>4}/s'
+                f' | {"ordered   " if ordered else "completion"} | {elapsed:6.2f}s | first result {first:5.2f}s | {runner.stats}'
+            )
+
+
+if __name__ == '__main__':
+    # python -m utils.batch [input count]
+    check_shared_client()
+    benchmark(*(int(argument) for argument in sys.argv[1:2]))
@@ -0,0 +1,166 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from langchain.globals import get_llm_cache
+from langchain.schema import AIMessage
+from langchain.schema import Generation
+from langchain.schema import ChatGeneration
+from langchain.schema.cache import BaseCache
+from langchain.schema.messages import AIMessageChunk
+from langchain.chat_models.base import BaseChatModel
+from langchain.load.dump import dumps
+from langchain.load.load import loads
+
+
+class ResponseCache(BaseCache):
+    """
+    Disk-backed LLM response cache stored in SQLite, pluggable as the `cache`
+    of any LangChain LLM or chat model (so chains pick it up too).
+
+    Responses are looked up by exact prompt first and then by a normalized
+    version of it (collapsed whitespace, case-insensitive), always scoped to the
+    model settings in `llm_string`. Entries older than `ttl` seconds are ignored
+    and the least recently used ones are dropped above `max_entries`.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                exact_key TEXT PRIMARY KEY,
+                normalized_key TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_normalized ON responses (normalized_key)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed)')
+        self._conn.commit()
+
+    @staticmethod
+    def normalize(prompt):
+        return re.sub(r'\s+', ' ', prompt).strip().casefold()
+
+    @staticmethod
+    def _hash(llm_string, prompt):
+        return hashlib.sha256(f'{llm_string}\x00{prompt}'.encode()).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        exact_key = self._hash(llm_string, prompt)
+        normalized_key = self._hash(llm_string, self.normalize(prompt))
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                '''SELECT exact_key, response FROM responses
+                   WHERE (exact_key = ? OR normalized_key = ?) AND created > ?
+                   ORDER BY exact_key = ? DESC, accessed DESC LIMIT 1''',
+                (exact_key, normalized_key, now - self.ttl, exact_key)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE responses SET accessed = ? WHERE exact_key = ?', (now, row[0]))
+            self._conn.commit()
+            self.hits += 1
+        return [loads(generation) for generation in json.loads(row[1])]
+
+    def update(self, prompt, llm_string, return_val):
+        now = time.time()
+        response = json.dumps([dumps(generation) for generation in return_val])
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                (self._hash(llm_string, prompt), self._hash(llm_string, self.normalize(prompt)), response, now, now)
+            )
+            self._conn.execute('DELETE FROM responses WHERE created <= ?', (now - self.ttl,))
+            self._conn.execute(
+                '''DELETE FROM responses WHERE exact_key IN (
+                       SELECT exact_key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                   )''',
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache(temperature=0.0):
+    """
+    Return the shared response cache for clients with temperature 0, and False
+    (which disables LangChain caching, including a global cache) for any other
+    temperature or an unknown one (None): a sampled call is expected to give a
+    different answer every time, so replaying a stored one would change the
+    behaviour. Clients created with temperature > 0 are never cached.
+    """
+    global _response_cache
+    if temperature is None or temperature > 0:
+        return False
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(os.path.join('.cache', 'responses.sqlite'))
+    return _response_cache
+
+
+def _cache_entry(model, input, stop):
+    """The cache used by `model.invoke(input)` and its `(prompt, llm_string)` key there, or None when it's off."""
+    cache = model.cache if isinstance(model.cache, BaseCache) else (None if model.cache is False else get_llm_cache())
+    if not cache:
+        return None
+    prompt_value = model._convert_input(input)
+    if isinstance(model, BaseChatModel):
+        return cache, dumps(prompt_value.to_messages()), model._get_llm_string(stop=stop)
+    params = model.dict()
+    params['stop'] = stop
+    return cache, prompt_value.to_string(), str(sorted(params.items()))
+
+
+def stream_with_cache(model, input, stop=None):
+    """
+    `model.stream(input)`, going through the model cache like `invoke()` does
+    (LangChain streams skip it): a cached response is replayed as a single
+    chunk, and a response streamed to the end is stored, with the same key as
+    `invoke()` so the two share their entries. Streams closed early (eg. by a
+    parser giving up on the output) are not stored.
+    """
+    entry = _cache_entry(model, input, stop)
+    chat = isinstance(model, BaseChatModel)
+    cached = entry[0].lookup(entry[1], entry[2]) if entry else None
+    if isinstance(cached, list):
+        yield AIMessageChunk(content=cached[0].text) if chat else cached[0].text
+        return
+    text = ''
+    chunks = model.stream(input, stop=stop)
+    try:
+        for chunk in chunks:
+            # LLMs stream strings, chat models stream message chunks
+            text += getattr(chunk, 'content', chunk)
+            yield chunk
+    finally:
+        chunks.close()
+    if entry:
+        entry[0].update(entry[1], entry[2], [ChatGeneration(message=AIMessage(content=text)) if chat else Generation(text=text)])
@@ -0,0 +1,226 @@
+import re
+import sys
+import json
+import time
+import random
+from langchain.chains import LLMChain
+from langchain.prompts import ChatPromptTemplate
+from langchain.output_parsers import ResponseSchema
+from langchain.output_parsers.json import parse_json_markdown
+from utils.batch import BatchRunner
+from utils.batch import FakeChatModel
+from utils.batch import run_in_loop
+from utils.tokens import count_tokens
+from utils.tokens import count_tokens_batch
+from utils.prompts import compile_template
+from utils.prompts import get_format_instructions
+
+BULK_TEMPLATE = """\
+The following texts are reviews from customers reviewing a service provided by a developer.
+Each review starts with its number in square brackets. For every review, extract the information
+described below, and return one object per review, in the same order, with its number as "index".
+
+Reviews:
+{reviews}
+
+{format_instructions}
+"""
+
+SINGLE_TEMPLATE = """\
+The following text is a review from a customer reviewing a service provided by a developer,
+extract the information described below.
+
+text: {text}
+
+{format_instructions}
+"""
+
+
+def list_format_instructions(response_schemas):
+    """Like StructuredOutputParser.get_format_instructions(), for a list of objects with an index."""
+    fields = '\n'.join(
+        f'\t\t"{schema.name}": {schema.type}  // {schema.description}' for schema in response_schemas
+    )
+    return (
+        'The output should be a markdown code snippet formatted in the following schema, a JSON list with '
+        'one object per review, including the leading and trailing "```json" and "```":\n\n'
+        '```json\n[\n\t{\n\t\t"index": integer  // the number of the review\n'
+        f'{fields}\n\t}},\n\t...\n]\n```'
+    )
+
+
+class BulkClassifier:
+    """
+    Structured extraction over many reviews with few LLM calls: reviews are
+    packed into prompts of at most `max_prompt_tokens` (and `max_batch_size`
+    reviews), the model answers with a JSON list of objects that are mapped
+    back by their index, and only the reviews missing or invalid in the answer
+    are sent again one by one, with the single-review prompt.
+
+    `report` accumulates calls, tokens and time over every `classify()` call,
+    `summary()` adds the estimated cost (from `prices`, USD per 1K prompt and
+    completion tokens) per review and the throughput.
+    """
+
+    def __init__(self, chat, response_schemas, max_prompt_tokens=3000, max_batch_size=50, max_concurrency=8,
+                 bucket=None, prices=(0.0005, 0.0015), encoding_name='cl100k_base'):
+        self.response_schemas = response_schemas
+        self.keys = [schema.name for schema in response_schemas]
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_batch_size = max_batch_size
+        self.prices = prices
+        self.encoding_name = encoding_name
+        bulk_instructions = list_format_instructions(response_schemas)
+        single_instructions = get_format_instructions(response_schemas)
+        # the compiled prompts are only used to count the prompt tokens
+        self.bulk_prompt = compile_template(BULK_TEMPLATE).partial(format_instructions=bulk_instructions)
+        self.single_prompt = compile_template(SINGLE_TEMPLATE).partial(format_instructions=single_instructions)
+        bulk_chain = LLMChain(llm=chat, prompt=ChatPromptTemplate.from_template(BULK_TEMPLATE).partial(format_instructions=bulk_instructions))
+        single_chain = LLMChain(llm=chat, prompt=ChatPromptTemplate.from_template(SINGLE_TEMPLATE).partial(format_instructions=single_instructions))
+        self.bulk_runner = BatchRunner(bulk_chain, max_concurrency=max_concurrency, bucket=bucket)
+        self.single_runner = BatchRunner(single_chain, max_concurrency=max_concurrency, bucket=bucket)
+        self._base_tokens = count_tokens(self.bulk_prompt.format_messages(reviews='')[0].content, encoding_name)
+        self.report = {
+            'reviews': 0,
+            'bulk_calls': 0,
+            'single_calls': 0,
+            'failed': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'elapsed': 0.0,
+        }
+
+    def pack(self, reviews):
+        """Split the review indexes in batches fitting the token budget (an oversized review goes alone)."""
+        lines = [f'[{index}] {" ".join(review.split())}' for index, review in enumerate(reviews)]
+        counts = count_tokens_batch(lines, self.encoding_name)
+        batches = []
+        batch = []
+        tokens = self._base_tokens
+        for index, count in enumerate(counts):
+            if batch and (tokens + count > self.max_prompt_tokens or len(batch) == self.max_batch_size):
+                batches.append(batch)
+                batch = []
+                tokens = self._base_tokens
+            batch.append(index)
+            tokens += count + 1
+        if batch:
+            batches.append(batch)
+        return batches, lines
+
+    def _parse_bulk(self, text, batch):
+        """Map the objects of a bulk answer to their review index, skipping the invalid ones."""
+        try:
+            items = parse_json_markdown(text)
+        except (json.JSONDecodeError, ValueError):
+            return {}
+        if not isinstance(items, list):
+            return {}
+        results = {}
+        for item in items:
+            if (
+                isinstance(item, dict) and isinstance(item.get('index'), int) and item['index'] in batch
+                and all(key in item for key in self.keys)
+            ):
+                results[item['index']] = {key: item[key] for key in self.keys}
+        return results
+
+    def _parse_single(self, text):
+        try:
+            item = parse_json_markdown(text)
+        except (json.JSONDecodeError, ValueError):
+            return None
+        if isinstance(item, dict) and all(key in item for key in self.keys):
+            return {key: item[key] for key in self.keys}
+        return None
+
+    def _count(self, prompts, outputs):
+        self.report['prompt_tokens'] += sum(count_tokens_batch(prompts, self.encoding_name))
+        self.report['completion_tokens'] += sum(count_tokens_batch([output or '' for output in outputs], self.encoding_name))
+
+    def classify(self, reviews):
+        """Return one dict (or None if even the single-review retry failed) per review, in order."""
+        # both passes are one coroutine, submitted once to the shared event loop
+        return run_in_loop(self.aclassify(reviews))
+
+    async def aclassify(self, reviews):
+        started = time.perf_counter()
+        reviews = list(reviews)
+        # with batches of one review the single-review prompt is the cheaper one, so skip straight to it
+        batches, lines = self.pack(reviews) if self.max_batch_size > 1 else ([], [])
+        results = [None] * len(reviews)
+        bulk_inputs = [{'reviews': '\n'.join(lines[index] for index in batch)} for batch in batches]
+        outputs = [None] * len(batches)
+        async for position, output, error in self.bulk_runner.astream(bulk_inputs):
+            outputs[position] = output
+            if error is None:
+                # reviews are numbered by their position in this call, so indexes map straight back
+                for index, result in self._parse_bulk(output, batches[position]).items():
+                    results[index] = result
+        self._count([self.bulk_prompt.format_messages(**inputs)[0].content for inputs in bulk_inputs], outputs)
+        failed = [index for index, result in enumerate(results) if result is None]
+        single_outputs = [None] * len(failed)
+        async for position, output, error in self.single_runner.astream([{'text': reviews[index]} for index in failed]):
+            single_outputs[position] = output
+            if error is None:
+                results[failed[position]] = self._parse_single(output)
+        self._count([self.single_prompt.format_messages(text=reviews[index])[0].content for index in failed], single_outputs)
+        self.report['reviews'] += len(reviews)
+        self.report['bulk_calls'] += len(batches)
+        self.report['single_calls'] += len(failed)
+        self.report['failed'] += sum(1 for result in results if result is None)
+        self.report['elapsed'] += time.perf_counter() - started
+        return results
+
+    def summary(self):
+        report = dict(self.report)
+        report['cost'] = (report['prompt_tokens'] * self.prices[0] + report['completion_tokens'] * self.prices[1]) / 1000
+        report['cost_per_review'] = report['cost'] / max(report['reviews'], 1)
+        report['reviews_per_second'] = report['reviews'] / max(report['elapsed'], 1e-9)
+        return report
+
+
+class FakeReviewModel(FakeChatModel):
+    """Fake chat model answering the bulk and single review prompts, dropping `drop_rate` of the bulk items."""
+
+    drop_rate: float = 0.0
+
+    def _reply(self, messages):
+        prompt = messages[-1].content
+        reviews = re.findall(r'^\[(\d+)\] (.*)$', prompt, re.MULTILINE)
+        if reviews:
+            items = [
+                {'index': int(index), 'satisfied': 'great' in text, 'keywords': ', '.join(text.split()[:3])}
+                for index, text in reviews if random.random() >= self.drop_rate
+            ]
+            return '```json\n' + json.dumps(items, indent=1) + '\n```'
+        text = prompt.split('text: ', 1)[1].split('\n', 1)[0]
+        return '```json\n' + json.dumps({'satisfied': 'great' in text, 'keywords': ', '.join(text.split()[:3])}) + '\n```'
+
+
+def benchmark(review_count=2_000, latency=0.5, drop_rate=0.02):
+    random.seed(0)
+    words = 'great terrible fast slow responsive late clean buggy professional friendly expensive cheap'.split()
+    reviews = [' '.join(random.choices(words, k=random.randint(10, 80))) for _ in range(review_count)]
+    response_schemas = [
+        ResponseSchema(name='satisfied', description='Was the customer satisfied? true, false or null if unclear.'),
+        ResponseSchema(name='keywords', description='The 3 most relevant adjectives, as a comma separated list.'),
+    ]
+    for max_prompt_tokens, max_batch_size in [(0, 1), (2000, 25), (4000, 50)]:
+        chat = FakeReviewModel(latency=latency, drop_rate=drop_rate)
+        classifier = BulkClassifier(chat, response_schemas, max_prompt_tokens=max_prompt_tokens, max_batch_size=max_batch_size, max_concurrency=16)
+        results = classifier.classify(reviews)
+        assert all(result is not None for result in results)
+        assert all(result['satisfied'] == ('great' in review) for result, review in zip(results, reviews))
+        summary = classifier.summary()
+        print(
+            f'{review_count} reviews | batch <= {max_batch_size:>2} reviews, {max_prompt_tokens:>4} tokens'
+            f' | {summary["bulk_calls"]:>5} bulk + {summary["single_calls"]:>3} single calls'
+            f' | {summary["reviews_per_second"]:7.1f} reviews/s'
+            f' | ${summary["cost_per_review"] * 1000:.4f} per 1K reviews'
+        )
+
+
+if __name__ == '__main__':
+    # python -m utils.classify [review count]
+    benchmark(*(int(argument) for argument in sys.argv[1:2]))
@@ -0,0 +1,127 @@
+import time
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from langchain.llms import OpenAI
+from langchain.llms import DeepInfra
+from langchain.chat_models import ChatOpenAI
+from langchain.embeddings import OpenAIEmbeddings
+from utils.cache import get_response_cache
+from utils.embeddings import EmbeddingStore
+from utils.embeddings import CachedEmbeddings
+
+
+class ClientRegistry:
+    """
+    Shared registry of LLM clients, so Streamlit reruns reuse the same object
+    (and the pooled keep-alive HTTP client the OpenAI SDK holds inside it) instead
+    of rebuilding it on every submit.
+    Clients are keyed by provider, model, API key hash and temperature, and the
+    ones not used for `max_idle` seconds are evicted (and closed, if they have
+    a `close()` method).
+    """
+
+    def __init__(self, max_idle=600, max_clients=64):
+        self.max_idle = max_idle
+        self.max_clients = max_clients
+        self.hits = 0
+        self.misses = 0
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(provider, model, api_key, temperature):
+        # never keep raw API keys around as dictionary keys
+        key_hash = hashlib.sha256((api_key or '').encode()).hexdigest()[:16]
+        return (provider, model, key_hash, temperature)
+
+    def get(self, key, factory):
+        with self._lock:
+            evicted = self._evict_idle()
+            if key in self._clients:
+                client, _ = self._clients.pop(key)
+                self.hits += 1
+            else:
+                client = factory()
+                self.misses += 1
+            self._clients[key] = (client, time.monotonic())
+            while len(self._clients) > self.max_clients:
+                evicted.append(self._clients.popitem(last=False)[1][0])
+        # outside the lock: closing may wait for a request in flight
+        for evicted_client in evicted:
+            self._close(evicted_client)
+        return client
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        evicted = []
+        while self._clients:
+            key, (client, last_used) = next(iter(self._clients.items()))
+            if now - last_used < self.max_idle:
+                break
+            del self._clients[key]
+            evicted.append(client)
+        return evicted
+
+    @staticmethod
+    def _close(client):
+        # clients owning a background thread (eg. CachedEmbeddings) release it, the others have nothing to close
+        close = getattr(client, 'close', None)
+        if callable(close):
+            close()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'clients': len(self._clients)}
+
+
+registry = ClientRegistry()
+
+
+def get_openai_llm(openai_key, temperature=0.7):
+    key = registry.make_key('openai', 'completion', openai_key, temperature)
+    return registry.get(key, lambda: OpenAI(
+        openai_api_key=openai_key,
+        temperature=temperature,
+        cache=get_response_cache(temperature),
+    ))
+
+
+def get_chat_openai(openai_key, temperature=0.7, streaming=False):
+    # streaming clients send every token to the callbacks, so they are a separate registry entry
+    key = registry.make_key('openai', 'chat-streaming' if streaming else 'chat', openai_key, temperature)
+    return registry.get(key, lambda: ChatOpenAI(
+        openai_api_key=openai_key,
+        temperature=temperature,
+        streaming=streaming,
+        cache=get_response_cache(temperature),
+    ))
+
+
+def get_deepinfra_llm(deepinfra_token, model_id):
+    key = registry.make_key('deepinfra', model_id, deepinfra_token, None)
+    return registry.get(key, lambda: DeepInfra(
+        deepinfra_api_token=deepinfra_token,
+        model_id=model_id,
+        # the sampling settings are up to the model, so its calls can't be assumed deterministic: never cached
+        cache=False,
+    ))
+
+
+def get_openai_embeddings(openai_key):
+    key = registry.make_key('openai', 'embeddings', openai_key, None)
+    return registry.get(key, lambda: CachedEmbeddings(
+        OpenAIEmbeddings(openai_api_key=openai_key),
+        _embedding_store('openai-embeddings'),
+    ))
+
+
+_embedding_stores = {}
+
+
+def _embedding_store(name):
+    # vectors only depend on the model, so all API keys share the same store
+    if name not in _embedding_stores:
+        _embedding_stores[name] = EmbeddingStore(os.path.join('.cache', 'embeddings', name))
+    return _embedding_stores[name]
@@ -0,0 +1,745 @@
+import os
+import sys
+import json
+import time
+import struct
+import sqlite3
+import hashlib
+import fnmatch
+import uuid
+import random
+import tempfile
+import threading
+from abc import ABC
+from abc import abstractmethod
+from typing import Any
+from collections import OrderedDict
+from collections import namedtuple
+from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationSummaryMemory
+from langchain.memory import ConversationBufferWindowMemory
+from langchain.schema import BaseMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.memory.utils import get_prompt_input_key
+from utils.memory import TokenBufferMemory
+from utils.memory import FakeSummaryModel
+from utils.memory import RollingSummaryMemory
+from utils.memory import synthetic_turns
+from utils.tokens import count_tokens
+from utils.embeddings import HashingEmbeddings
+from utils.vectorstore import NumpyVectorStore
+
+# a message of the log: `role` is 'human' or 'ai', `tokens` the count of its line in the prompt ("Human: ...")
+Message = namedtuple('Message', ['role', 'content', 'tokens'])
+
+
+class ConversationStore(ABC):
+    """
+    Append-only message log per session, plus a small JSON state per session
+    (eg. the memoized summaries). Backends implement `append`, `length`,
+    `read` (any range of positions, so the end of a long log is read without
+    the rest), `get_state` and `set_state`.
+    """
+
+    @abstractmethod
+    def append(self, session_id, messages):
+        """Appends after the last stored message, returns the position of the first one."""
+
+    @abstractmethod
+    def length(self, session_id):
+        pass
+
+    @abstractmethod
+    def read(self, session_id, start, end):
+        """Messages `start` (included) to `end` (excluded), in order."""
+
+    @abstractmethod
+    def get_state(self, session_id):
+        pass
+
+    @abstractmethod
+    def set_state(self, session_id, state):
+        pass
+
+
+class SQLiteConversationStore(ConversationStore):
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # write-ahead log: appends don't block readers and don't wait for a full sync
+        self._conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS messages (
+                session TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (session, position)
+            );
+            CREATE TABLE IF NOT EXISTS states (
+                session TEXT PRIMARY KEY,
+                state TEXT NOT NULL
+            );
+        ''')
+        self._conn.commit()
+
+    def append(self, session_id, messages):
+        with self._lock:
+            # the write lock is taken before reading the length, so two processes appending to the same
+            # session get consecutive positions instead of one of them failing on the primary key
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                start = self._length(session_id)
+                self._conn.executemany('INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)', [
+                    (session_id, start + i, message.role, message.content, message.tokens, time.time())
+                    for i, message in enumerate(messages)
+                ])
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            return start
+
+    def _length(self, session_id):
+        row = self._conn.execute('SELECT MAX(position) FROM messages WHERE session = ?', (session_id,)).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def length(self, session_id):
+        with self._lock:
+            return self._length(session_id)
+
+    def read(self, session_id, start, end):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT role, content, tokens FROM messages WHERE session = ? AND position >= ? AND position < ? ORDER BY position',
+                (session_id, start, end),
+            ).fetchall()
+        return [Message(*row) for row in rows]
+
+    def get_state(self, session_id):
+        with self._lock:
+            row = self._conn.execute('SELECT state FROM states WHERE session = ?', (session_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def set_state(self, session_id, state):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO states VALUES (?, ?)', (session_id, json.dumps(state)))
+            self._conn.commit()
+
+
+class FileConversationStore(ConversationStore):
+    """
+    One JSON lines file per session, appended to and never rewritten, with a
+    side file of fixed size offsets so any range of messages is read with a
+    single seek.
+    """
+
+    _offset = struct.Struct('<Q')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id, extension):
+        return os.path.join(self.directory, hashlib.sha256(session_id.encode()).hexdigest()[:32] + extension)
+
+    def append(self, session_id, messages):
+        with self._lock:
+            start = self._length(session_id)
+            with open(self._path(session_id, '.jsonl'), 'ab') as log, open(self._path(session_id, '.idx'), 'ab') as index:
+                offset = log.tell()
+                for message in messages:
+                    line = (json.dumps(message._asdict()) + '\n').encode()
+                    log.write(line)
+                    index.write(self._offset.pack(offset))
+                    offset += len(line)
+            return start
+
+    def _length(self, session_id):
+        try:
+            return os.path.getsize(self._path(session_id, '.idx')) // self._offset.size
+        except FileNotFoundError:
+            return 0
+
+    def length(self, session_id):
+        with self._lock:
+            return self._length(session_id)
+
+    def read(self, session_id, start, end):
+        with self._lock:
+            end = min(end, self._length(session_id))
+            if start >= end:
+                return []
+            with open(self._path(session_id, '.idx'), 'rb') as index:
+                index.seek(start * self._offset.size)
+                offset = self._offset.unpack(index.read(self._offset.size))[0]
+            with open(self._path(session_id, '.jsonl'), 'rb') as log:
+                log.seek(offset)
+                return [Message(**json.loads(log.readline())) for _ in range(end - start)]
+
+    def get_state(self, session_id):
+        try:
+            with open(self._path(session_id, '.state.json')) as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            return {}
+
+    def set_state(self, session_id, state):
+        # written to a temporary file and renamed, so a crash never leaves half a state
+        with tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False) as state_file:
+            json.dump(state, state_file)
+        os.replace(state_file.name, self._path(session_id, '.state.json'))
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the few Redis commands RedisConversationStore uses
+    (RPUSH, LLEN, LRANGE, GET, SET, KEYS), returning bytes like redis-py does.
+    For running without a Redis server; point the store to a real client in production.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bytes(value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def rpush(self, key, *values):
+        with self._lock:
+            items = self._data.setdefault(key, [])
+            items.extend(self._bytes(value) for value in values)
+            return len(items)
+
+    def llen(self, key):
+        with self._lock:
+            return len(self._data.get(key, []))
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            items = self._data.get(key, [])
+            # like Redis, `end` is included and negative indexes count from the end
+            end = len(items) if end == -1 else (end + 1 if end >= 0 else len(items) + end + 1)
+            return list(items[start:end])
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = self._bytes(value)
+            return True
+
+    def keys(self, pattern='*'):
+        with self._lock:
+            return [key.encode() for key in self._data if fnmatch.fnmatchcase(key, pattern)]
+
+
+class RedisConversationStore(ConversationStore):
+    """Messages in a Redis list per session (RPUSH/LRANGE), shared by every replica using the same server."""
+
+    def __init__(self, client, prefix='conversation'):
+        self.client = client
+        self.prefix = prefix
+
+    def append(self, session_id, messages):
+        if not messages:
+            return self.length(session_id)
+        # RPUSH is atomic and returns the new length, so the start is right even with other writers
+        length = self.client.rpush(f'{self.prefix}:{session_id}:messages', *[json.dumps(message._asdict()) for message in messages])
+        return length - len(messages)
+
+    def length(self, session_id):
+        return self.client.llen(f'{self.prefix}:{session_id}:messages')
+
+    def read(self, session_id, start, end):
+        if start >= end:
+            return []
+        items = self.client.lrange(f'{self.prefix}:{session_id}:messages', start, end - 1)
+        return [Message(**json.loads(item)) for item in items]
+
+    def get_state(self, session_id):
+        state = self.client.get(f'{self.prefix}:{session_id}:state')
+        return json.loads(state) if state else {}
+
+    def set_state(self, session_id, state):
+        self.client.set(f'{self.prefix}:{session_id}:state', json.dumps(state))
+
+
+def get_conversation_store(url):
+    """`sqlite:///path.db`, `file:///directory`, `redis://host:port/db` or `local-redis://`."""
+    scheme, _, location = url.partition('://')
+    # like SQLAlchemy URLs, three slashes for a relative path and four for an absolute one
+    path = location[1:] if location.startswith('/') else location
+    if scheme == 'sqlite':
+        return SQLiteConversationStore(path)
+    if scheme == 'file':
+        return FileConversationStore(path)
+    if scheme == 'redis':
+        import redis
+        return RedisConversationStore(redis.Redis.from_url(url))
+    if scheme == 'local-redis':
+        return RedisConversationStore(LocalRedis())
+    raise ValueError(f'Unknown conversation store: {url}')
+
+
+class ConversationLog:
+    """
+    The canonical history of a session: messages are appended to the store
+    and read from it lazily, from the end, keeping the part already read in RAM
+    (`messages` holds positions `offset` to `length`). Memory views project it,
+    so changing view never loses or reloads anything. Other processes (replicas,
+    tabs) may append to the same session: `sync()` reads what they added.
+    """
+
+    def __init__(self, store, session_id, page_size=64):
+        self.store = store
+        self.session_id = session_id
+        self.page_size = page_size
+        self.length = store.length(session_id)
+        self.offset = self.length
+        self.messages = []
+        self.state = store.get_state(session_id)
+        # vector indexes of retrieval views, rebuilt from the log (and the embedding cache) when needed
+        self.indexes = {}
+        self.last_used = time.monotonic()
+
+    def __len__(self):
+        return self.length
+
+    def append(self, messages):
+        start = self.store.append(self.session_id, messages)
+        # messages appended by someone else since the last sync come before ours
+        self._read_new(start)
+        self.messages.extend(messages)
+        self.length += len(messages)
+
+    def _read_new(self, length):
+        if length > self.length:
+            self.messages.extend(self.store.read(self.session_id, self.length, length))
+            self.length = length
+
+    def sync(self):
+        """Reads the messages and state other writers stored since this log was loaded."""
+        self._read_new(self.store.length(self.session_id))
+        self.state = self.store.get_state(self.session_id)
+
+    def read(self, start, end):
+        start = max(start, 0)
+        if start < self.offset:
+            self.messages[:0] = self.store.read(self.session_id, start, self.offset)
+            self.offset = start
+        return self.messages[start - self.offset:end - self.offset]
+
+    def tail(self, count=None, max_tokens=None):
+        """The last `count` messages, or the most recent ones fitting in `max_tokens` (using the stored counts)."""
+        if max_tokens is None:
+            return self.read(0 if count is None else self.length - count, self.length)
+        total = 0
+        start = self.length
+        while start > 0:
+            # pages are only read from the store the first time
+            page = self.read(start - self.page_size, start)
+            for message in reversed(page):
+                if total + message.tokens > max_tokens:
+                    return self.read(start, self.length)
+                total += message.tokens
+                start -= 1
+        return self.read(0, self.length)
+
+    def get_summary(self, key):
+        return self.state.get('summaries', {}).get(key, (0, ''))
+
+    def set_summary(self, key, covered, summary):
+        self.state.setdefault('summaries', {})[key] = (covered, summary)
+        self.store.set_state(self.session_id, self.state)
+
+
+def _line(memory, message):
+    return f'{memory.human_prefix if message.role == "human" else memory.ai_prefix}: {message.content}'
+
+
+def _message(memory, role, content):
+    message = Message(role, content, 0)
+    return message._replace(tokens=count_tokens(_line(memory, message), memory.encoding_name))
+
+
+class BufferView:
+    """The whole conversation, like ConversationBufferMemory."""
+
+    def project(self, log, memory, query=None):
+        return [_line(memory, message) for message in log.tail()]
+
+
+class WindowView:
+    """The last `k` exchanges, like ConversationBufferWindowMemory."""
+
+    def __init__(self, k=2):
+        self.k = k
+
+    def project(self, log, memory, query=None):
+        return [_line(memory, message) for message in log.tail(count=2 * self.k)]
+
+
+class TokenBudgetView:
+    """The most recent messages fitting in `max_token_limit` tokens, like TokenBufferMemory."""
+
+    def __init__(self, max_token_limit=2000):
+        self.max_token_limit = max_token_limit
+
+    def project(self, log, memory, query=None):
+        return [_line(memory, message) for message in log.tail(max_tokens=self.max_token_limit)]
+
+
+class SummaryView:
+    """
+    A summary of the old messages plus the last `k` exchanges verbatim, like
+    RollingSummaryMemory: messages out of the window are folded into the
+    summary once they add up to `summary_threshold` tokens (with k=0 and
+    summary_threshold=0, every exchange is summarized, like
+    ConversationSummaryMemory). Summaries are memoized in the log state by how
+    many messages they cover, so coming back to this view after using another
+    one only summarizes the messages added in between.
+    """
+
+    def __init__(self, llm, k=4, summary_threshold=400, max_fold_tokens=3000, prompt=SUMMARY_PROMPT):
+        self.llm = llm
+        self.k = k
+        self.summary_threshold = summary_threshold
+        self.max_fold_tokens = max_fold_tokens
+        self.prompt = prompt
+        self.key = f'k={k},threshold={summary_threshold}'
+        self.summary_calls = 0
+
+    def _fold(self, summary, messages, memory):
+        new_lines = '\n'.join(_line(memory, message) for message in messages)
+        self.summary_calls += 1
+        return self.llm.predict(self.prompt.format(summary=summary, new_lines=new_lines)).strip()
+
+    def project(self, log, memory, query=None):
+        evicted = max(len(log) - 2 * self.k, 0)
+        covered, summary = log.get_summary(self.key)
+        pending = log.read(covered, evicted)
+        if pending and sum(message.tokens for message in pending) >= self.summary_threshold:
+            # a long backlog (eg. the first time this view is used) is folded `max_fold_tokens` at a time
+            batch = []
+            tokens = 0
+            for message in pending:
+                if batch and tokens + message.tokens > self.max_fold_tokens:
+                    summary = self._fold(summary, batch, memory)
+                    batch = []
+                    tokens = 0
+                batch.append(message)
+                tokens += message.tokens
+            summary = self._fold(summary, batch, memory)
+            log.set_summary(self.key, evicted, summary)
+            pending = []
+        lines = [f'System: {summary}'] if summary else []
+        return lines + [_line(memory, message) for message in pending + log.read(evicted, len(log))]
+
+
+def _embeddings_name(embeddings):
+    # wrappers like CachedEmbeddings are named after the model they wrap
+    while hasattr(embeddings, 'embeddings'):
+        embeddings = embeddings.embeddings
+    model = next((getattr(embeddings, attribute) for attribute in ('model', 'model_name', 'size') if hasattr(embeddings, attribute)), '')
+    return f'{type(embeddings).__name__}:{model}'
+
+
+class RetrievalView:
+    """
+    The last `k` exchanges verbatim plus the `top_k` older exchanges most
+    similar to the new input, found in a NumpyVectorStore of the log. Older
+    exchanges are embedded once, in one batch, when they leave the window, so
+    the prompt stays the same size however long the conversation gets, and old
+    facts can still come back when they are relevant.
+    """
+
+    def __init__(self, embeddings, k=2, top_k=4, name=None):
+        self.embeddings = embeddings
+        self.k = k
+        self.top_k = top_k
+        # the index is kept in the log under this key, so it must be the same for the same model on every rerun
+        self.key = f'retrieval:{name or _embeddings_name(embeddings)}'
+
+    def _index(self, log, memory, end):
+        # one vector store per log and embeddings, filled up to the first exchange still in the window
+        if self.key not in log.indexes:
+            log.indexes[self.key] = (NumpyVectorStore(self.embeddings), 0)
+        store, indexed = log.indexes[self.key]
+        if indexed < end:
+            messages = log.read(indexed, end)
+            texts = [
+                f'{_line(memory, human)}\n{_line(memory, ai)}' for human, ai in zip(messages[::2], messages[1::2])
+            ]
+            store.add_texts(texts, [{'position': position} for position in range(indexed, end, 2)])
+            log.indexes[self.key] = (store, end)
+        return store
+
+    def project(self, log, memory, query=None):
+        evicted = max(len(log) - 2 * self.k, 0)
+        evicted -= evicted % 2
+        lines = []
+        if query and evicted:
+            store = self._index(log, memory, evicted)
+            # exchanges indexed by a view with a smaller window may be back in the window now
+            retrieved = [
+                doc for doc in store.similarity_search(query, k=self.top_k + self.k)
+                if doc.metadata['position'] < evicted
+            ][:self.top_k]
+            # older exchanges go back in their original order
+            retrieved.sort(key=lambda doc: doc.metadata['position'])
+            lines = ['System: Relevant earlier messages:'] + [doc.page_content for doc in retrieved]
+            lines.append('System: Latest messages:')
+        return lines + [_line(memory, message) for message in log.read(evicted, len(log))]
+
+
+class LogMemory(BaseMemory):
+    """
+    Memory for ConversationChain made of a ConversationLog and a view over it.
+    Every exchange is appended to the log, the history is the projection of the
+    current `view`: switching memory type is just assigning another view.
+    """
+
+    log: Any
+    view: Any
+    memory_key: str = 'history'
+    input_key: Any = None
+    output_key: Any = None
+    human_prefix: str = 'Human'
+    ai_prefix: str = 'AI'
+    encoding_name: str = 'cl100k_base'
+
+    @property
+    def memory_variables(self):
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs):
+        # the new input, for views that pick the history by relevance
+        query = inputs.get(self.input_key or 'input')
+        return {self.memory_key: '\n'.join(self.view.project(self.log, self, query))}
+
+    def save_context(self, inputs, outputs):
+        input_key = self.input_key or get_prompt_input_key(inputs, self.memory_variables)
+        output_key = self.output_key or next(iter(outputs))
+        self.log.append([
+            _message(self, 'human', inputs[input_key]),
+            _message(self, 'ai', outputs[output_key]),
+        ])
+
+    def clear(self):
+        # the log is append-only, a cleared memory just stops seeing it
+        self.log = ConversationLog(self.log.store, f'{self.log.session_id}:{uuid.uuid4().hex}')
+
+
+class SessionCache:
+    """
+    Keeps the logs of the active sessions in RAM, least recently used first:
+    above `max_sessions`, or after `max_idle` seconds without use, a session is
+    dropped, and it's read again from the store (only as far back as the views
+    need) the next time it's used. A cached log is synced with the store on
+    every `get`, so what other replicas appended is never missed.
+    """
+
+    def __init__(self, store, max_sessions=256, max_idle=1800):
+        self.store = store
+        self.max_sessions = max_sessions
+        self.max_idle = max_idle
+        self.hits = 0
+        self.misses = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            self._evict_idle()
+            if session_id in self._sessions:
+                log = self._sessions.pop(session_id)
+                log.sync()
+                self.hits += 1
+            else:
+                log = ConversationLog(self.store, session_id)
+                self.misses += 1
+            log.last_used = time.monotonic()
+            self._sessions[session_id] = log
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return log
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        while self._sessions:
+            session_id, log = next(iter(self._sessions.items()))
+            if now - log.last_used < self.max_idle:
+                break
+            del self._sessions[session_id]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'sessions': len(self._sessions)}
+
+
+def check_views(turn_count=200):
+    """Every view gives the same history as the LangChain (or utils.memory) memory it mirrors."""
+    llm = FakeSummaryModel()
+    cases = [
+        (BufferView(), ConversationBufferMemory()),
+        (WindowView(k=2), ConversationBufferWindowMemory(k=2)),
+        (TokenBudgetView(max_token_limit=500), TokenBufferMemory(max_token_limit=500)),
+        (SummaryView(llm, k=4, summary_threshold=600), RollingSummaryMemory(llm=llm, k=4, summary_threshold=600)),
+        (SummaryView(llm, k=0, summary_threshold=0), ConversationSummaryMemory(llm=llm)),
+    ]
+    for view, reference in cases:
+        memory = LogMemory(log=ConversationLog(RedisConversationStore(LocalRedis()), 'check'), view=view)
+        for inputs, outputs in synthetic_turns(turn_count):
+            expected = reference.load_memory_variables(inputs)['history']
+            if isinstance(reference, ConversationSummaryMemory) and expected:
+                # the view labels the summary like RollingSummaryMemory does
+                expected = f'System: {expected}'
+            assert memory.load_memory_variables(inputs)['history'] == expected, type(view).__name__
+            memory.save_context(inputs, outputs)
+            reference.save_context(inputs, outputs)
+    # the retrieval index of a log is found again by views built on a later rerun
+    assert RetrievalView(HashingEmbeddings()).key == RetrievalView(HashingEmbeddings()).key
+
+
+def check_shared_store(turn_count=50):
+    """Two caches on one store (like two replicas) see each other's messages, at the right positions."""
+    with tempfile.TemporaryDirectory() as directory:
+        stores = [
+            SQLiteConversationStore(os.path.join(directory, 'conversations.db')),
+            FileConversationStore(os.path.join(directory, 'conversations')),
+            RedisConversationStore(LocalRedis()),
+        ]
+        for store in stores:
+            replicas = [SessionCache(store), SessionCache(store)]
+            expected = []
+            for turn, (inputs, outputs) in enumerate(synthetic_turns(turn_count)):
+                memory = LogMemory(log=replicas[turn % 2].get('shared'), view=BufferView())
+                assert memory.load_memory_variables(inputs)['history'] == '\n'.join(expected), type(store).__name__
+                memory.save_context(inputs, outputs)
+                expected += [f'Human: {inputs["input"]}', f'AI: {outputs["response"]}']
+            # a stale log appending without a sync still puts its messages after the others
+            stale = replicas[0].get('shared')
+            replicas[1].get('shared').append([Message('human', 'from the other replica', 5)])
+            stale.append([Message('ai', 'from this one', 4)])
+            assert [message.content for message in stale.tail(count=2)] == ['from the other replica', 'from this one']
+            assert [message.content for message in store.read('shared', 0, len(stale))] == [
+                message.content for message in stale.tail()
+            ]
+
+
+def benchmark(turn_count=1000, sessions=20):
+    """Append long conversations, reload cold sessions through each view, then switch views on a warm one."""
+    llm = FakeSummaryModel()
+    views = [
+        ('buffer', lambda: BufferView()),
+        ('window k=4', lambda: WindowView(k=4)),
+        ('tokens <= 2000', lambda: TokenBudgetView(max_token_limit=2000)),
+        ('summary k=4', lambda: SummaryView(llm, k=4, summary_threshold=1500)),
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        stores = [
+            ('sqlite', SQLiteConversationStore(os.path.join(directory, 'conversations.db'))),
+            ('file', FileConversationStore(os.path.join(directory, 'conversations'))),
+            ('local-redis', RedisConversationStore(LocalRedis())),
+        ]
+        for store_name, store in stores:
+            started = time.perf_counter()
+            for session in range(sessions):
+                memory = LogMemory(log=ConversationLog(store, f'session-{session}'), view=BufferView())
+                for inputs, outputs in synthetic_turns(turn_count, session):
+                    memory.save_context(inputs, outputs)
+            append = (time.perf_counter() - started) / (sessions * turn_count)
+            print(f'{store_name:<11} | append {append * 1e6:7.1f} µs per turn')
+            for view_name, view in views[:3]:
+                started = time.perf_counter()
+                for session in range(sessions):
+                    LogMemory(log=ConversationLog(store, f'session-{session}'), view=view()).load_memory_variables({})
+                load = (time.perf_counter() - started) / sessions
+                print(f'{"":<11} | cold load {view_name:<15} {load * 1e3:8.2f} ms per session of {turn_count} turns')
+        # switching back and forth on a warm log: only the first summary projection calls the LLM
+        memory = LogMemory(log=ConversationLog(store, 'session-0'), view=BufferView())
+        for round_number in range(3):
+            for view_name, view in views:
+                llm.calls = 0
+                memory.view = view()
+                started = time.perf_counter()
+                memory.load_memory_variables({})
+                print(
+                    f'switch {round_number} | {view_name:<15} | {(time.perf_counter() - started) * 1e3:8.2f} ms'
+                    f' | {llm.calls} summary calls'
+                )
+
+
+PROJECTS = 'Falcon Orchid Granite Nimbus Tundra Saffron Quartz Harbor Juniper Cobalt Meadow Ember Lotus Summit Willow Onyx Cedar Aurora Delta Marble'.split()
+
+
+def planted_conversation(turn_count, fact_count=20, seed=0):
+    """Synthetic turns with `fact_count` facts planted at random turns, and the questions asking for them back."""
+    random.seed(seed)
+    turns = list(synthetic_turns(turn_count, seed))
+    facts = []
+    for i, position in enumerate(sorted(random.sample(range(turn_count), fact_count))):
+        project = PROJECTS[i % len(PROJECTS)]
+        secret = f'{random.choice(["red", "blue", "green", "amber"])}-{random.randint(100, 999)}'
+        turns[position] = (
+            {'input': f'Please remember that the code name of project {project} is {secret}.'},
+            {'response': f'Noted, project {project} has code name {secret}.'},
+        )
+        facts.append((f'What is the code name of project {project}?', secret))
+    return turns, facts
+
+
+def benchmark_recall(turn_counts=(1000, 3000), fact_count=20):
+    """Share of planted facts present in the history when asked for, against the history size in tokens."""
+    llm = FakeSummaryModel(latency=0)
+    embeddings = HashingEmbeddings()
+    views = [
+        ('window k=4', lambda: WindowView(k=4)),
+        ('tokens <= 2000', lambda: TokenBudgetView(max_token_limit=2000)),
+        ('summary k=4', lambda: SummaryView(llm, k=4, summary_threshold=1500)),
+        ('retrieval k=2, top 4', lambda: RetrievalView(embeddings, k=2, top_k=4)),
+        ('buffer', lambda: BufferView()),
+    ]
+    for turn_count in turn_counts:
+        turns, facts = planted_conversation(turn_count, fact_count)
+        store = RedisConversationStore(LocalRedis())
+        memory = LogMemory(log=ConversationLog(store, 'recall'), view=BufferView())
+        for inputs, outputs in turns:
+            memory.save_context(inputs, outputs)
+        for name, view in views:
+            memory.view = view()
+            recalled = 0
+            tokens = 0
+            started = time.perf_counter()
+            for question, secret in facts:
+                history = memory.load_memory_variables({'input': question})['history']
+                recalled += secret in history
+                tokens += count_tokens(history)
+            elapsed = (time.perf_counter() - started) / len(facts)
+            print(
+                f'{turn_count} turns | {name:<20} | recall {recalled / len(facts):4.0%}'
+                f' | {tokens // len(facts):>7} history tokens | {elapsed * 1e3:8.2f} ms per question'
+            )
+
+
+if __name__ == '__main__':
+    # python -m utils.conversations [turn count]
+    # python -m utils.conversations recall [turn count ...]
+    if sys.argv[1:2] == ['recall']:
+        benchmark_recall(tuple(int(count) for count in sys.argv[2:]) or (1000, 3000))
+    else:
+        check_views()
+        check_shared_store()
+        benchmark(*(int(argument) for argument in sys.argv[1:2]))
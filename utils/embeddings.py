@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import time
+import queue
+import hashlib
+import threading
+import numpy as np
+from concurrent.futures import Future
+from langchain.embeddings.base import Embeddings
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Content-addressed embedding store: vectors live in a float32 memory-mapped
+    file (one row per text) and `keys.txt` maps row numbers to content hashes.
+    Both files are append-only, so reopening the store only has to read the keys.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.dim = None
+        self._rows = {}
+        self._vectors = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, 'meta.json')
+        self._keys_path = os.path.join(directory, 'keys.txt')
+        self._vectors_path = os.path.join(directory, 'vectors.f32')
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as meta_file:
+                self.dim = json.load(meta_file)['dim']
+            with open(self._keys_path) as keys_file:
+                for row, key in enumerate(keys_file):
+                    self._rows[key.strip()] = row
+            self._map(os.path.getsize(self._vectors_path) // (self.dim * 4))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _map(self, capacity):
+        with open(self._vectors_path, 'ab') as vectors_file:
+            if vectors_file.tell() < capacity * self.dim * 4:
+                vectors_file.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+
+    def get(self, text):
+        row = self._rows.get(content_hash(text))
+        return None if row is None else self._vectors[row]
+
+    def add(self, texts, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self._meta_path, 'w') as meta_file:
+                    json.dump({'dim': self.dim}, meta_file)
+                open(self._keys_path, 'w').close()
+                self._map(max(len(texts), 1024))
+            new_keys = {}
+            for text, vector in zip(texts, vectors):
+                key = content_hash(text)
+                if key in self._rows or key in new_keys:
+                    continue
+                row = len(self._rows) + len(new_keys)
+                if row >= self._vectors.shape[0]:
+                    self._vectors.flush()
+                    self._map(self._vectors.shape[0] * 2)
+                self._vectors[row] = vector
+                new_keys[key] = row
+            self._vectors.flush()
+            # keys are written after the vectors, so a crash never points at an empty row
+            with open(self._keys_path, 'a') as keys_file:
+                keys_file.writelines(key + '\n' for key in new_keys)
+            self._rows.update(new_keys)
+
+
+_CLOSE = object()
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces `submit(text)` calls coming from concurrent threads (Streamlit
+    sessions) into a single `embed_documents` call, flushed as soon as the batch
+    reaches `max_batch_size` texts or the oldest request waited `max_wait` seconds.
+    `close()` flushes the pending requests and stops the worker thread, texts
+    submitted after that are embedded right away in the calling thread.
+    """
+
+    def __init__(self, embed_documents, max_batch_size=64, max_wait=0.02):
+        self.embed_documents = embed_documents
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, text):
+        future = Future()
+        with self._lock:
+            if not self._closed:
+                self._queue.put((text, future))
+                return future
+        try:
+            future.set_result(self.embed_documents([text])[0])
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_CLOSE)
+        self._worker.join()
+
+    def _run(self):
+        closing = False
+        while not closing:
+            item = self._queue.get()
+            if item is _CLOSE:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _CLOSE:
+                    # nothing is queued after the sentinel, so this is the last batch
+                    closing = True
+                    break
+                batch.append(item)
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = dict(zip(texts, self.embed_documents(texts)))
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+            else:
+                for text, future in batch:
+                    future.set_result(vectors[text])
+            self.batches += 1
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local bag-of-words embeddings: every word is hashed to one of `size`
+    dimensions (with a hashed sign), so texts sharing words are similar. No
+    semantics and no API key: for benchmarks and offline demos.
+    """
+
+    def __init__(self, size=512):
+        self.size = size
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r'\w+', text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), 'little')
+            vector[digest % self.size] += 1.0 if digest >> 63 else -1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends to the provider the texts it has never
+    seen before, and batches single queries together through an EmbeddingBatcher.
+    """
+
+    def __init__(self, embeddings, store, max_batch_size=64, max_wait=0.02):
+        self.embeddings = embeddings
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.batcher = EmbeddingBatcher(self.embed_documents, max_batch_size, max_wait)
+
+    def embed_documents(self, texts):
+        vectors = [self.store.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            self.store.add(missing, self.embeddings.embed_documents(missing))
+            vectors = [self.store.get(text) for text in texts]
+        return [vector.tolist() for vector in vectors]
+
+    def embed_query(self, text):
+        vector = self.store.get(text)
+        if vector is not None:
+            self.hits += 1
+            return vector.tolist()
+        return self.batcher.submit(text).result()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'vectors': len(self.store), 'batches': self.batcher.batches}
+
+    def close(self):
+        """Stop the batcher thread (the ClientRegistry calls it when the client is evicted)."""
+        self.batcher.close()
@@ -0,0 +1,166 @@
+import time
+import asyncio
+from langchain.chains import LLMChain
+from langchain.chains import SequentialChain
+from langchain.prompts import ChatPromptTemplate
+from utils.batch import FakeChatModel
+from utils.batch import run_in_loop
+from utils.batch import fake_openai
+
+
+class ChainGraph:
+    """
+    Runs chains as a dependency graph instead of a fixed sequence: a chain
+    depends on the chains producing its `input_keys` (through their
+    `output_key`), and starts as soon as those are done, so chains that only
+    need the original inputs run concurrently and the total latency is the one
+    of the critical path. `timings` has the start/end of every node of the last
+    run, relative to its start.
+    """
+
+    def __init__(self, chains, input_variables, output_variables=None):
+        self.chains = {}
+        for chain in chains:
+            for key in chain.output_keys:
+                if key in self.chains or key in input_variables:
+                    raise ValueError(f'Output key {key} is produced more than once')
+                self.chains[key] = chain
+        self.input_variables = list(input_variables)
+        self.output_variables = output_variables
+        self.dependencies = {}
+        for chain in chains:
+            missing = set(chain.input_keys) - set(self.chains) - set(self.input_variables)
+            if missing:
+                raise ValueError(f'Missing required input keys: {missing}')
+            self.dependencies[self._name(chain)] = sorted({
+                self._name(self.chains[key]) for key in chain.input_keys if key in self.chains
+            })
+        self.order = self._topological_order()
+        self.timings = {}
+
+    @staticmethod
+    def _name(chain):
+        return chain.output_keys[0]
+
+    def _topological_order(self):
+        order = []
+        state = {}
+
+        def visit(name):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f'Chains have a circular dependency through {name}')
+            state[name] = 'visiting'
+            for dependency in self.dependencies[name]:
+                visit(dependency)
+            state[name] = 'done'
+            order.append(name)
+
+        for name in self.dependencies:
+            visit(name)
+        return order
+
+    async def _run_node(self, name, values, tasks, started):
+        await asyncio.gather(*[tasks[dependency] for dependency in self.dependencies[name]])
+        chain = self.chains[name]
+        node_started = time.perf_counter()
+        outputs = await chain.ainvoke({key: values[key] for key in chain.input_keys})
+        node_finished = time.perf_counter()
+        values.update({key: outputs[key] for key in chain.output_keys})
+        self.timings[name] = {
+            'node': name,
+            'depends_on': self.dependencies[name],
+            'started': node_started - started,
+            'finished': node_finished - started,
+            'duration': node_finished - node_started,
+        }
+
+    async def ainvoke(self, inputs):
+        values = dict(inputs)
+        self.timings = {}
+        started = time.perf_counter()
+        tasks = {}
+        # nodes are created in topological order, so every dependency task already exists
+        for name in self.order:
+            tasks[name] = asyncio.ensure_future(self._run_node(name, values, tasks, started))
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+        if self.output_variables is None:
+            return values
+        return {key: values[key] for key in self.input_variables + list(self.output_variables)}
+
+    def invoke(self, inputs):
+        if not isinstance(inputs, dict):
+            inputs = {self.input_variables[0]: inputs}
+        # on the shared loop: a private loop per call would break the cached client's connection pool
+        return run_in_loop(self.ainvoke(inputs))
+
+    def critical_path(self):
+        """The chain of nodes that determined the total latency of the last run, and its duration."""
+        finish = {}
+        previous = {}
+        for name in self.order:
+            # the dependency finishing last is the one this node waited for
+            slowest = max(self.dependencies[name], key=lambda dependency: finish[dependency], default=None)
+            finish[name] = (finish[slowest] if slowest else 0) + self.timings[name]['duration']
+            previous[name] = slowest
+        name = max(finish, key=finish.get)
+        total = finish[name]
+        path = []
+        while name:
+            path.append(name)
+            name = previous[name]
+        return path[::-1], total
+
+
+def check_shared_client(runs=3):
+    """Graph runs one after the other on the same cached ChatOpenAI client."""
+    from utils.clients import get_chat_openai
+    with fake_openai() as server:
+        chat = get_chat_openai('sk-check', temperature=0.9)
+        chains = [
+            LLMChain(llm=chat, prompt=ChatPromptTemplate.from_template('Title for {movie}'), output_key='movie_title'),
+            LLMChain(llm=chat, prompt=ChatPromptTemplate.from_template('Plot of {movie}'), output_key='plot'),
+            LLMChain(llm=chat, prompt=ChatPromptTemplate.from_template('Tweet about {movie_title}: {plot}'), output_key='tweet'),
+        ]
+        graph = ChainGraph(chains, input_variables=['movie'])
+        for run in range(runs):
+            graph.invoke({'movie': f'Movie {run}'})
+        print(f'{runs} graph runs on the same client | {server.requests} requests | no errors')
+
+
+def benchmark(latency=0.2, runs=5):
+    def chain(template, output_key):
+        return LLMChain(llm=FakeChatModel(latency=latency), prompt=ChatPromptTemplate.from_template(template), output_key=output_key)
+
+    chains = [
+        chain('Come up with an alternative name for the movie {movie}', 'movie_title'),
+        chain('Summarize the plot of {movie} in one sentence', 'plot'),
+        chain('What is the genre of {movie}?', 'genre'),
+        chain('Write a short advertisement for {movie_title}, a {genre} movie: {plot}', 'trailer'),
+        chain('Write a tweet announcing {movie_title}', 'tweet'),
+    ]
+    output_variables = ['movie_title', 'plot', 'genre', 'trailer', 'tweet']
+    sequential_chain = SequentialChain(chains=chains, input_variables=['movie'], output_variables=output_variables)
+    graph = ChainGraph(chains, input_variables=['movie'], output_variables=output_variables)
+    for name, run in [('SequentialChain', sequential_chain), ('ChainGraph', graph)]:
+        started = time.perf_counter()
+        for i in range(runs):
+            outputs = run.invoke({'movie': f'Movie {i}'})
+        elapsed = (time.perf_counter() - started) / runs
+        assert set(output_variables) <= set(outputs)
+        print(f'{len(chains)} chains | {name:<15} | {elapsed:6.3f}s per input')
+    path, total = graph.critical_path()
+    print(f'critical path {" -> ".join(path)}: {total:.3f}s')
+    for timing in graph.timings.values():
+        print(f'  {timing}')
+
+
+if __name__ == '__main__':
+    # python -m utils.graph
+    check_shared_client()
+    benchmark()
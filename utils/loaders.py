@@ -0,0 +1,254 @@
+import io
+import os
+import sys
+import csv
+import time
+import pypdf
+import itertools
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from pypdf.generic import NameObject
+from pypdf.generic import StreamObject
+from pypdf.generic import DictionaryObject
+from langchain.schema import Document
+from langchain.document_loaders.base import BaseLoader
+
+
+class UploadedFileLoader(BaseLoader):
+    """
+    Base class for loaders reading straight from an in-memory upload (a Streamlit
+    UploadedFile, or any binary file-like object) instead of a path on disk, so
+    there's no need to copy the upload into a temporary file first. Each
+    reader works on its own buffer over the upload's bytes, so several readers
+    (or suspended iterators) of the same upload never share a cursor. Plain
+    paths are accepted too, and are streamed from disk.
+    """
+
+    def __init__(self, file, source=None):
+        self.file = file
+        self.source = source or (str(file) if isinstance(file, (str, os.PathLike)) else getattr(file, 'name', None))
+
+    @contextmanager
+    def _binary(self):
+        if isinstance(self.file, (str, os.PathLike)):
+            with open(self.file, 'rb') as binary_file:
+                yield binary_file
+        else:
+            # every reader gets its own cursor: Streamlit keeps the same UploadedFile across reruns, and a
+            # suspended lazy_load() iterator must not be moved by another reader of the same upload
+            if hasattr(self.file, 'getvalue'):
+                data = self.file.getvalue()
+            else:
+                self.file.seek(0)
+                data = self.file.read()
+            yield io.BytesIO(data)
+
+    @contextmanager
+    def _text(self, encoding):
+        with self._binary() as binary_file:
+            with io.TextIOWrapper(binary_file, encoding=encoding, newline='') as wrapper:
+                yield wrapper
+
+
+class UploadedTextLoader(UploadedFileLoader):
+    """Same output as TextLoader: the whole file as a single Document."""
+
+    def __init__(self, file, source=None, encoding='utf-8'):
+        super().__init__(file, source)
+        self.encoding = encoding
+
+    def lazy_load(self):
+        with self._text(self.encoding) as text_file:
+            yield Document(page_content=text_file.read(), metadata={'source': self.source})
+
+
+class UploadedCSVLoader(UploadedFileLoader):
+    """
+    Same output as CSVLoader by default: one Document per row, parsed while
+    iterating. Rows are read `chunk_size` at a time, `content_columns` and
+    `metadata_columns` choose where each column goes, and `metadata_types` maps
+    metadata columns to a conversion function (eg. {'price': float}).
+    """
+
+    def __init__(self, file, source=None, encoding='utf-8', csv_args=None, content_columns=None,
+                 metadata_columns=(), metadata_types=None, chunk_size=1000):
+        super().__init__(file, source)
+        self.encoding = encoding
+        self.csv_args = csv_args or {}
+        self.content_columns = content_columns
+        self.metadata_columns = metadata_columns
+        self.metadata_types = metadata_types or {}
+        self.chunk_size = chunk_size
+
+    def columns(self):
+        with self._text(self.encoding) as csv_file:
+            return [column.strip() for column in next(csv.reader(csv_file, **self.csv_args), [])]
+
+    def _column_indexes(self, header, columns):
+        try:
+            return [(column, header.index(column)) for column in columns]
+        except ValueError as error:
+            raise ValueError(f'Column not found in CSV file: {error}')
+
+    def _convert(self, column, value):
+        if value is None or column not in self.metadata_types:
+            return value
+        try:
+            return self.metadata_types[column](value)
+        except ValueError:
+            return None
+
+    def lazy_load_chunks(self):
+        """Yield lists of up to `chunk_size` Documents, handy for batched splitting and embedding."""
+        with self._text(self.encoding) as csv_file:
+            reader = csv.reader(csv_file, **self.csv_args)
+            header = [column.strip() for column in next(reader, [])]
+            content_columns = self.content_columns or [column for column in header if column not in self.metadata_columns]
+            content_indexes = self._column_indexes(header, content_columns)
+            metadata_indexes = self._column_indexes(header, self.metadata_columns)
+            row_number = 0
+            while True:
+                rows = list(itertools.islice(reader, self.chunk_size))
+                if not rows:
+                    break
+                chunk = []
+                for row in rows:
+                    values = [value.strip() for value in row] + [None] * (len(header) - len(row))
+                    metadata = {'source': self.source, 'row': row_number}
+                    for column, index in metadata_indexes:
+                        metadata[column] = self._convert(column, values[index])
+                    content = '\n'.join(f'{column}: {values[index]}' for column, index in content_indexes)
+                    chunk.append(Document(page_content=content, metadata=metadata))
+                    row_number += 1
+                yield chunk
+
+    def lazy_load(self):
+        for chunk in self.lazy_load_chunks():
+            yield from chunk
+
+
+class UploadedPDFLoader(UploadedFileLoader):
+    """Same output as PyPDFLoader: one Document per page, extracted while iterating."""
+
+    def lazy_load(self):
+        with self._binary() as pdf_file:
+            reader = pypdf.PdfReader(pdf_file)
+            for page_number, page in enumerate(reader.pages):
+                yield Document(page_content=page.extract_text(), metadata={'source': self.source, 'page': page_number})
+
+
+_worker_reader = None
+
+
+def _init_pdf_worker(data):
+    global _worker_reader
+    _worker_reader = pypdf.PdfReader(io.BytesIO(data))
+
+
+def _extract_pages(page_range):
+    return [_worker_reader.pages[page_number].extract_text() for page_number in range(*page_range)]
+
+
+class ParallelPDFLoader(UploadedPDFLoader):
+    """
+    PDF loader splitting the page ranges across a process pool, since text
+    extraction is CPU-bound. Each worker parses the PDF once, and documents are
+    still yielded in page order with the same metadata as UploadedPDFLoader.
+    Pages are extracted eagerly: the pool is shut down before the first
+    document is yielded, so a suspended `lazy_load()` never keeps processes
+    alive (eg. in Streamlit's session state).
+    """
+
+    def __init__(self, file, source=None, max_workers=None, pages_per_task=16):
+        super().__init__(file, source)
+        self.max_workers = max_workers
+        self.pages_per_task = pages_per_task
+
+    def load(self):
+        with self._binary() as pdf_file:
+            data = pdf_file.read()
+        page_count = len(pypdf.PdfReader(io.BytesIO(data)).pages)
+        page_ranges = [
+            (start, min(start + self.pages_per_task, page_count))
+            for start in range(0, page_count, self.pages_per_task)
+        ]
+        with ProcessPoolExecutor(self.max_workers, initializer=_init_pdf_worker, initargs=(data,)) as executor:
+            texts = [text for page_texts in executor.map(_extract_pages, page_ranges) for text in page_texts]
+        return [
+            Document(page_content=text, metadata={'source': self.source, 'page': page_number})
+            for page_number, text in enumerate(texts)
+        ]
+
+    def lazy_load(self):
+        yield from self.load()
+
+
+def sample_pdf(page_count, lines_per_page=40):
+    """Build an in-memory PDF with `page_count` pages of text, for benchmarks."""
+    writer = pypdf.PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    }))
+    for page_number in range(page_count):
+        page = writer.add_blank_page(612, 792)
+        lines = ' '.join(
+            f'({f"Page {page_number} line {line}: the quick brown fox jumps over the lazy dog"}) Tj 0 -16 Td'
+            for line in range(lines_per_page)
+        )
+        content = StreamObject()
+        content.set_data(f'BT /F1 10 Tf 40 760 Td {lines} ET'.encode())
+        page[NameObject('/Contents')] = writer._add_object(content)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        })
+    output = io.BytesIO()
+    writer.write(output)
+    output.seek(0)
+    return output
+
+
+def benchmark_pdf(page_counts=(200, 500)):
+    for page_count in page_counts:
+        pdf = sample_pdf(page_count)
+        for name, loader in [('sequential', UploadedPDFLoader(pdf)), ('parallel', ParallelPDFLoader(pdf))]:
+            started = time.perf_counter()
+            docs = loader.load()
+            elapsed = time.perf_counter() - started
+            print(f'{page_count:>7} pages | {name:<10} | {elapsed:6.2f}s | {page_count / elapsed:10.1f} pages/s')
+        assert [doc.metadata['page'] for doc in docs] == list(range(page_count))
+
+
+def benchmark_csv(row_counts=(100_000, 1_000_000)):
+    for row_count in row_counts:
+        csv_file = io.BytesIO()
+        text = io.TextIOWrapper(csv_file, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(['id', 'name', 'review', 'rating', 'price', 'country'])
+        for i in range(row_count):
+            writer.writerow([i, f'customer {i}', f'review number {i}, the service was great', i % 5, f'{i % 100}.99', 'IT'])
+        text.detach()
+        loaders = [
+            ('all columns', UploadedCSVLoader(csv_file)),
+            ('projected', UploadedCSVLoader(
+                csv_file,
+                content_columns=['review'],
+                metadata_columns=['id', 'rating', 'price'],
+                metadata_types={'id': int, 'rating': int, 'price': float},
+            )),
+        ]
+        for name, loader in loaders:
+            started = time.perf_counter()
+            rows = sum(1 for _ in loader.lazy_load())
+            elapsed = time.perf_counter() - started
+            print(f'{rows:>7} rows  | {name:<11} | {elapsed:6.2f}s | {rows / elapsed:10.1f} rows/s')
+
+
+if __name__ == '__main__':
+    # python -m utils.loaders pdf|csv [size ...]
+    sizes = tuple(int(size) for size in sys.argv[2:])
+    if sys.argv[1:2] == ['csv']:
+        benchmark_csv(sizes or (100_000, 1_000_000))
+    else:
+        benchmark_pdf(sizes or (200, 500))
@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from langchain.schema import Document
+from utils.embeddings import content_hash
+from utils.splitters import sample_text
+from utils.splitters import SpanTextSplitter
+
+
+# where a document sits in its source: it says nothing about its content, so it's never part of the hash
+POSITIONAL_METADATA = ('page', 'row', 'start_line')
+
+
+def document_hash(doc):
+    metadata = {key: value for key, value in doc.metadata.items() if key not in POSITIONAL_METADATA}
+    return content_hash(doc.page_content + '\x00' + json.dumps(metadata, sort_keys=True, default=str))
+
+
+def document_key(doc, position, id_key=None):
+    if id_key is not None:
+        if id_key not in doc.metadata:
+            raise ValueError(f'Document without the id key {id_key}: {doc.metadata}')
+        return f'{id_key}:{doc.metadata[id_key]}'
+    # a row inserted or deleted shifts the rows after it, so rows are keyed by their content
+    if 'row' in doc.metadata:
+        return f'content:{document_hash(doc)}'
+    # pages keep their number across edits, code chunks their first line, other documents fall back to their position
+    for name in ('page', 'start_line'):
+        if name in doc.metadata:
+            return f'{name}:{doc.metadata[name]}'
+    return f'position:{position}'
+
+
+class IngestionManifest:
+    """
+    Remembers, for every source (eg. an uploaded file name), the content hash of
+    each of its documents (pages, rows...) and the ids of the chunks they were
+    split into. `update()` only re-splits the documents whose hash changed, and
+    returns the chunks to add and the chunk ids to delete from the vector store.
+    `ingest()` does the same, but only records the new state once the caller
+    has stored the chunks, so a failed embedding or save is retried next time.
+    """
+
+    def __init__(self, path, lock_timeout=600):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # an ingestion holds the write lock while the chunks are embedded, so other processes wait for it
+        self._conn = sqlite3.connect(path, timeout=lock_timeout, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS documents (
+                source TEXT NOT NULL,
+                document TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                chunk_ids TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (source, document)
+            )
+        ''')
+        self._conn.commit()
+
+    def _load(self, source):
+        rows = self._conn.execute('SELECT document, hash, chunk_ids FROM documents WHERE source = ?', (source,))
+        return {document: (hash_, json.loads(chunk_ids)) for document, hash_, chunk_ids in rows}
+
+    @contextmanager
+    def ingest(self, source, docs, splitter, id_key=None):
+        """
+        Compare `docs` with what was ingested last time from `source`, and yield
+        `(chunks, removed_ids, report)`: the new chunks (with an `id` in their
+        metadata), the ids of the chunks that no longer exist, and the counts of
+        skipped and reprocessed documents and chunks. The manifest is updated
+        when the block exits without an exception, and left untouched otherwise.
+        Other ingestions wait for the block to finish. Documents are matched by
+        their `id_key` metadata when given (eg. an id column of a CSV file), by
+        page or content otherwise (see `document_key`).
+        """
+        report = {
+            'documents_skipped': 0,
+            'documents_processed': 0,
+            'documents_removed': 0,
+            'chunks_kept': 0,
+            'chunks_added': 0,
+            'chunks_removed': 0,
+        }
+        chunks = []
+        removed_ids = []
+        rows = []
+        with self._lock:
+            # the write lock is taken before reading, so concurrent ingestions (from other sessions or processes
+            # sharing the manifest and its vector store) run one after the other instead of overwriting each other
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                previous = self._load(source)
+                seen = set()
+                duplicates = {}
+                for position, doc in enumerate(docs):
+                    key = document_key(doc, position, id_key)
+                    if key in seen:
+                        # identical rows (or a repeated id) are still distinct documents
+                        duplicates[key] = duplicates.get(key, 0) + 1
+                        key = f'{key}-{duplicates[key]}'
+                    hash_ = document_hash(doc)
+                    seen.add(key)
+                    if key in previous and previous[key][0] == hash_:
+                        report['documents_skipped'] += 1
+                        report['chunks_kept'] += len(previous[key][1])
+                        continue
+                    report['documents_processed'] += 1
+                    old_ids = set(previous.get(key, (None, []))[1])
+                    chunk_ids = []
+                    occurrences = {}
+                    for chunk in splitter.split_documents([doc]):
+                        # the same text twice in a document gets two ids
+                        base_id = content_hash(f'{source}\x00{key}\x00{chunk.page_content}')
+                        occurrences[base_id] = occurrences.get(base_id, -1) + 1
+                        chunk_id = f'{base_id}-{occurrences[base_id]}'
+                        chunk_ids.append(chunk_id)
+                        if chunk_id in old_ids:
+                            report['chunks_kept'] += 1
+                        else:
+                            chunks.append(Document(page_content=chunk.page_content, metadata={**chunk.metadata, 'id': chunk_id}))
+                    removed_ids.extend(old_ids.difference(chunk_ids))
+                    rows.append((source, key, hash_, json.dumps(chunk_ids), time.time()))
+                for key in previous.keys() - seen:
+                    report['documents_removed'] += 1
+                    removed_ids.extend(previous[key][1])
+                report['chunks_added'] = len(chunks)
+                report['chunks_removed'] = len(removed_ids)
+                yield chunks, removed_ids, report
+                self._conn.executemany('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)', rows)
+                self._conn.executemany(
+                    'DELETE FROM documents WHERE source = ? AND document = ?',
+                    [(source, key) for key in previous.keys() - seen],
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def update(self, source, docs, splitter, id_key=None):
+        """Same as `ingest()`, for chunks that are not stored anywhere: the manifest is updated right away."""
+        with self.ingest(source, docs, splitter, id_key) as result:
+            return result
+
+    def forget(self, source):
+        with self._lock:
+            self._conn.execute('DELETE FROM documents WHERE source = ?', (source,))
+            self._conn.commit()
+
+
+def benchmark(page_count=2_000, edited=20):
+    """Full re-ingestion against a manifest update after editing a few pages of a large document set."""
+    text = sample_text(page_count * 3_000)
+    docs = [
+        Document(page_content=text[start:start + 3_000], metadata={'source': 'sample.pdf', 'page': page})
+        for page, start in enumerate(range(0, page_count * 3_000, 3_000))
+    ]
+    splitter = SpanTextSplitter(chunk_size=500, chunk_overlap=50)
+    manifest = IngestionManifest(':memory:')
+    started = time.perf_counter()
+    chunks, _, report = manifest.update('sample.pdf', docs, splitter)
+    print(f'{page_count:>6} pages | first load  | {time.perf_counter() - started:6.2f}s | {report}')
+    for page in range(0, page_count, page_count // edited):
+        docs[page] = Document(page_content=docs[page].page_content.replace('fox', 'cat', 1), metadata=docs[page].metadata)
+    started = time.perf_counter()
+    try:
+        with manifest.ingest('sample.pdf', docs, splitter):
+            raise OSError('vector store save failed')
+    except OSError:
+        pass
+    chunks, removed_ids, report = manifest.update('sample.pdf', docs, splitter)
+    print(f'{page_count:>6} pages | {edited} edited  | {time.perf_counter() - started:6.2f}s | {report}')
+    # the failed ingestion above did not record the edited pages
+    assert report['documents_processed'] == len(range(0, page_count, page_count // edited))
+
+
+def check_rows(row_count=1_000):
+    """Inserting a row at the top of a CSV file only processes that row, by content or by id column."""
+    def rows(values):
+        return [
+            Document(page_content=f'id: {value}\nreview: review number {value}', metadata={'source': 'reviews.csv', 'row': row, 'id': value})
+            for row, value in enumerate(values)
+        ]
+
+    splitter = SpanTextSplitter(chunk_size=500, chunk_overlap=50)
+    for id_key in (None, 'id'):
+        manifest = IngestionManifest(':memory:')
+        manifest.update('reviews.csv', rows(range(row_count)), splitter, id_key)
+        _, removed_ids, report = manifest.update('reviews.csv', rows([-1, *range(row_count)]), splitter, id_key)
+        assert (report['documents_processed'], report['documents_skipped'], removed_ids) == (1, row_count, []), report
+        print(f'{row_count:>6} rows  | 1 inserted | keyed by {id_key or "content"} | {report}')
+
+
+if __name__ == '__main__':
+    # python -m utils.manifest [page count]
+    check_rows()
+    benchmark(*(int(argument) for argument in sys.argv[1:2]))
@@ -0,0 +1,233 @@
+import sys
+import time
+import random
+from typing import Any
+from collections import deque
+from collections import namedtuple
+from langchain.schema import BaseMemory
+from langchain.schema import BasePromptTemplate
+from langchain.schema.language_model import BaseLanguageModel
+from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationSummaryMemory
+from langchain.memory import ConversationTokenBufferMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.memory.utils import get_prompt_input_key
+from langchain_core.pydantic_v1 import Field
+from utils.batch import FakeChatModel
+from utils.tokens import get_encoding
+from utils.tokens import count_tokens
+
+# a piece of the history, `text` is how it appears in the prompt and `tokens` its count, computed once
+Line = namedtuple('Line', ['text', 'tokens'])
+
+
+def make_lines(memory, inputs, outputs):
+    """The human and AI messages of a chain run, formatted like get_buffer_string() does."""
+    input_key = memory.input_key or get_prompt_input_key(inputs, memory.memory_variables)
+    output_key = memory.output_key or next(iter(outputs))
+    texts = [f'{memory.human_prefix}: {inputs[input_key]}', f'{memory.ai_prefix}: {outputs[output_key]}']
+    return [Line(text, count_tokens(text, memory.encoding_name)) for text in texts]
+
+
+def make_turn(memory, inputs, outputs):
+    """A whole exchange (both messages) as a single Line, counted as the sum of its messages."""
+    lines = make_lines(memory, inputs, outputs)
+    return Line('\n'.join(line.text for line in lines), sum(line.tokens for line in lines))
+
+
+class RollingSummaryMemory(BaseMemory):
+    """
+    The last `k` turns are kept verbatim in a ring buffer, older turns are
+    folded into a running summary. Evicted turns are not summarized one by one:
+    they wait (still verbatim in the prompt) until they add up to
+    `summary_threshold` tokens, then a single LLM call folds them all into the
+    summary. Token counts are computed once per turn, so the prompt size and the
+    number of summarization calls per turn stay flat in long sessions.
+    """
+
+    llm: BaseLanguageModel
+    k: int = 4
+    summary_threshold: int = 400
+    prompt: BasePromptTemplate = SUMMARY_PROMPT
+    memory_key: str = 'history'
+    human_prefix: str = 'Human'
+    ai_prefix: str = 'AI'
+    input_key: Any = None
+    output_key: Any = None
+    encoding_name: str = 'cl100k_base'
+    summary: str = ''
+    summary_tokens: int = 0
+    summary_calls: int = 0
+    turns: Any = Field(default_factory=deque)
+    pending: Any = Field(default_factory=list)
+    pending_tokens: int = 0
+    buffer_tokens: int = 0
+
+    @property
+    def memory_variables(self):
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs):
+        lines = [f'System: {self.summary}'] if self.summary else []
+        lines += [turn.text for turn in self.pending]
+        lines += [turn.text for turn in self.turns]
+        return {self.memory_key: '\n'.join(lines)}
+
+    def save_context(self, inputs, outputs):
+        turn = make_turn(self, inputs, outputs)
+        self.turns.append(turn)
+        self.buffer_tokens += turn.tokens
+        if len(self.turns) > self.k:
+            evicted = self.turns.popleft()
+            self.buffer_tokens -= evicted.tokens
+            self.pending.append(evicted)
+            self.pending_tokens += evicted.tokens
+        if self.pending_tokens >= self.summary_threshold:
+            self._fold_pending()
+
+    def _fold_pending(self):
+        new_lines = '\n'.join(turn.text for turn in self.pending)
+        self.summary = self.llm.predict(self.prompt.format(summary=self.summary, new_lines=new_lines)).strip()
+        self.summary_tokens = count_tokens(self.summary, self.encoding_name)
+        self.summary_calls += 1
+        self.pending = []
+        self.pending_tokens = 0
+
+    def history_tokens(self):
+        return self.summary_tokens + self.pending_tokens + self.buffer_tokens
+
+    def clear(self):
+        self.summary = ''
+        self.summary_tokens = 0
+        self.turns.clear()
+        self.pending = []
+        self.pending_tokens = 0
+        self.buffer_tokens = 0
+
+
+class TokenBufferMemory(BaseMemory):
+    """
+    The most recent messages fitting in `max_token_limit` tokens, like
+    ConversationTokenBufferMemory. Each message is stored with its token count
+    (computed once, with the cached tiktoken counter) and the total is kept up
+    to date, so pruning only pops messages from the left instead of counting
+    the whole buffer again after every message: O(1) amortized per message.
+
+    Tokens are counted on the "Human: ..." / "AI: ..." lines of the history.
+    That's what ConversationTokenBufferMemory does with a plain LLM, so both
+    keep the same messages (the benchmark checks it), but with ChatOpenAI it
+    counts the messages like the chat API does, with a few tokens of overhead
+    per message, and keeps a few messages less for the same limit.
+    """
+
+    max_token_limit: int = 2000
+    memory_key: str = 'history'
+    human_prefix: str = 'Human'
+    ai_prefix: str = 'AI'
+    input_key: Any = None
+    output_key: Any = None
+    encoding_name: str = 'cl100k_base'
+    messages: Any = Field(default_factory=deque)
+    total_tokens: int = 0
+
+    @property
+    def memory_variables(self):
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs):
+        return {self.memory_key: '\n'.join(message.text for message in self.messages)}
+
+    def save_context(self, inputs, outputs):
+        for message in make_lines(self, inputs, outputs):
+            self.messages.append(message)
+            self.total_tokens += message.tokens
+        while self.total_tokens > self.max_token_limit:
+            self.total_tokens -= self.messages.popleft().tokens
+
+    def clear(self):
+        self.messages.clear()
+        self.total_tokens = 0
+
+
+class FakeSummaryModel(FakeChatModel):
+    """
+    Fake chat model summarizing by keeping the last `summary_words` words of the
+    summary prompt. It counts tokens with tiktoken on every call, like ChatOpenAI.
+    """
+
+    summary_words: int = 60
+    encoding_name: str = 'cl100k_base'
+
+    def _reply(self, messages):
+        return ' '.join(messages[-1].content.split()[-self.summary_words:])
+
+    def get_num_tokens(self, text):
+        return len(get_encoding(self.encoding_name).encode(text))
+
+
+def synthetic_turns(count, seed=0):
+    random.seed(seed)
+    words = 'project deadline budget invoice design feature bug release client meeting server database'.split()
+    for i in range(count):
+        question = f'Turn {i}: what about the ' + ' '.join(random.choices(words, k=random.randint(5, 25))) + '?'
+        answer = 'Sure, ' + ' '.join(random.choices(words, k=random.randint(10, 40))) + '.'
+        yield {'input': question}, {'response': answer}
+
+
+def benchmark(turn_count=500, latency=0.0):
+    llm = FakeSummaryModel(latency=latency)
+    memories = [
+        ('ConversationBufferMemory', lambda: ConversationBufferMemory()),
+        ('ConversationSummaryMemory', lambda: ConversationSummaryMemory(llm=llm)),
+        ('RollingSummaryMemory', lambda: RollingSummaryMemory(llm=llm, k=4, summary_threshold=1500)),
+    ]
+    for name, factory in memories:
+        memory = factory()
+        llm.calls = 0
+        checkpoints = {}
+        started = time.perf_counter()
+        for i, (inputs, outputs) in enumerate(synthetic_turns(turn_count), start=1):
+            history = memory.load_memory_variables(inputs)['history']
+            memory.save_context(inputs, outputs)
+            if i in (10, 100, turn_count):
+                checkpoints[i] = count_tokens(history)
+        elapsed = time.perf_counter() - started
+        print(
+            f'{turn_count} turns | {name:<26} | {llm.calls:>4} summary calls'
+            f' | history tokens at turn ' + ', '.join(f'{i}: {tokens:>6}' for i, tokens in checkpoints.items())
+            + f' | {elapsed:6.2f}s'
+        )
+
+
+def benchmark_tokens(turn_count=1000, max_token_limit=2000, conversations=3):
+    llm = FakeSummaryModel()
+    memories = [
+        ('ConversationTokenBufferMemory', lambda: ConversationTokenBufferMemory(llm=llm, max_token_limit=max_token_limit)),
+        ('TokenBufferMemory', lambda: TokenBufferMemory(max_token_limit=max_token_limit)),
+    ]
+    histories = {}
+    for name, factory in memories:
+        elapsed = 0.0
+        for seed in range(conversations):
+            memory = factory()
+            histories[name, seed] = []
+            started = time.perf_counter()
+            for inputs, outputs in synthetic_turns(turn_count, seed):
+                memory.save_context(inputs, outputs)
+                histories[name, seed].append(memory.load_memory_variables(inputs)['history'])
+            elapsed += time.perf_counter() - started
+        print(
+            f'{conversations} x {turn_count} turns | {max_token_limit} tokens | {name:<29}'
+            f' | {elapsed / (conversations * turn_count) * 1e6:8.1f} µs per turn'
+        )
+    for seed in range(conversations):
+        assert histories['ConversationTokenBufferMemory', seed] == histories['TokenBufferMemory', seed]
+
+
+if __name__ == '__main__':
+    # python -m utils.memory [turn count]
+    # python -m utils.memory tokens [turn count]
+    if sys.argv[1:2] == ['tokens']:
+        benchmark_tokens(*(int(argument) for argument in sys.argv[2:3]))
+    else:
+        benchmark(*(int(argument) for argument in sys.argv[1:2]))
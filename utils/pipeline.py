@@ -0,0 +1,212 @@
+import sys
+import time
+import random
+import asyncio
+from langchain.chains import LLMChain
+from langchain.chains import SequentialChain
+from langchain.prompts import ChatPromptTemplate
+from utils.batch import BatchRunner
+from utils.batch import FakeChatModel
+from utils.batch import drain
+from utils.batch import fake_openai
+from utils.batch import iterate_in_loop
+from utils.batch import invoke_with_retries
+
+_DONE = object()
+
+
+class PipelineRunner:
+    """
+    Run a SequentialChain (or a list of chains) over many inputs as a pipeline:
+    every chain is a stage with its own workers (`max_concurrency`, one value
+    or one per stage) reading from a bounded queue (`queue_size`), so an input
+    enters stage 2 as soon as its stage 1 output is ready, while the others are
+    still in stage 1. Full queues block the stage before them (backpressure).
+
+    Results are `(index, values, error)` tuples, `values` holding the inputs and
+    every output key like `SequentialChain.__call__` does. `stats` has the
+    throughput and, for each stage, the counts and the queue depth.
+    """
+
+    def __init__(self, chain, max_concurrency=8, queue_size=16, bucket=None, max_retries=5, base_delay=1.0, max_delay=30.0):
+        self.chains = chain.chains if isinstance(chain, SequentialChain) else list(chain)
+        self.max_concurrency = (
+            list(max_concurrency) if isinstance(max_concurrency, (list, tuple)) else [max_concurrency] * len(self.chains)
+        )
+        self.queue_size = queue_size
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {}
+
+    def _inputs(self, item):
+        return item if isinstance(item, dict) else {self.chains[0].input_keys[0]: item}
+
+    async def _worker(self, stage, queues, results):
+        chain = self.chains[stage]
+        stats = self.stats['stages'][stage]
+        output = queues[stage + 1] if stage + 1 < len(self.chains) else results
+        while True:
+            stats['depth_total'] += queues[stage].qsize()
+            stats['depth_samples'] += 1
+            item = await queues[stage].get()
+            if item is _DONE:
+                return
+            index, values = item
+            started = time.perf_counter()
+            try:
+                outputs = await invoke_with_retries(
+                    chain, {key: values[key] for key in chain.input_keys}, stats,
+                    self.bucket, self.max_retries, self.base_delay, self.max_delay,
+                )
+            except Exception as error:
+                stats['failed'] += 1
+                # a failed input skips the remaining stages
+                await results.put((index, values, error))
+                continue
+            finally:
+                stats['busy'] += time.perf_counter() - started
+            stats['completed'] += 1
+            values = {**values, **{key: outputs[key] for key in chain.output_keys}}
+            if output is results:
+                self.stats['completed'] += 1
+                await results.put((index, values, None))
+            else:
+                await output.put((index, values))
+                self.stats['stages'][stage + 1]['max_depth'] = max(self.stats['stages'][stage + 1]['max_depth'], output.qsize())
+
+    async def _stage(self, stage, queues, results):
+        await asyncio.gather(*[self._worker(stage, queues, results) for _ in range(self.max_concurrency[stage])])
+        if stage + 1 < len(self.chains):
+            for _ in range(self.max_concurrency[stage + 1]):
+                await queues[stage + 1].put(_DONE)
+
+    async def _feed(self, inputs, queue):
+        for index, item in enumerate(inputs):
+            await queue.put((index, self._inputs(item)))
+            self.stats['stages'][0]['max_depth'] = max(self.stats['stages'][0]['max_depth'], queue.qsize())
+        for _ in range(self.max_concurrency[0]):
+            await queue.put(_DONE)
+
+    async def astream(self, inputs, ordered=True):
+        self.stats = {
+            'completed': 0,
+            'started': time.perf_counter(),
+            'stages': [
+                {
+                    'name': chain.output_keys[0],
+                    'completed': 0,
+                    'failed': 0,
+                    'retries': 0,
+                    'busy': 0.0,
+                    'max_depth': 0,
+                    'depth_total': 0,
+                    'depth_samples': 0,
+                }
+                for chain in self.chains
+            ],
+        }
+        queues = [asyncio.Queue(self.queue_size) for _ in self.chains]
+        queue = asyncio.Queue()
+        running = asyncio.ensure_future(asyncio.gather(
+            self._feed(inputs, queues[0]),
+            *[self._stage(stage, queues, queue) for stage in range(len(self.chains))],
+        ))
+        results = drain(queue, running, ordered)
+        try:
+            async for result in results:
+                yield result
+        finally:
+            await results.aclose()
+
+    def stream(self, inputs, ordered=True):
+        """Blocking iterator over `astream()`, run on the shared event loop (see `utils.batch.get_event_loop`)."""
+        return iterate_in_loop(self.astream(inputs, ordered))
+
+    def report(self):
+        """Throughput of the last run, and for each stage its counts, busy time and mean/max queue depth."""
+        elapsed = time.perf_counter() - self.stats['started']
+        return {
+            'completed': self.stats['completed'],
+            'elapsed': elapsed,
+            'throughput': self.stats['completed'] / elapsed,
+            'stages': [
+                {
+                    'stage': stats['name'],
+                    'completed': stats['completed'],
+                    'failed': stats['failed'],
+                    'retries': stats['retries'],
+                    'busy': stats['busy'],
+                    'mean_depth': stats['depth_total'] / max(stats['depth_samples'], 1),
+                    'max_depth': stats['max_depth'],
+                }
+                for stats in self.stats['stages']
+            ],
+        }
+
+
+def check_shared_client(runs=3):
+    """Pipelines, then a batch, one after the other on the same cached ChatOpenAI client."""
+    from utils.clients import get_chat_openai
+    with fake_openai() as server:
+        chat = get_chat_openai('sk-check', temperature=0.9)
+        chains = [
+            LLMChain(llm=chat, prompt=ChatPromptTemplate.from_template('Title for {movie}'), output_key='movie_title'),
+            LLMChain(llm=chat, prompt=ChatPromptTemplate.from_template('Tweet about {movie_title}'), output_key='tweet'),
+        ]
+        for run in range(runs):
+            errors = [error for _, _, error in PipelineRunner(chains, max_concurrency=4).stream([f'Movie {i}' for i in range(8)]) if error]
+            assert not errors, f'run {run}: {errors[0]!r}'
+        errors = [error for _, _, error in BatchRunner(chains[0], max_concurrency=4).stream([f'Movie {i}' for i in range(8)]) if error]
+        assert not errors, f'batch: {errors[0]!r}'
+        print(f'{runs} pipelines and a batch on the same client | {server.requests} requests | no errors')
+
+
+def benchmark(input_count=500, latencies=(0.1, 0.2)):
+    random.seed(0)
+    first_chain = LLMChain(
+        llm=FakeChatModel(latency=latencies[0]),
+        prompt=ChatPromptTemplate.from_template('Come up with an alternative name for the movie {movie}'),
+        output_key='movie_title',
+    )
+    second_chain = LLMChain(
+        llm=FakeChatModel(latency=latencies[1]),
+        prompt=ChatPromptTemplate.from_template('Write a short advertisement of the movie {movie_title}'),
+        output_key='trailer',
+    )
+    sequential_chain = SequentialChain(
+        chains=[first_chain, second_chain],
+        input_variables=['movie'],
+        output_variables=['movie_title', 'trailer'],
+    )
+    movies = [f'Movie {i}' for i in range(input_count)]
+
+    def measure(name, stream):
+        started = time.perf_counter()
+        first = None
+        count = 0
+        for _ in stream:
+            first = first or time.perf_counter() - started
+            count += 1
+        elapsed = time.perf_counter() - started
+        assert count == input_count
+        print(f'{input_count:>5} inputs | {name:<38} | {elapsed:6.2f}s | first result {first:5.2f}s | {count / elapsed:6.1f} inputs/s')
+
+    # stage after stage: every title first, then every trailer
+    def stage_by_stage():
+        titles = BatchRunner(first_chain, max_concurrency=16).run(movies)
+        yield from BatchRunner(second_chain, max_concurrency=16).stream(titles)
+
+    measure('stage by stage, 16 + 16 workers', stage_by_stage())
+    measure('whole SequentialChain, 32 workers', BatchRunner(sequential_chain, max_concurrency=32).stream(movies))
+    pipeline = PipelineRunner(sequential_chain, max_concurrency=[11, 21])
+    measure('pipeline, 11 + 21 workers', pipeline.stream(movies))
+    for stage in pipeline.report()['stages']:
+        print(f'{"":>12} | {stage}')
+
+
+if __name__ == '__main__':
+    # python -m utils.pipeline [input count]
+    check_shared_client()
+    benchmark(*(int(argument) for argument in sys.argv[1:2]))
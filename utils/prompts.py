@@ -0,0 +1,172 @@
+import sys
+import json
+import timeit
+import hashlib
+from string import Formatter
+from functools import lru_cache
+from langchain.prompts import ChatPromptTemplate
+from langchain.schema import AIMessage
+from langchain.schema import BaseMessage
+from langchain.schema import HumanMessage
+from langchain.schema import SystemMessage
+from langchain.prompts.chat import AIMessagePromptTemplate
+from langchain.prompts.chat import HumanMessagePromptTemplate
+from langchain.prompts.chat import SystemMessagePromptTemplate
+from langchain.output_parsers import ResponseSchema
+from langchain.output_parsers import StructuredOutputParser
+
+MESSAGE_TYPES = {
+    HumanMessagePromptTemplate: HumanMessage,
+    AIMessagePromptTemplate: AIMessage,
+    SystemMessagePromptTemplate: SystemMessage,
+}
+
+
+def compile_segments(template):
+    """Split an f-string template into literal strings and variable names (in a 1-tuple)."""
+    segments = []
+    for literal, field, format_spec, conversion in Formatter().parse(template):
+        if literal:
+            segments.append(literal)
+        if field is not None:
+            if format_spec or conversion or not field.isidentifier():
+                raise ValueError(f'Only plain {{variable}} fields can be compiled, got {{{field}}}')
+            segments.append((field,))
+    return segments
+
+
+class CompiledChatPrompt:
+    """
+    A ChatPromptTemplate parsed once into a list of segments per message, so
+    formatting is just a join of literals and values (no template parsing, no
+    validation). `partial()` renders variables that never change, like the
+    format instructions of an output parser, into the literal parts.
+    `format_messages()` returns the same messages as the original template.
+    """
+
+    def __init__(self, prompt_template, partial_variables=None):
+        self.prompt_template = prompt_template
+        self.messages = []
+        for message in prompt_template.messages:
+            if isinstance(message, BaseMessage):
+                self.messages.append((None, [message]))
+            elif type(message) in MESSAGE_TYPES and message.prompt.template_format == 'f-string':
+                self.messages.append((MESSAGE_TYPES[type(message)], compile_segments(message.prompt.template)))
+            else:
+                raise ValueError(f'{type(message).__name__} messages can not be compiled')
+        if partial_variables:
+            self._render_partial(partial_variables)
+
+    def _render_partial(self, values):
+        for i, (message_type, segments) in enumerate(self.messages):
+            if message_type is None:
+                continue
+            merged = []
+            for segment in segments:
+                if isinstance(segment, tuple) and segment[0] in values:
+                    segment = str(values[segment[0]])
+                if isinstance(segment, str) and merged and isinstance(merged[-1], str):
+                    merged[-1] += segment
+                else:
+                    merged.append(segment)
+            self.messages[i] = (message_type, merged)
+
+    @property
+    def input_variables(self):
+        return sorted({
+            segment[0]
+            for message_type, segments in self.messages if message_type is not None
+            for segment in segments if isinstance(segment, tuple)
+        })
+
+    def partial(self, **values):
+        compiled = CompiledChatPrompt.__new__(CompiledChatPrompt)
+        compiled.prompt_template = self.prompt_template
+        compiled.messages = list(self.messages)
+        compiled._render_partial(values)
+        return compiled
+
+    def format_messages(self, **values):
+        try:
+            return [
+                segments[0] if message_type is None else message_type(content=''.join([
+                    segment if segment.__class__ is str else str(values[segment[0]]) for segment in segments
+                ]))
+                for message_type, segments in self.messages
+            ]
+        except KeyError as error:
+            raise KeyError(f'Missing prompt variable: {error}')
+
+
+@lru_cache(maxsize=256)
+def compile_template(template):
+    """`ChatPromptTemplate.from_template(template)`, parsed and compiled once per process."""
+    return CompiledChatPrompt(ChatPromptTemplate.from_template(template))
+
+
+def schema_hash(response_schemas):
+    return hashlib.sha256(json.dumps(
+        [[schema.name, schema.description, schema.type] for schema in response_schemas]
+    ).encode()).hexdigest()
+
+
+_format_instructions = {}
+
+
+def get_format_instructions(response_schemas):
+    """Format instructions of a StructuredOutputParser, built once per distinct schema list."""
+    key = schema_hash(response_schemas)
+    if key not in _format_instructions:
+        _format_instructions[key] = StructuredOutputParser.from_response_schemas(response_schemas).get_format_instructions()
+    return _format_instructions[key]
+
+
+def benchmark(number=20_000):
+    review_template = """\
+The following text is a review from a customer reviewing a service
+provided by a developer, extract the following information:
+
+satisfied: Was the customer satisfied with the service provided? \
+Answer True if yes, False if no, null if unclear.
+
+keywords: Extract any adjective to satisfaction, dissatisfaction, value provided, \
+issues related to the service provided, and output them as a comma separated list.
+
+text: {text}
+
+{format_instructions}
+"""
+    response_schemas = [
+        ResponseSchema(name='satisfied', description='Was the customer satisfied with the service provided?'),
+        ResponseSchema(name='keywords', description='The 3 most relevant adjectives, as a comma separated list.'),
+    ]
+    review_text = 'Great work, delivered on time and very responsive. ' * 5
+
+    def rerun():
+        # what the page does on every Streamlit rerun today
+        format_instructions = StructuredOutputParser.from_response_schemas(response_schemas).get_format_instructions()
+        prompt_template = ChatPromptTemplate.from_template(template=review_template)
+        return prompt_template.format_messages(text=review_text, format_instructions=format_instructions)
+
+    def compiled_rerun():
+        prompt = compile_template(review_template).partial(format_instructions=get_format_instructions(response_schemas))
+        return prompt.format_messages(text=review_text)
+
+    prompt_template = ChatPromptTemplate.from_template(template=review_template)
+    format_instructions = get_format_instructions(response_schemas)
+    compiled = compile_template(review_template).partial(format_instructions=format_instructions)
+    assert rerun() == compiled_rerun() == compiled.format_messages(text=review_text)
+    cases = [
+        ('rerun: from_template + instructions + format', rerun),
+        ('rerun: cached compiled template', compiled_rerun),
+        ('format_messages only', lambda: prompt_template.format_messages(text=review_text, format_instructions=format_instructions)),
+        ('compiled format_messages only', lambda: compiled.format_messages(text=review_text)),
+    ]
+    for name, function in cases:
+        elapsed = min(timeit.repeat(function, number=number, repeat=3))
+        print(f'{name:<46} | {elapsed / number * 1e6:8.2f} µs per call')
+
+
+if __name__ == '__main__':
+    # python -m utils.prompts [number]
+    benchmark(*(int(argument) for argument in sys.argv[1:2]))
@@ -0,0 +1,284 @@
+import os
+import re
+import sys
+import time
+import random
+import itertools
+import shutil
+import tempfile
+import zipfile
+from bisect import bisect_left
+from collections import deque
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from langchain.schema import Document
+from langchain.text_splitter import Language
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.document_loaders.base import BaseLoader
+from utils.splitters import SpanTextSplitter
+
+
+LANGUAGE_EXTENSIONS = {
+    '.c': Language.CPP,
+    '.h': Language.CPP,
+    '.cc': Language.CPP,
+    '.cpp': Language.CPP,
+    '.hpp': Language.CPP,
+    '.cs': Language.CSHARP,
+    '.go': Language.GO,
+    '.java': Language.JAVA,
+    '.kt': Language.KOTLIN,
+    '.js': Language.JS,
+    '.jsx': Language.JS,
+    '.mjs': Language.JS,
+    '.ts': Language.TS,
+    '.tsx': Language.TS,
+    '.php': Language.PHP,
+    '.proto': Language.PROTO,
+    '.py': Language.PYTHON,
+    '.rst': Language.RST,
+    '.rb': Language.RUBY,
+    '.rs': Language.RUST,
+    '.scala': Language.SCALA,
+    '.swift': Language.SWIFT,
+    '.md': Language.MARKDOWN,
+    '.tex': Language.LATEX,
+    '.html': Language.HTML,
+    '.htm': Language.HTML,
+    '.sol': Language.SOL,
+    '.cbl': Language.COBOL,
+    '.lua': Language.LUA,
+    '.hs': Language.HASKELL,
+}
+
+EXCLUDED_DIRECTORIES = ('.git', '.hg', '.svn', 'node_modules', '__pycache__', '.venv', 'venv', 'dist', 'build')
+
+
+_worker_splitters = {}
+
+
+def _split_files(files, chunk_size, chunk_overlap):
+    """Split a batch of `(path, language)` files, in a worker process."""
+    results = []
+    for path, language in files:
+        started = time.perf_counter()
+        try:
+            with open(path, encoding='utf-8') as code_file:
+                text = code_file.read()
+                # bytes on disk, not characters: the two differ for non-ASCII sources
+                size = os.fstat(code_file.fileno()).st_size
+        except (OSError, UnicodeDecodeError):
+            # binary or unreadable files are skipped, like DirectoryLoader(silent_errors=True) does
+            continue
+        key = (language, chunk_size, chunk_overlap)
+        if key not in _worker_splitters:
+            _worker_splitters[key] = SpanTextSplitter(
+                RecursiveCharacterTextSplitter.get_separators_for_language(language),
+                is_separator_regex=True,
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+            )
+        newlines = [match.start() for match in re.finditer('\n', text)]
+        chunks = [
+            (text[start:end], bisect_left(newlines, start) + 1, bisect_left(newlines, end - 1) + 1)
+            for start, end in _worker_splitters[key].split_spans(text)
+        ]
+        results.append((path, language, size, chunks, time.perf_counter() - started))
+    return results
+
+
+class RepositoryLoader(BaseLoader):
+    """
+    Walk a source tree and split every file with the LangChain separators of its
+    language (picked by extension), sharing the files across a process pool.
+    Documents are yielded while the workers go on, with the file path, language
+    and line range in the metadata. `report` holds per-language totals.
+    """
+
+    def __init__(self, path, chunk_size=1000, chunk_overlap=0, max_workers=None, files_per_task=64,
+                 extensions=None, excluded_directories=EXCLUDED_DIRECTORIES, max_file_size=1_000_000):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_workers = max_workers
+        self.files_per_task = files_per_task
+        self.extensions = extensions or LANGUAGE_EXTENSIONS
+        self.excluded_directories = set(excluded_directories)
+        self.max_file_size = max_file_size
+        self.report = {}
+
+    def files(self):
+        for directory, directories, file_names in os.walk(self.path):
+            directories[:] = sorted(name for name in directories if name not in self.excluded_directories)
+            for file_name in sorted(file_names):
+                language = self.extensions.get(os.path.splitext(file_name)[1].lower())
+                if language is None:
+                    continue
+                path = os.path.join(directory, file_name)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    # broken symlinks, or files removed while walking
+                    continue
+                if size <= self.max_file_size:
+                    yield path, language
+
+    def _tasks(self):
+        batch = []
+        for file in self.files():
+            batch.append(file)
+            if len(batch) == self.files_per_task:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def lazy_load(self):
+        self.report = defaultdict(lambda: {'files': 0, 'bytes': 0, 'chunks': 0, 'seconds': 0.0})
+        with ProcessPoolExecutor(self.max_workers) as executor:
+            # keep a few batches in flight per worker, so a slow consumer doesn't pile up results
+            in_flight = 2 * (self.max_workers or os.cpu_count() or 1)
+            pending = deque()
+            tasks = self._tasks()
+            for files in itertools.islice(tasks, in_flight):
+                pending.append(executor.submit(_split_files, files, self.chunk_size, self.chunk_overlap))
+            while pending:
+                results = pending.popleft().result()
+                for files in itertools.islice(tasks, 1):
+                    pending.append(executor.submit(_split_files, files, self.chunk_size, self.chunk_overlap))
+                for path, language, size, chunks, seconds in results:
+                    report = self.report[language.value]
+                    report['files'] += 1
+                    report['bytes'] += size
+                    report['chunks'] += len(chunks)
+                    report['seconds'] += seconds
+                    source = os.path.relpath(path, self.path)
+                    for text, start_line, end_line in chunks:
+                        yield Document(page_content=text, metadata={
+                            'source': source,
+                            'language': language.value,
+                            'start_line': start_line,
+                            'end_line': end_line,
+                        })
+        self.report = dict(self.report)
+
+
+class ZipRepositoryLoader(RepositoryLoader):
+    """
+    RepositoryLoader over an uploaded zip archive (a path or a binary file-like
+    object), extracted into a temporary directory that is removed once the
+    documents are loaded. Archives expanding to more than `max_archive_size`
+    bytes are rejected with a ValueError before anything is written.
+    """
+
+    def __init__(self, file, max_archive_size=200_000_000, **kwargs):
+        super().__init__(None, **kwargs)
+        self.file = file
+        self.max_archive_size = max_archive_size
+
+    def lazy_load(self):
+        with zipfile.ZipFile(self.file) as archive:
+            if sum(member.file_size for member in archive.infolist()) > self.max_archive_size:
+                raise ValueError(f'The archive expands to more than {self.max_archive_size} bytes')
+            with tempfile.TemporaryDirectory() as directory:
+                # extractall() drops absolute paths and ".." components, so nothing is written outside the directory
+                archive.extractall(directory)
+                self.path = directory
+                yield from super().lazy_load()
+
+
+SAMPLE_CODE = {
+    Language.PYTHON: ('''
+class Service{n}:
+
+    def __init__(self, client):
+        self.client = client
+
+    def fetch(self, key):
+        """Fetch one value from the remote service."""
+        if key in self.client.cache:
+            return self.client.cache[key]
+        return self.client.get(f"/items/{{key}}")
+''', '.py'),
+    Language.JS: ('''
+function handler{n}(request, response) {{
+  const items = request.body.items.map((item) => item.id);
+  if (items.length === 0) {{
+    return response.status(400).send("empty");
+  }}
+  return response.json({{ items }});
+}}
+''', '.js'),
+    Language.GO: ('''
+func Handler{n}(w http.ResponseWriter, r *http.Request) {{
+	items := make([]string, 0)
+	for _, item := range r.URL.Query()["item"] {{
+		items = append(items, item)
+	}}
+	json.NewEncoder(w).Encode(items)
+}}
+''', '.go'),
+    Language.MARKDOWN: ('''
+## Section {n}
+
+Some documentation about the module, with a list of steps:
+
+- install the package
+- configure the client
+- run the service
+''', '.md'),
+}
+
+
+def sample_repository(directory, file_count, blocks_per_file=(5, 60)):
+    """Write `file_count` source files in a few languages under `directory`, for benchmarks."""
+    random.seed(0)
+    languages = list(SAMPLE_CODE)
+    for i in range(file_count):
+        template, extension = SAMPLE_CODE[languages[i % len(languages)]]
+        package = os.path.join(directory, f'package{i % 100}')
+        os.makedirs(package, exist_ok=True)
+        with open(os.path.join(package, f'module{i}{extension}'), 'w') as code_file:
+            code_file.write(''.join(template.format(n=n) for n in range(random.randint(*blocks_per_file))))
+
+
+def benchmark(file_counts=(2_000, 20_000), chunk_size=1000):
+    for file_count in file_counts:
+        directory = tempfile.mkdtemp()
+        try:
+            sample_repository(directory, file_count)
+            # a dangling symlink is skipped like any unreadable file
+            os.symlink(os.path.join(directory, 'missing.py'), os.path.join(directory, 'broken.py'))
+            loader = RepositoryLoader(directory, chunk_size=chunk_size)
+            started = time.perf_counter()
+            sequential = 0
+            splitters = {}
+            for path, language in loader.files():
+                if language not in splitters:
+                    splitters[language] = RecursiveCharacterTextSplitter.from_language(language, chunk_size=chunk_size, chunk_overlap=0)
+                with open(path, encoding='utf-8') as code_file:
+                    sequential += len(splitters[language].split_text(code_file.read()))
+            sequential_elapsed = time.perf_counter() - started
+            started = time.perf_counter()
+            parallel = sum(1 for _ in loader.lazy_load())
+            parallel_elapsed = time.perf_counter() - started
+            assert parallel == sequential
+            archive = shutil.make_archive(os.path.join(tempfile.gettempdir(), 'repository'), 'zip', directory)
+            try:
+                assert sum(1 for _ in ZipRepositoryLoader(archive, chunk_size=chunk_size).lazy_load()) == sequential
+            finally:
+                os.remove(archive)
+            print(f'{file_count:>7} files | from_language loop | {sequential_elapsed:6.2f}s | {file_count / sequential_elapsed:8.0f} files/s')
+            print(f'{file_count:>7} files | RepositoryLoader   | {parallel_elapsed:6.2f}s | {file_count / parallel_elapsed:8.0f} files/s')
+            for language, report in sorted(loader.report.items()):
+                print(
+                    f'{"":>13} | {language:<10} | {report["files"]:>6} files | {report["chunks"]:>7} chunks'
+                    f' | {report["bytes"] / 1e6 / report["seconds"]:6.2f} MB/s per worker'
+                )
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    # python -m utils.repository [file count ...]
+    benchmark(tuple(int(file_count) for file_count in sys.argv[1:]) or (2_000, 20_000))
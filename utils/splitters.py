@@ -0,0 +1,336 @@
+import re
+import sys
+import time
+import logging
+import random
+import numpy as np
+from bisect import bisect_left
+from bisect import bisect_right
+from operator import sub
+from itertools import accumulate
+from langchain.text_splitter import TextSplitter
+from langchain.text_splitter import CharacterTextSplitter
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils.tokens import count_tokens_batch
+
+
+class SeparatorIndex:
+    """
+    Positions of every match of a separator in a text, computed once per separator
+    (lazily, the first time it's needed) with a vectorized scan over the text
+    code points. Sub-ranges of the text are then split by bisecting these
+    positions instead of running a regex again on a copy of the sub-string.
+    """
+
+    def __init__(self, text, is_separator_regex=False):
+        self.text = text
+        self.is_separator_regex = is_separator_regex
+        self._codes = None
+        self._matches = {}
+        self._scanned = {}
+
+    def _literal_matches(self, separator):
+        if self._codes is None:
+            self._codes = np.frombuffer(self.text.encode('utf-32-le'), dtype=np.uint32)
+        length = len(separator)
+        if length > len(self._codes):
+            return np.empty(0, dtype=np.int64)
+        mask = self._codes[:len(self._codes) - length + 1] == ord(separator[0])
+        for offset in range(1, length):
+            mask &= self._codes[offset:len(self._codes) - length + 1 + offset] == ord(separator[offset])
+        starts = np.flatnonzero(mask)
+        if length > 1 and len(starts) > 1 and (np.diff(starts) < length).any():
+            # overlapping candidates (eg. "\n\n" in "\n\n\n"): keep the leftmost ones, like re does
+            kept = []
+            next_free = -1
+            for start in starts.tolist():
+                if start >= next_free:
+                    kept.append(start)
+                    next_free = start + length
+            starts = np.array(kept, dtype=np.int64)
+        return starts
+
+    def _index(self, separator):
+        if separator not in self._matches:
+            if self.is_separator_regex:
+                starts, ends = self._scan(separator, 0, len(self.text))
+            else:
+                starts = self._literal_matches(separator)
+                ends = starts + len(separator)
+            self._matches[separator] = (np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64), list(starts), list(ends))
+        return self._matches[separator]
+
+    def _scan(self, separator, start, end, arrays=False):
+        pattern = re.compile(separator if self.is_separator_regex else re.escape(separator))
+        found = [
+            (match.start(), match.end())
+            for match in pattern.finditer(self.text, start, end)
+            if match.end() > match.start()
+        ]
+        starts, ends = [match_start for match_start, _ in found], [match_end for _, match_end in found]
+        if arrays:
+            return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+        return starts, ends
+
+    def matches(self, separator, start, end, arrays=False):
+        """Return the starts and ends of the separator matches inside text[start:end] (as lists, or NumPy arrays)."""
+        if separator not in self._matches:
+            # deeper separators are often only needed on a few long pieces: scan those
+            # directly, and index the whole text only once they cover a good part of it
+            self._scanned[separator] = self._scanned.get(separator, 0) + end - start
+            if self._scanned[separator] < len(self.text) // 4:
+                return self._scan(separator, start, end, arrays)
+        start_array, end_array, starts, ends = self._index(separator)
+        first = bisect_left(starts, start)
+        last = bisect_left(starts, end, first)
+        if (first > 0 and ends[first - 1] > start) or (last > first and ends[last - 1] > end):
+            # a match crosses the range border: rescan just this range (no copy needed)
+            return self._scan(separator, start, end, arrays)
+        if arrays:
+            return start_array[first:last], end_array[first:last]
+        return starts[first:last], ends[first:last]
+
+
+class SpanTextSplitter(TextSplitter):
+    """
+    Character splitter working on `(start, end)` offsets into the original text.
+    With `recursive=True` it follows RecursiveCharacterTextSplitter, otherwise
+    CharacterTextSplitter (only the first separator is used). Chunks are only
+    turned into strings by `split_text()`, `split_spans()` returns the offsets.
+
+    The recursive output is the same as RecursiveCharacterTextSplitter. The
+    character output is the same as CharacterTextSplitter as long as the
+    separator doesn't repeat: with `keep_separator=False` a run of repeated
+    separators stays as it is in the text (and counts in the chunk length)
+    instead of being collapsed into a single separator, so chunks can end at
+    different places (see `check_equivalence`).
+    """
+
+    def __init__(self, separators=None, recursive=True, is_separator_regex=False, keep_separator=None, **kwargs):
+        if keep_separator is None:
+            keep_separator = recursive
+        super().__init__(keep_separator=keep_separator, **kwargs)
+        if self._length_function is not len:
+            raise ValueError('SpanTextSplitter measures chunks with _measure(), length_function must be len')
+        self._separators = separators or (['\n\n', '\n', ' ', ''] if recursive else ['\n\n'])
+        self._recursive = recursive
+        self._is_separator_regex = is_separator_regex
+
+    def _pieces(self, index, separator, start, end, matches=None):
+        """Offsets of the pieces of text[start:end] split by `separator`, empty ones dropped."""
+        if separator == '':
+            return list(range(start, end)), list(range(start + 1, end + 1))
+        if not self._keep_separator:
+            match_starts, match_ends = index.matches(separator, start, end, arrays=True)
+            starts = np.concatenate(([start], match_ends))
+            ends = np.concatenate((match_starts, [end]))
+            non_empty = ends > starts
+            return starts[non_empty].tolist(), ends[non_empty].tolist()
+        match_starts, match_ends = matches or index.matches(separator, start, end)
+        # separators are glued to the next piece, so only the first piece can be empty
+        if match_starts and match_starts[0] == start:
+            return match_starts, match_starts[1:] + [end]
+        return [start] + match_starts, match_starts + [end]
+
+    def _strip(self, text, start, end):
+        if self._strip_whitespace:
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+        return start, end
+
+    def _measure(self, text, starts, ends):
+        """
+        Positions on the length scale such that pieces i..j measure rights[j] - lefts[i].
+        For characters they are the offsets themselves.
+        """
+        return starts, ends
+
+    def _merge(self, text, starts, ends, lefts, rights, chunks):
+        """
+        Same algorithm as TextSplitter._merge_splits, but instead of adding pieces
+        one by one each chunk boundary is found with a binary search on the offsets.
+        """
+        count = len(starts)
+        first = 0
+        while first < count:
+            # extend the chunk as long as it fits (the first piece always goes in)
+            last = max(bisect_right(rights, lefts[first] + self._chunk_size) - 1, first)
+            chunk_start, chunk_end = self._strip(text, starts[first], ends[last])
+            if chunk_end > chunk_start:
+                chunks.append((chunk_start, chunk_end))
+            if last == count - 1:
+                break
+            # drop pieces from the front until the rest fits in the overlap and leaves room for the next one
+            first = min(max(
+                bisect_left(lefts, rights[last] - self._chunk_overlap),
+                bisect_left(lefts, rights[last + 1] - self._chunk_size),
+                first + 1,
+            ), last + 1)
+
+    def _split(self, index, start, end, level, chunks):
+        separator = self._separators[-1]
+        next_level = len(self._separators)
+        matches = None
+        for i in range(level, len(self._separators)):
+            if self._separators[i] == '':
+                separator = ''
+                break
+            matches = index.matches(self._separators[i], start, end)
+            if matches[0]:
+                separator = self._separators[i]
+                next_level = i + 1
+                break
+        starts, ends = self._pieces(index, separator, start, end, matches)
+        lefts, rights = self._measure(index.text, starts, ends)
+        # runs of pieces shorter than chunk_size get merged, the longer ones are split again
+        long_pieces = [piece for piece, length in enumerate(map(sub, rights, lefts)) if length >= self._chunk_size]
+        previous = 0
+        for piece in long_pieces:
+            if piece > previous:
+                self._merge(
+                    index.text, starts[previous:piece], ends[previous:piece],
+                    lefts[previous:piece], rights[previous:piece], chunks,
+                )
+            if next_level >= len(self._separators):
+                chunks.append((starts[piece], ends[piece]))
+            else:
+                self._split(index, starts[piece], ends[piece], next_level, chunks)
+            previous = piece + 1
+        if previous < len(starts):
+            self._merge(index.text, starts[previous:], ends[previous:], lefts[previous:], rights[previous:], chunks)
+
+    def split_spans(self, text):
+        index = SeparatorIndex(text, self._is_separator_regex)
+        chunks = []
+        if self._recursive:
+            self._split(index, 0, len(text), 0, chunks)
+        else:
+            starts, ends = self._pieces(index, self._separators[0], 0, len(text))
+            self._merge(text, starts, ends, *self._measure(text, starts, ends), chunks)
+        return chunks
+
+    def split_text(self, text):
+        return [text[start:end] for start, end in self.split_spans(text)]
+
+
+class TokenBudgetSplitter(SpanTextSplitter):
+    """
+    Recursive splitter measuring `chunk_size` and `chunk_overlap` in tiktoken
+    tokens. Each piece is tokenized once (counts are cached per piece text) and
+    chunks are packed by summing the piece counts, instead of re-encoding every
+    candidate chunk like `length_function=tiktoken_len` does.
+    """
+
+    def __init__(self, encoding_name='cl100k_base', **kwargs):
+        super().__init__(**kwargs)
+        self._encoding_name = encoding_name
+
+    def _measure(self, text, starts, ends):
+        counts = count_tokens_batch([text[start:end] for start, end in zip(starts, ends)], self._encoding_name)
+        rights = list(accumulate(counts))
+        return list(map(sub, rights, counts)), rights
+
+
+def sample_text(size):
+    random.seed(0)
+    words = 'the quick brown fox jumps over lazy dog language model chain prompt memory vector'.split()
+    paragraphs = []
+    length = 0
+    while length < size:
+        sentences = [' '.join(random.choices(words, k=random.randint(5, 25))) + '.' for _ in range(random.randint(1, 8))]
+        paragraph = '\n'.join(sentences)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return '\n\n'.join(paragraphs)
+
+
+def benchmark(sizes=(1_000_000, 5_000_000), settings=((100, 20), (1000, 200))):
+    for size in sizes:
+        text = sample_text(size)
+        for chunk_size, chunk_overlap in settings:
+            splitters = [
+                ('character', CharacterTextSplitter(separator=' ', chunk_size=chunk_size, chunk_overlap=chunk_overlap),
+                 SpanTextSplitter([' '], recursive=False, chunk_size=chunk_size, chunk_overlap=chunk_overlap)),
+                ('recursive', RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap),
+                 SpanTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)),
+            ]
+            for name, langchain_splitter, span_splitter in splitters:
+                started = time.perf_counter()
+                expected = langchain_splitter.split_text(text)
+                langchain_elapsed = time.perf_counter() - started
+                started = time.perf_counter()
+                spans = span_splitter.split_spans(text)
+                span_elapsed = time.perf_counter() - started
+                assert [text[start:end] for start, end in spans] == expected
+                print(
+                    f'{len(text) / 1e6:5.1f} MB | {name:<9} {chunk_size:>5}/{chunk_overlap:<4}'
+                    f' | langchain {len(text) / 1e6 / langchain_elapsed:7.2f} MB/s'
+                    f' | spans {len(text) / 1e6 / span_elapsed:7.2f} MB/s | {len(spans)} chunks'
+                )
+
+
+def benchmark_tokens(sizes=(1_000_000,), settings=((100, 20), (500, 50)), encoding_name='cl100k_base'):
+    """Token counting throughput (cold and cached), then chunk counts of token and character budgets."""
+    for size in sizes:
+        text = sample_text(size)
+        pieces = text.split('\n')
+        for name, texts in [('cold', pieces), ('cached', pieces)]:
+            started = time.perf_counter()
+            tokens = sum(count_tokens_batch(texts, encoding_name))
+            elapsed = time.perf_counter() - started
+            print(f'{len(text) / 1e6:5.1f} MB | count {name:<6} | {tokens / elapsed / 1e6:7.2f} M tokens/s | {tokens} tokens')
+        for chunk_size, chunk_overlap in settings:
+            splitters = [
+                ('tiktoken length_function', RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+                    encoding_name=encoding_name, chunk_size=chunk_size, chunk_overlap=chunk_overlap)),
+                ('token budget', TokenBudgetSplitter(encoding_name, chunk_size=chunk_size, chunk_overlap=chunk_overlap)),
+                ('characters (x4)', SpanTextSplitter(chunk_size=4 * chunk_size, chunk_overlap=4 * chunk_overlap)),
+            ]
+            for name, splitter in splitters:
+                started = time.perf_counter()
+                chunks = splitter.split_text(text)
+                elapsed = time.perf_counter() - started
+                counts = count_tokens_batch(chunks, encoding_name)
+                print(
+                    f'{len(text) / 1e6:5.1f} MB | {name:<24} {chunk_size:>4}/{chunk_overlap:<3}'
+                    f' | {len(text) / 1e6 / elapsed:7.2f} MB/s | {len(chunks)} chunks'
+                    f' | max {max(counts)} tokens | over budget {sum(count > chunk_size for count in counts)}'
+                )
+
+
+def check_equivalence(cases=3000):
+    """Random texts with runs of separators: recursive chunks always match, character ones only without runs."""
+    random.seed(0)
+    differences = {'recursive': 0, 'character': 0, 'character without runs': 0}
+    # LangChain logs every chunk longer than chunk_size, and tiny chunk sizes make plenty of them
+    logging.disable(logging.WARNING)
+    try:
+        for _ in range(cases):
+            words = [''.join(random.choices('abc', k=random.randint(1, 6))) for _ in range(random.randint(1, 60))]
+            text = ''.join(word + random.choice([' ', '  ', '\n', '\n\n', ' \n']) for word in words)
+            chunk_size = random.randint(5, 40)
+            chunk_overlap = random.randint(0, chunk_size // 2)
+            separator = random.choice([' ', '\n', '\n\n'])
+            expected = CharacterTextSplitter(separator=separator, chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_text(text)
+            chunks = SpanTextSplitter([separator], recursive=False, chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_text(text)
+            if chunks != expected:
+                differences['character'] += 1
+                differences['character without runs'] += separator * 2 not in text
+            expected = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_text(text)
+            differences['recursive'] += SpanTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_text(text) != expected
+    finally:
+        logging.disable(logging.NOTSET)
+    assert differences['recursive'] == differences['character without runs'] == 0, differences
+    print(f'{cases} random texts | chunks different from LangChain: {differences}')
+
+
+if __name__ == '__main__':
+    # python -m utils.splitters [size ...]
+    # python -m utils.splitters tokens [size ...]
+    if sys.argv[1:2] == ['tokens']:
+        benchmark_tokens(tuple(int(size) for size in sys.argv[2:]) or (1_000_000,))
+    else:
+        check_equivalence()
+        benchmark(tuple(int(size) for size in sys.argv[1:]) or (1_000_000, 5_000_000))
@@ -0,0 +1,93 @@
+import time
+from langchain.callbacks.base import BaseCallbackHandler
+from utils.cache import stream_with_cache
+
+
+class TokenRenderer:
+    """
+    Renders a response into a Streamlit container (eg. `st.empty()`) while its
+    tokens arrive, refreshing it at most every `min_interval` seconds, and
+    measures the time to the first token. `finish()` writes the final text, so
+    what stays on screen is the same as the non-streamed response.
+    """
+
+    def __init__(self, container, render='markdown', min_interval=0.05, cursor='▌'):
+        self.container = container
+        self.render = render
+        self.min_interval = min_interval
+        self.cursor = cursor
+        self.start()
+
+    def start(self):
+        self.text = ''
+        self.tokens = 0
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.elapsed = None
+        self._refreshed = 0.0
+
+    def _show(self, text):
+        getattr(self.container, self.render)(text)
+
+    def add(self, token):
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now - self.started
+        self.text += token
+        self.tokens += 1
+        if now - self._refreshed >= self.min_interval:
+            self._refreshed = now
+            self._show(self.text + self.cursor)
+
+    def finish(self, text=None):
+        # a response coming from the cache (or a model that can't stream) arrives all at once
+        if text is not None and not self.tokens:
+            self.text = text
+            self.first_token = time.perf_counter() - self.started
+        self.elapsed = time.perf_counter() - self.started
+        self._show(self.text)
+        return self.text
+
+    def stats(self):
+        return {'first_token': self.first_token, 'elapsed': self.elapsed, 'tokens': self.tokens}
+
+    def caption(self):
+        # an empty answer has no first token (and a stream cut short is never finished)
+        first_token, elapsed = ('–' if value is None else f'{value:.2f}s' for value in (self.first_token, self.elapsed))
+        return f'First token after {first_token} · {self.tokens} tokens streamed in {elapsed}'
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """
+    Callback handler feeding a TokenRenderer from `on_llm_new_token`, for chains
+    (eg. ConversationChain.predict) whose model was created with `streaming=True`.
+    """
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.renderer.start()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.renderer.start()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.renderer.add(token)
+
+    def on_llm_end(self, response, **kwargs):
+        self.renderer.finish(response.generations[0][0].text)
+
+
+def stream_response(llm, prompt, container, render='markdown'):
+    """
+    Call `llm.stream(prompt)` rendering the response as it arrives, returns
+    `(text, renderer)`. The model cache is used like `invoke()` would: a cached
+    response is rendered at once (see `stream_with_cache`).
+    """
+    renderer = TokenRenderer(container, render)
+    for chunk in stream_with_cache(llm, prompt):
+        # LLMs stream strings, chat models stream message chunks
+        renderer.add(getattr(chunk, 'content', chunk))
+    renderer.finish()
+    return renderer.text, renderer
@@ -0,0 +1,258 @@
+import re
+import sys
+import json
+import time
+from langchain.schema import HumanMessage
+from langchain.schema import OutputParserException
+from langchain.output_parsers import ResponseSchema
+from langchain.output_parsers import StructuredOutputParser
+from langchain.output_parsers.json import parse_and_check_json_markdown
+from utils.cache import stream_with_cache
+
+_VALUE_START = re.compile(r'["{\[\-0-9tfn]')
+
+
+class StreamingJSONParser:
+    """
+    Incremental parser for the JSON object a StructuredOutputParser asks for
+    (optionally wrapped in a ```json fence). Feed it the tokens as they arrive:
+    `feed()` returns the `(key, value)` pairs completed by that token, and
+    raises OutputParserException as soon as the text can't become a valid
+    object anymore, so the caller can stop the generation right there.
+    """
+
+    def __init__(self, expected_keys, max_preamble=200):
+        self.expected_keys = list(expected_keys)
+        self.max_preamble = max_preamble
+        self.values = {}
+        self.done = False
+        self._buffer = ''
+        self._position = 0
+        # before_object, key, colon, value, after_value, finished
+        self._state = 'before_object'
+        self._key = None
+        self._value_start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def _fail(self, reason):
+        raise OutputParserException(f'Got invalid JSON object: {reason}, after {self._buffer[-80:]!r}')
+
+    def feed(self, token):
+        self._buffer += token
+        completed = []
+        buffer = self._buffer
+        while self._position < len(buffer):
+            character = buffer[self._position]
+            state = self._state
+            if state == 'value':
+                if self._consume_value(character):
+                    completed.append(self._finish_value(self._position))
+                    continue
+            elif state == 'key':
+                if self._escaped:
+                    self._escaped = False
+                elif character == '\\':
+                    self._escaped = True
+                elif character == '"':
+                    self._key = json.loads(buffer[self._value_start:self._position + 1], strict=False)
+                    self._state = 'colon'
+            elif character.isspace():
+                pass
+            elif state == 'before_object':
+                if character == '{':
+                    self._state = 'after_value'
+                    self._expect_key = True
+                elif self._position >= self.max_preamble:
+                    self._fail('no JSON object found')
+            elif state == 'after_value':
+                if character == '}':
+                    self._state = 'finished'
+                    self._check_keys()
+                elif character == ',' and not self._expect_key:
+                    self._expect_key = True
+                elif character == '"' and self._expect_key:
+                    self._state = 'key'
+                    self._value_start = self._position
+                else:
+                    self._fail(f'unexpected {character!r} between fields')
+            elif state == 'colon':
+                if character != ':':
+                    self._fail(f'expected ":" after key {self._key!r}')
+                self._state = 'value'
+                self._value_start = None
+            elif state == 'finished':
+                # trailing text (eg. the closing fence) is ignored, like StructuredOutputParser does
+                break
+            self._position += 1
+        return completed
+
+    def _consume_value(self, character):
+        """Advance the current value by one character, True when the character ends a top level value."""
+        if self._value_start is None:
+            if character.isspace():
+                return False
+            if not _VALUE_START.match(character):
+                self._fail(f'a value can not start with {character!r}')
+            self._value_start = self._position
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif character == '\\':
+                self._escaped = True
+            elif character == '"':
+                self._in_string = False
+                if self._depth == 0:
+                    # a top level string ends with its closing quote
+                    self._position += 1
+                    return True
+            return False
+        if character == '"':
+            self._in_string = self._depth > 0 or self._position == self._value_start
+            if not self._in_string:
+                self._fail('unexpected quote inside a value')
+        elif character in '{[':
+            self._depth += 1
+        elif character in '}]' and self._depth > 0:
+            self._depth -= 1
+            if self._depth == 0:
+                self._position += 1
+                return True
+        elif character in ',}' and self._depth == 0:
+            # end of a number, true, false or null
+            return True
+        return False
+
+    def _finish_value(self, end):
+        text = self._buffer[self._value_start:end]
+        try:
+            value = json.loads(text, strict=False)
+        except json.JSONDecodeError:
+            self._fail(f'invalid value {text.strip()!r} for key {self._key!r}')
+        self.values[self._key] = value
+        self._state = 'after_value'
+        self._expect_key = False
+        return self._key, value
+
+    def _check_keys(self):
+        for key in self.expected_keys:
+            if key not in self.values:
+                self._fail(f'expected key `{key}` to be present, but got {self.values}')
+        self.done = True
+
+    def close(self):
+        """
+        Call at the end of the stream, returns the parsed object. If the stream
+        stopped before the object was closed (eg. max_tokens reached), the text is
+        handed to StructuredOutputParser's own lenient parsing, so the result is
+        the same as `output_parser.parse()` on the whole response.
+        """
+        if self.done:
+            return self.values
+        return parse_and_check_json_markdown(self._buffer, self.expected_keys)
+
+
+def stream_structured(chat, messages, expected_keys):
+    """
+    Stream `chat` on `messages`, yielding each `(key, value)` as soon as it's
+    complete. On malformed output the model stream is closed right away (so no
+    more tokens are generated) and OutputParserException is raised. The chat
+    model cache is used like `invoke()` would (see `stream_with_cache`).
+    """
+    parser = StreamingJSONParser(expected_keys)
+    chunks = stream_with_cache(chat, messages)
+    try:
+        for chunk in chunks:
+            yield from parser.feed(chunk.content)
+            if parser.done:
+                break
+        # a truncated object can still be parsed leniently at the end
+        for key, value in parser.close().items():
+            if key not in parser.values:
+                yield key, value
+        # the few tokens after the object (eg. the closing fence) are read too, so the whole response gets cached
+        for _ in chunks:
+            pass
+    finally:
+        chunks.close()
+
+
+# token streams shaped like chat model answers to the review prompt (split where the tokenizer splits), plus malformed ones
+RECORDED_STREAMS = {
+    'fenced': ['```', 'json', '\n', '{\n', '\t', '"', 'satisfied', '":', ' true', ',\n', '\t', '"', 'keywords', '":', ' "', 'fast', ',', ' professional', ',', ' responsive', '"\n', '}\n', '```'],
+    'bare': ['{"', 'satisfied', '":', ' false', ', "', 'keywords', '":', ' "', 'late', ', ', 'buggy', ', ', 'unresponsive', '"}'],
+    'escapes': ['```json\n{', '"keywords": "', 'said \\"', 'wow\\"', ', {great}', '", ', '"satisfied": ', 'null', '}\n```'],
+    'nested': ['{"satisfied": true, "keywords": ', '["', 'clean', '", "', 'quick', '"], "extra": {"a": [1, ', '2]}}'],
+    'python literal': ['```json\n{\n\t"satisfied": ', 'True', ',\n\t"keywords": "great, quick, clean"\n}\n```'],
+    'missing key': ['{"satisfied": true', '}'],
+    'prose': ['The customer seems ', 'very happy with the service, ' * 10, 'so I would say yes.'],
+    'truncated': ['```json\n{"satisfied": true, "keywords": "gr'],
+}
+
+
+def replay(name, tokens, expected_keys=('satisfied', 'keywords')):
+    """Feed a recorded stream, return `(values or error, tokens consumed, token index of each field)`."""
+    parser = StreamingJSONParser(expected_keys)
+    fields = {}
+    for consumed, token in enumerate(tokens, start=1):
+        try:
+            for key, _ in parser.feed(token):
+                fields[key] = consumed
+        except OutputParserException as error:
+            return error, consumed, fields
+        if parser.done:
+            break
+    try:
+        return parser.close(), consumed, fields
+    except OutputParserException as error:
+        return error, consumed, fields
+
+
+def check_recorded_streams():
+    response_schemas = [
+        ResponseSchema(name='satisfied', description='Was the customer satisfied?'),
+        ResponseSchema(name='keywords', description='The 3 most relevant keywords'),
+    ]
+    output_parser = StructuredOutputParser.from_response_schemas(response_schemas)
+    for name, tokens in RECORDED_STREAMS.items():
+        result, consumed, fields = replay(name, tokens)
+        try:
+            expected = output_parser.parse(''.join(tokens))
+        except OutputParserException as error:
+            expected = error
+        assert isinstance(result, OutputParserException) == isinstance(expected, OutputParserException), name
+        assert isinstance(result, OutputParserException) or result == expected, name
+        outcome = 'failed fast' if isinstance(result, OutputParserException) else 'parsed'
+        print(f'{name:<15} | {outcome:<11} | {consumed:>3}/{len(tokens):<3} tokens | fields at token {fields}')
+
+
+def check_cached_stream():
+    """A streamed answer is cached like an invoked one: the second stream and invoke() replay it."""
+    from utils.cache import ResponseCache
+    from utils.classify import FakeReviewModel
+    chat = FakeReviewModel(latency=0.0, cache=ResponseCache(':memory:'))
+    prompt = 'text: great and fast service'
+    streamed = [dict(stream_structured(chat, prompt, ['satisfied', 'keywords'])) for _ in range(2)]
+    invoked = chat.invoke(prompt).content
+    assert streamed[0] == streamed[1] and chat.calls == 1, (streamed, chat.calls)
+    assert invoked == chat._reply([HumanMessage(content=prompt)]), invoked
+    print(f'2 streams and 1 invoke | {chat.calls} model call | cache {chat.cache.stats()}')
+
+
+def benchmark(repeat=2000):
+    tokens = RECORDED_STREAMS['fenced']
+    started = time.perf_counter()
+    for _ in range(repeat):
+        parser = StreamingJSONParser(['satisfied', 'keywords'])
+        for token in tokens:
+            parser.feed(token)
+        parser.close()
+    print(f'incremental parse | {(time.perf_counter() - started) / repeat * 1e6:8.2f} µs per response')
+
+
+if __name__ == '__main__':
+    # python -m utils.structured
+    check_recorded_streams()
+    check_cached_stream()
+    benchmark(*(int(argument) for argument in sys.argv[1:2]))
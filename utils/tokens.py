@@ -0,0 +1,61 @@
+import tiktoken
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name='cl100k_base'):
+    """Load a tiktoken encoding once per process (loading it reads and parses the whole BPE file)."""
+    return tiktoken.get_encoding(encoding_name)
+
+
+class TokenCounter:
+    """Token counts cached per text (least recently used ones are dropped above `max_entries`)."""
+
+    def __init__(self, encoding_name='cl100k_base', max_entries=100_000):
+        self.encoding = get_encoding(encoding_name)
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, text, count):
+        self._counts[text] = count
+        if len(self._counts) > self.max_entries:
+            self._counts.popitem(last=False)
+
+    def count(self, text):
+        with self._lock:
+            if text in self._counts:
+                self._counts.move_to_end(text)
+                return self._counts[text]
+        count = len(self.encoding.encode_ordinary(text))
+        with self._lock:
+            self._store(text, count)
+        return count
+
+    def count_batch(self, texts):
+        """Counts of many texts, encoding the ones not seen yet in a single (multi-threaded) tiktoken batch."""
+        with self._lock:
+            counts = {text: self._counts[text] for text in texts if text in self._counts}
+        missing = list(dict.fromkeys(text for text in texts if text not in counts))
+        if missing:
+            encoded = self.encoding.encode_ordinary_batch(missing)
+            with self._lock:
+                for text, tokens in zip(missing, encoded):
+                    counts[text] = len(tokens)
+                    self._store(text, len(tokens))
+        return [counts[text] for text in texts]
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(encoding_name='cl100k_base'):
+    return TokenCounter(encoding_name)
+
+
+def count_tokens(text, encoding_name='cl100k_base'):
+    return get_token_counter(encoding_name).count(text)
+
+
+def count_tokens_batch(texts, encoding_name='cl100k_base'):
+    return get_token_counter(encoding_name).count_batch(texts)
@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import uuid
+import numpy as np
+from langchain.schema import Document
+from langchain.vectorstores.base import VectorStore
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first, without sorting the whole array."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class IVFIndex:
+    """
+    Inverted file index: vectors are clustered with k-means into `nlist` lists and
+    a query only scores the vectors of its `nprobe` closest lists. Recall goes up
+    with `nprobe`, latency goes down with `nlist`.
+    """
+
+    def __init__(self, nlist=256, nprobe=8, iterations=10, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.lists = None
+
+    def train(self, vectors):
+        if not len(vectors):
+            self.centroids = np.empty((0, vectors.shape[1]), dtype=np.float32)
+            self.lists = []
+            return
+        rng = np.random.default_rng(self.seed)
+        nlist = min(self.nlist, len(vectors))
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignments = self._nearest_blocks(sample, centroids)
+            # per-list means in one pass: sort by list, then sum each contiguous run
+            order = np.argsort(assignments, kind='stable')
+            counts = np.bincount(assignments, minlength=nlist)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            non_empty = counts > 0
+            sums = np.add.reduceat(sample[order], starts[non_empty], axis=0)
+            centroids[non_empty] = sums / counts[non_empty, None]
+        self.centroids = centroids
+        self.assign(vectors)
+
+    @staticmethod
+    def _nearest(vectors, centroids):
+        # argmin of squared euclidean distance, dropping the constant |x|^2 term
+        return np.argmax(vectors @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+
+    @classmethod
+    def _nearest_blocks(cls, vectors, centroids, max_scores=1 << 24):
+        """`_nearest()` over blocks of rows, so the score matrix stays under `max_scores` floats (64 MB)."""
+        if not len(vectors):
+            return np.empty(0, dtype=np.int64)
+        rows = max(1, max_scores // max(len(centroids), 1))
+        return np.concatenate([
+            cls._nearest(vectors[start:start + rows], centroids)
+            for start in range(0, len(vectors), rows)
+        ])
+
+    def assign(self, vectors):
+        assignments = self._nearest_blocks(vectors, self.centroids)
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def candidates(self, query):
+        if not len(self.centroids):
+            # trained on an empty store
+            return np.empty(0, dtype=np.int64)
+        probes = top_k(self.centroids @ query - 0.5 * (self.centroids ** 2).sum(axis=1), self.nprobe)
+        return np.concatenate([self.lists[i] for i in probes])
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process vector store keeping all the vectors in one contiguous float32
+    matrix, so a query is a single matrix-vector product plus a partial sort.
+    With `metric='cosine'` vectors are normalized on insert and the dot product
+    is the cosine similarity. Call `build_index()` to switch large stores to an
+    approximate IVF search.
+    """
+
+    def __init__(self, embedding, metric='cosine'):
+        self.embedding = embedding
+        self.metric = metric
+        self.index = None
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._count = 0
+        self._ids = []
+        self._rows = {}
+        self._texts = []
+        self._metadatas = []
+        self._index_dirty = False
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def vectors(self):
+        return self._vectors[:self._count]
+
+    def _prepare(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.metric == 'cosine':
+            norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors
+
+    def add_vectors(self, vectors, texts, metadatas=None, ids=None):
+        if not len(texts):
+            return []
+        vectors = self._prepare(vectors)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        needed = self._count + len(vectors)
+        if self._count and self._vectors.shape[1] != vectors.shape[1]:
+            raise ValueError(f'Expected vectors of size {self._vectors.shape[1]}, got {vectors.shape[1]}')
+        if needed > self._vectors.shape[0] or self._vectors.shape[1] != vectors.shape[1]:
+            grown = np.empty((max(needed, 2 * self._vectors.shape[0], 1024), vectors.shape[1]), dtype=np.float32)
+            if self._count:
+                grown[:self._count] = self._vectors[:self._count]
+            self._vectors = grown
+        self._vectors[self._count:needed] = vectors
+        for row, (id_, text, metadata) in enumerate(zip(ids, texts, metadatas), start=self._count):
+            self._rows[id_] = row
+            self._ids.append(id_)
+            self._texts.append(text)
+            self._metadatas.append(metadata)
+        self._count = needed
+        self._index_dirty = self.index is not None
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            # nothing to embed, don't call the provider
+            return []
+        return self.add_vectors(self.embedding.embed_documents(texts), texts, metadatas, ids)
+
+    def delete(self, ids=None, **kwargs):
+        # swap each deleted row with the last one, so the matrix stays contiguous (unknown ids are skipped)
+        for id_ in ids or []:
+            row = self._rows.pop(id_, None)
+            if row is None:
+                continue
+            last = self._count - 1
+            if row != last:
+                self._vectors[row] = self._vectors[last]
+                self._ids[row] = self._ids[last]
+                self._texts[row] = self._texts[last]
+                self._metadatas[row] = self._metadatas[last]
+                self._rows[self._ids[row]] = row
+            self._ids.pop()
+            self._texts.pop()
+            self._metadatas.pop()
+            self._count = last
+        self._index_dirty = self.index is not None
+        return True
+
+    def build_index(self, nlist=256, nprobe=8):
+        self.index = IVFIndex(nlist=nlist, nprobe=nprobe)
+        self.index.train(self.vectors)
+        self._index_dirty = False
+
+    def search_vector(self, vector, k=4, exact=False):
+        """Return `(rows, scores)` of the k most similar stored vectors."""
+        if not self._count:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = self._prepare(vector)
+        if self.index is None or exact:
+            scores = self.vectors @ query
+            rows = top_k(scores, k)
+            return rows, scores[rows]
+        if self._index_dirty:
+            if len(self.index.centroids):
+                self.index.assign(self.vectors)
+            else:
+                # the index was built on an empty store, there are no lists to assign to yet
+                self.index.train(self.vectors)
+            self._index_dirty = False
+        candidates = self.index.candidates(query)
+        scores = self._vectors[candidates] @ query
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, **kwargs):
+        rows, scores = self.search_vector(embedding, k)
+        return [
+            (Document(page_content=self._texts[row], metadata=self._metadatas[row]), float(score))
+            for row, score in zip(rows, scores)
+        ]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # scores are similarities (higher is better), cosine ones live in [-1, 1]
+        if self.metric == 'cosine':
+            return lambda score: (score + 1) / 2
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, metric='cosine', **kwargs):
+        store = cls(embedding, metric=metric)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'vectors.npy'), self.vectors)
+        with open(os.path.join(directory, 'documents.json'), 'w') as documents_file:
+            json.dump({
+                'metric': self.metric,
+                'ids': self._ids,
+                'texts': self._texts,
+                'metadatas': self._metadatas,
+                'index': None if self.index is None else {'nlist': self.index.nlist, 'nprobe': self.index.nprobe},
+            }, documents_file)
+        if self.index is not None:
+            np.save(os.path.join(directory, 'centroids.npy'), self.index.centroids)
+
+    @classmethod
+    def load(cls, directory, embedding):
+        with open(os.path.join(directory, 'documents.json')) as documents_file:
+            data = json.load(documents_file)
+        store = cls(embedding, metric=data['metric'])
+        # vectors were normalized before saving, so they are copied in as they are
+        store._vectors = np.load(os.path.join(directory, 'vectors.npy'))
+        store._count = len(store._vectors)
+        store._ids = data['ids']
+        store._texts = data['texts']
+        store._metadatas = data['metadatas']
+        store._rows = {id_: row for row, id_ in enumerate(store._ids)}
+        if data['index'] is not None:
+            store.index = IVFIndex(**data['index'])
+            store.index.centroids = np.load(os.path.join(directory, 'centroids.npy'))
+            store.index.assign(store.vectors)
+        return store
+
+
+def benchmark(sizes=(10_000, 100_000, 1_000_000), dim=64, queries=100, k=10):
+    """Compare exact and IVF search latency and recall@k on clustered random data."""
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        centers = rng.normal(size=(256, dim)).astype(np.float32)
+        data = centers[rng.integers(0, 256, size)] + 0.5 * rng.normal(size=(size, dim)).astype(np.float32)
+        store = NumpyVectorStore(embedding=None)
+        store.add_vectors(data, [''] * size, ids=[str(i) for i in range(size)])
+        query_vectors = data[rng.integers(0, size, queries)] + 0.1 * rng.normal(size=(queries, dim)).astype(np.float32)
+        started = time.perf_counter()
+        truth = [set(store.search_vector(query, k, exact=True)[0]) for query in query_vectors]
+        exact_ms = (time.perf_counter() - started) * 1000 / queries
+        print(f'{size:>9} vectors | exact          | {exact_ms:8.3f} ms/query | recall@{k} 1.000')
+        store.build_index(nlist=int(4 * np.sqrt(size)))
+        for nprobe in (1, 4, 16, 64):
+            store.index.nprobe = nprobe
+            started = time.perf_counter()
+            found = [set(store.search_vector(query, k)[0]) for query in query_vectors]
+            ivf_ms = (time.perf_counter() - started) * 1000 / queries
+            recall = np.mean([len(f & t) / k for f, t in zip(found, truth)])
+            print(f'{size:>9} vectors | ivf nprobe={nprobe:<4}| {ivf_ms:8.3f} ms/query | recall@{k} {recall:.3f}')
+
+
+def check_empty():
+    """Empty inputs and empty stores, with and without an index, return nothing instead of raising."""
+    from utils.embeddings import HashingEmbeddings
+    for indexed in (False, True):
+        store = NumpyVectorStore(HashingEmbeddings())
+        assert store.add_texts([]) == [] and store.add_vectors([], []) == []
+        if indexed:
+            store.build_index()
+        assert store.similarity_search('anything') == []
+        ids = store.add_texts(['first text', 'second text'])
+        assert [doc.page_content for doc in store.similarity_search('first', k=1)] == ['first text']
+        store.delete(ids)
+        assert store.similarity_search('first') == []
+    print('empty stores and inputs | ok')
+
+
+if __name__ == '__main__':
+    # python -m utils.vectorstore [size ...]
+    check_empty()
+    benchmark(tuple(int(size) for size in sys.argv[1:]) or (10_000, 100_000, 1_000_000))
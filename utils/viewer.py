@@ -0,0 +1,76 @@
+import time
+import itertools
+import streamlit as st
+from collections import OrderedDict
+
+
+def _move(key, step):
+    st.session_state[key]['page'] = max(0, st.session_state[key]['page'] + step)
+
+
+def _read(state, count):
+    started = time.perf_counter()
+    docs = list(itertools.islice(state['iterator'], count))
+    state['elapsed'] += time.perf_counter() - started
+    state['position'] += len(docs)
+    state['loaded'] = max(state['loaded'], state['position'])
+    if len(docs) < count:
+        state['done'] = True
+    return docs
+
+
+def _fetch_page(state, loader, page, page_size, window):
+    if page in state['pages']:
+        state['pages'].move_to_end(page)
+        return state['pages'][page]
+    start = page * page_size
+    if state['position'] > start:
+        # the page was evicted from the window, so read the source again from the top
+        state['iterator'] = loader.lazy_load()
+        state['position'] = 0
+    _read(state, start - state['position'])
+    docs = _read(state, page_size)
+    state['pages'][page] = docs
+    while len(state['pages']) > window:
+        state['pages'].popitem(last=False)
+    return docs
+
+
+def document_viewer(key, loader, source_id, page_size=20, window=5):
+    """
+    Render the documents of `loader` one page at a time, pulling them from its
+    `lazy_load()` iterator only when a page is requested. At most `window` pages
+    are kept in the session state, so huge files never sit in memory at once.
+    """
+    state = st.session_state.get(key)
+    if state is None or state['source_id'] != source_id:
+        state = st.session_state[key] = {
+            'source_id': source_id,
+            'iterator': loader.lazy_load(),
+            'pages': OrderedDict(),
+            'page': 0,
+            'position': 0,
+            'loaded': 0,
+            'elapsed': 0.0,
+            'done': False,
+        }
+
+    docs = _fetch_page(state, loader, state['page'], page_size, window)
+
+    if not docs and state['page'] > 0:
+        # we went past the last page, step back
+        state['page'] -= 1
+        docs = _fetch_page(state, loader, state['page'], page_size, window)
+
+    st.write(docs)
+
+    total = f"{state['loaded']} documents" if state['done'] else f"{state['loaded']}+ documents so far"
+    st.caption(f"Page {state['page'] + 1} · {total} · loaded in {state['elapsed']:.2f}s")
+
+    previous_column, next_column = st.columns(2)
+
+    previous_column.button('⬅️ Previous', key=f'{key}_previous', on_click=_move, args=(key, -1), disabled=state['page'] == 0)
+
+    last_page = state['done'] and (state['page'] + 1) * page_size >= state['loaded']
+
+    next_column.button('Next ➡️', key=f'{key}_next', on_click=_move, args=(key, 1), disabled=last_page)
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import aiohttp
+import threading
+from bs4 import BeautifulSoup
+from bs4.builder import ParserRejectedMarkup
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer
+from http.server import BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from langchain.schema import Document
+from langchain.document_loaders import WebBaseLoader
+from langchain.document_loaders.base import BaseLoader
+
+
+class HTTPCache:
+    """
+    On-disk cache of fetched pages: the body of each URL plus the ETag and
+    Last-Modified validators, so the next fetch can be a conditional request
+    and a `304 Not Modified` answer reuses the stored body.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def get(self, url):
+        """Return `(headers, body)` for a cached URL, or None."""
+        path = self._path(url)
+        try:
+            with open(path + '.json') as headers_file:
+                headers = json.load(headers_file)
+            with open(path + '.body', 'rb') as body_file:
+                return headers, body_file.read()
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url, headers, body):
+        path = self._path(url)
+        with open(path + '.body', 'wb') as body_file:
+            body_file.write(body)
+        # the validators are written last, so they never point to a partial body
+        with open(path + '.json', 'w') as headers_file:
+            json.dump(headers, headers_file)
+
+
+def _build_metadata(soup, url):
+    # same metadata as WebBaseLoader
+    metadata = {'source': url}
+    if title := soup.find('title'):
+        metadata['title'] = title.get_text()
+    if description := soup.find('meta', attrs={'name': 'description'}):
+        metadata['description'] = description.get('content', 'No description found.')
+    if html := soup.find('html'):
+        metadata['language'] = html.get('lang', 'No language found.')
+    return metadata
+
+
+def _parse(url, body, charset, parser, bs_get_text_kwargs):
+    soup = BeautifulSoup(body.decode(charset or 'utf-8', errors='replace'), parser)
+    return Document(page_content=soup.get_text(**bs_get_text_kwargs), metadata=_build_metadata(soup, url))
+
+
+class ConcurrentWebLoader(BaseLoader):
+    """
+    Batch version of WebBaseLoader: pages are fetched by an asyncio client with
+    at most `max_concurrency` requests in flight over pooled keep-alive
+    connections, revalidated against an HTTPCache with If-None-Match and
+    If-Modified-Since, and parsed with BeautifulSoup in a thread pool while the
+    other downloads go on. Documents come back in the order of `urls`, failed
+    URLs (network errors, unknown charsets, markup the parser rejects) are left
+    out and listed in `errors`.
+    """
+
+    def __init__(self, urls, max_concurrency=16, cache_directory='.cache/web', parse_workers=4, timeout=30,
+                 header_template=None, parser='html.parser', bs_get_text_kwargs=None):
+        self.urls = [urls] if isinstance(urls, str) else list(urls)
+        self.max_concurrency = max_concurrency
+        self.cache = HTTPCache(cache_directory) if cache_directory else None
+        self.parse_workers = parse_workers
+        self.timeout = timeout
+        self.header_template = header_template or {'User-Agent': 'Mozilla/5.0 (compatible; learn-langchain)'}
+        self.parser = parser
+        self.bs_get_text_kwargs = bs_get_text_kwargs or {}
+        self.errors = {}
+        self.stats = {}
+
+    async def _fetch(self, session, semaphore, url):
+        cached = self.cache.get(url) if self.cache else None
+        headers = {}
+        if cached is not None:
+            if cached[0].get('etag'):
+                headers['If-None-Match'] = cached[0]['etag']
+            if cached[0].get('last_modified'):
+                headers['If-Modified-Since'] = cached[0]['last_modified']
+        async with semaphore:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and cached is not None:
+                    self.stats['not_modified'] += 1
+                    return cached[0].get('charset'), cached[1]
+                response.raise_for_status()
+                body = await response.read()
+        self.stats['fetched'] += 1
+        self.stats['bytes'] += len(body)
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'charset': response.charset,
+        }
+        if self.cache and (validators['etag'] or validators['last_modified']):
+            self.cache.put(url, validators, body)
+        return response.charset, body
+
+    async def _load(self, url, session, semaphore, executor):
+        try:
+            charset, body = await self._fetch(session, semaphore, url)
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, _parse, url, body, charset, self.parser, self.bs_get_text_kwargs,
+            )
+        # LookupError is an unknown charset, the others markup the parser can't handle: only this URL fails
+        except (aiohttp.ClientError, asyncio.TimeoutError, LookupError, ValueError, AssertionError, ParserRejectedMarkup) as error:
+            self.errors[url] = str(error) or type(error).__name__
+            return None
+
+    async def aload_documents(self):
+        self.errors = {}
+        self.stats = {'fetched': 0, 'not_modified': 0, 'bytes': 0, 'elapsed': 0.0}
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        with ThreadPoolExecutor(self.parse_workers) as executor:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.header_template) as session:
+                docs = await asyncio.gather(*[self._load(url, session, semaphore, executor) for url in self.urls])
+        self.stats['elapsed'] = time.perf_counter() - started
+        return [doc for doc in docs if doc is not None]
+
+    def load(self):
+        return asyncio.run(self.aload_documents())
+
+    def lazy_load(self):
+        yield from self.load()
+
+
+class _SamplePageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    last_modified = formatdate(0, usegmt=True)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        page = self.path.strip('/')
+        # pages under /bad-charset/ declare an encoding that doesn't exist
+        charset = 'x-unknown' if page.startswith('bad-charset/') else 'utf-8'
+        etag = f'"{page}-v1"'
+        self.server.requests += 1
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        paragraphs = ''.join(f'<p>Paragraph {i} of page {page}: the quick brown fox jumps over the lazy dog.</p>' for i in range(50))
+        body = (
+            f'<html lang="en"><head><title>Page {page}</title>'
+            f'<meta name="description" content="Sample page {page}"></head><body>{paragraphs}</body></html>'
+        ).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', f'text/html; charset={charset}')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.last_modified)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_sample_pages(latency=0.05):
+    """Start a local HTTP server (in a daemon thread) serving a sample page on any path, with ETags."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SamplePageHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check_errors(page_count=10):
+    """A page that can't be decoded is listed in `errors` without failing the rest of the batch."""
+    server = serve_sample_pages(latency=0)
+    try:
+        urls = [f'http://127.0.0.1:{server.server_port}/check/{i}' for i in range(page_count)]
+        bad_url = f'http://127.0.0.1:{server.server_port}/bad-charset/0'
+        loader = ConcurrentWebLoader(urls[:5] + [bad_url] + urls[5:], cache_directory=None)
+        docs = loader.load()
+        assert [doc.metadata['source'] for doc in docs] == urls
+        assert list(loader.errors) == [bad_url], loader.errors
+    finally:
+        server.shutdown()
+
+
+def benchmark(page_counts=(100, 500), latency=0.05):
+    server = serve_sample_pages(latency)
+    try:
+        for page_count in page_counts:
+            urls = [f'http://127.0.0.1:{server.server_port}/{page_count}/{i}' for i in range(page_count)]
+            cache_directory = os.path.join('.cache', 'web-benchmark', str(page_count))
+            loaders = [
+                ('WebBaseLoader', WebBaseLoader(urls[:50])),
+                ('concurrent cold', ConcurrentWebLoader(urls, cache_directory=cache_directory)),
+                ('concurrent warm', ConcurrentWebLoader(urls, cache_directory=cache_directory)),
+            ]
+            for name, loader in loaders:
+                started = time.perf_counter()
+                docs = loader.load()
+                elapsed = time.perf_counter() - started
+                print(
+                    f'{page_count:>5} pages | {name:<15} | {len(docs):>5} docs | {elapsed:6.2f}s'
+                    f' | {len(docs) / elapsed:8.1f} pages/s | {getattr(loader, "stats", "")}'
+                )
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    # python -m utils.web [page count ...]
+    check_errors()
+    benchmark(tuple(int(page_count) for page_count in sys.argv[1:]) or (100, 500))